@@ -0,0 +1,59 @@
+"""
+In-memory stand-in for the Telegram gateway, for benchmarks and simulations.
+
+``install(fake)`` swaps the RPC methods on the shared ``gateway_client.GATEWAY``
+instance, so services, worker and main (which all import that object) talk to
+the fake without any code changes. Every send is recorded.
+"""
+from __future__ import annotations
+import asyncio, itertools
+from typing import NamedTuple
+
+from gateway_client import GATEWAY
+
+class SentMessage(NamedTuple):
+    account_id: str
+    user_id: int
+    message: str
+    media_id: str | None
+
+class FakeGateway:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: list[SentMessage] = []
+        self._message_ids = itertools.count(1)
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, account_id: str, user_id: int, message: str, media_id: str | None = None) -> int:
+        await self._delay()
+        self.sent.append(SentMessage(account_id, user_id, message, media_id))
+        return next(self._message_ids)
+
+    async def get_user_info(self, account_id: str, user_id: int) -> dict:
+        await self._delay()
+        return {"id": user_id, "first_name": "Bench", "last_name": str(user_id), "username": None,
+                "phone": None, "is_bot": False, "is_verified": False, "full_name": f"Bench {user_id}"}
+
+    async def resolve_user_identifier(self, account_id: str, identifier: str) -> int:
+        await self._delay()
+        return abs(hash(identifier)) % 10**10
+
+    async def ensure_reply_handler(self, account_id: str) -> None:
+        return None
+
+    async def status(self) -> dict:
+        return {"clients": 0, "connected": 0, "logins_pending": 0, "reply_handlers": 0}
+
+METHODS = ("send_message", "get_user_info", "resolve_user_identifier", "ensure_reply_handler", "status")
+
+def install(fake: FakeGateway) -> FakeGateway:
+    for name in METHODS:
+        setattr(GATEWAY, name, getattr(fake, name))
+    return fake
+
+def uninstall():
+    for name in METHODS:
+        GATEWAY.__dict__.pop(name, None)
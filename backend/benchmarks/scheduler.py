@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Benchmark: scheduler, worker tick and list endpoints at several scales.
+
+For each scale (number of contacts) it seeds synthetic users, accounts,
+campaigns with steps and contacts, then times:
+
+- ``due_contacts`` for every active campaign of one account
+- ``forecast_due`` for one account
+- bulk set-based operations (``defer_outside_window``, ``shape_due``,
+  ``reschedule_campaign``), each rolled back so runs see the same data
+- ``/api/dashboard``, ``/api/contacts`` and ``/api/contacts/search`` (exact
+  and misspelled) for one user
+- a full worker tick (reply handlers and one send cycle) with a fake
+  Telegram gateway
+
+    python -m benchmarks.scheduler --scales 10000 100000 1000000 --out scheduler.json
+
+Results are JSON (timings in ms plus SQL statements per run) tagged with the
+git commit, so runs from two commits can be diffed. Needs a dedicated local
+Postgres with the schema migrated: it refuses to run when non-benchmark users
+exist, because a tick sends for every active account. Seeded rows are removed
+afterwards unless --keep is given.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, inspect, json, math, statistics, subprocess, time
+from datetime import datetime
+from sqlalchemy import select, text
+
+from db import SessionLocal, engine
+from models import Account, Campaign, new_id
+from auth import create_access_token, get_password_hash
+from query_stats import profile_scope
+from services import due_contacts, forecast_due, defer_outside_window, shape_due, reschedule_campaign
+from health import WORKER_ID
+from campaign_cache import CAMPAIGNS
+from benchmarks.fake_telegram import FakeGateway, install
+
+EMAIL_DOMAIN = "bench.invalid"
+CONTACTS_PER_USER = 50_000
+ACCOUNTS_PER_USER = 3
+CAMPAIGNS_PER_ACCOUNT = 2
+STEPS_PER_CAMPAIGN = 3
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_user_ids(conn) -> list[str]:
+    return [str(r[0]) for r in conn.execute(text("SELECT id FROM users WHERE email LIKE :p"), {"p": f"%@{EMAIL_DOMAIN}"})]
+
+def check_dedicated_db(conn):
+    foreign = conn.execute(text("SELECT count(*) FROM users WHERE email NOT LIKE :p"),
+                           {"p": f"%@{EMAIL_DOMAIN}"}).scalar()
+    if foreign:
+        raise SystemExit(f"❌ {foreign} non-benchmark users found: run against a dedicated database")
+
+def seed(conn, contacts: int, fresh: bool = False) -> list[str]:
+    """Insert the synthetic tenant data; returns the user ids.
+
+    ``fresh`` enrolls every contact at step 1 with nothing sent yet. Contact
+    ids derive from their sequence number, so ordering ties break the same way
+    on every run."""
+    password = get_password_hash("bench")
+    n_users = max(1, contacts // CONTACTS_PER_USER)
+    users, accounts, campaigns, steps = [], [], [], []
+    for u in range(n_users):
+        user_id = new_id()
+        users.append({"id": user_id, "email": f"bench-{u}@{EMAIL_DOMAIN}", "pw": password})
+        for a in range(ACCOUNTS_PER_USER):
+            account_id = new_id()
+            accounts.append({"id": account_id, "user_id": user_id, "phone": f"+1555{u:04d}{a:02d}"})
+            for c in range(CAMPAIGNS_PER_ACCOUNT):
+                campaign_id = new_id()
+                # Every other campaign has a sending window, so deferral has work
+                windowed = c % 2 == 1
+                campaigns.append({"id": campaign_id, "user_id": user_id, "account_id": account_id,
+                                  "name": f"Bench {u}/{a}/{c}", "priority": c + 1,
+                                  "tz": "America/Sao_Paulo" if windowed else None,
+                                  "start": 9 if windowed else None, "end": 17 if windowed else None})
+                for s in range(1, STEPS_PER_CAMPAIGN + 1):
+                    steps.append({"id": new_id(), "campaign_id": campaign_id, "step": s,
+                                  "message": "Hi {first_name|there}, this is step {step}"})
+    conn.execute(text("""
+        INSERT INTO users (id, email, hashed_password, is_active, created_at, updated_at)
+        VALUES (CAST(:id AS uuid), :email, :pw, true, now(), now())
+    """), users)
+    conn.execute(text("""
+        INSERT INTO accounts (id, user_id, phone, status, send_rate_per_minute, created_at, updated_at)
+        VALUES (CAST(:id AS uuid), CAST(:user_id AS uuid), :phone, 'active', 60, now(), now())
+    """), accounts)
+    conn.execute(text("""
+        INSERT INTO campaigns (id, user_id, account_id, name, interval_seconds, max_steps, active, priority,
+                               timezone, send_days, send_hour_start, send_hour_end)
+        VALUES (CAST(:id AS uuid), CAST(:user_id AS uuid), CAST(:account_id AS uuid), :name, 86400, 3, true,
+                :priority, :tz, 127, :start, :end)
+    """), campaigns)
+    conn.execute(text("""
+        INSERT INTO campaign_steps (id, campaign_id, step_number, message)
+        VALUES (CAST(:id AS uuid), CAST(:campaign_id AS uuid), :step, :message)
+    """), steps)
+    # Contacts in one set-based INSERT: 1% never sent, 5% overdue by up to an
+    # hour, 10% replied, the rest due over the coming week
+    conn.execute(text("""
+        WITH cps AS (
+            SELECT id, user_id, account_id, row_number() OVER (ORDER BY id) - 1 AS idx
+            FROM campaigns WHERE user_id = ANY(CAST(:users AS uuid[]))
+        ), clock AS (SELECT now() AT TIME ZONE 'utc' AS now)
+        INSERT INTO contacts (id, user_id, account_id, campaign_id, telegram_user_id, name, first_name, username,
+                              replied, current_step, last_message_at, next_due_at)
+        SELECT CAST(md5('bench' || n) AS uuid), cp.user_id, cp.account_id, cp.id, 1000000000 + n,
+               'Bench ' || n, 'Bench', 'bench' || n,
+               NOT :fresh AND n % 10 = 5,
+               CASE WHEN :fresh THEN 1 ELSE 1 + n % 3 END,
+               CASE WHEN :fresh OR n % 100 = 0 THEN NULL ELSE clock.now - interval '1 day' END,
+               CASE WHEN :fresh OR n % 100 = 0 THEN NULL
+                    WHEN n % 20 = 1 THEN clock.now - make_interval(secs => n % 3600)
+                    ELSE clock.now + make_interval(secs => n % 604800) END
+        FROM generate_series(0, :contacts - 1) AS n
+        CROSS JOIN clock
+        JOIN cps cp ON cp.idx = n % :n_campaigns
+    """), {"users": [u["id"] for u in users], "contacts": contacts, "n_campaigns": len(campaigns),
+          "fresh": fresh})
+    for table in ("users", "accounts", "campaigns", "campaign_steps", "contacts"):
+        conn.execute(text(f"ANALYZE {table}"))
+    return [u["id"] for u in users]
+
+def cleanup(conn, user_ids: list[str]):
+    params = {"users": user_ids}
+    for sql in (
+        "DELETE FROM messages_sent WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        "DELETE FROM user_daily_sends WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        "DELETE FROM messages_received WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        "DELETE FROM segments WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        "DELETE FROM contacts WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        "DELETE FROM tags WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        """DELETE FROM campaign_steps WHERE campaign_id IN
+               (SELECT id FROM campaigns WHERE user_id = ANY(CAST(:users AS uuid[])))""",
+        "DELETE FROM campaigns WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        "DELETE FROM accounts WHERE user_id = ANY(CAST(:users AS uuid[]))",
+        "DELETE FROM users WHERE id = ANY(CAST(:users AS uuid[]))",
+    ):
+        conn.execute(text(sql), params)
+
+async def measure(name: str, fn, runs: int, **extra) -> dict:
+    samples, queries = [], []
+    for _ in range(runs):
+        with profile_scope(f"bench {name}") as stats:
+            start = time.perf_counter()
+            result = fn()
+            if inspect.isawaitable(result):
+                result = await result
+            samples.append((time.perf_counter() - start) * 1000)
+        # API calls run in the TestClient's thread and report their own count
+        queries.append(result if isinstance(result, int) else stats.count)
+    samples.sort()
+    return {
+        "name": name, "runs": runs,
+        "min_ms": round(samples[0], 2),
+        "median_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(samples[math.ceil(0.95 * len(samples)) - 1], 2),
+        "max_ms": round(samples[-1], 2),
+        "queries": max(queries),
+        **extra,
+    }
+
+def _rolled_back(op):
+    def run():
+        with SessionLocal() as db:
+            op(db)
+            db.rollback()
+    return run
+
+async def run_scale(contacts: int, runs: int, tick_runs: int, fake: FakeGateway) -> list[dict]:
+    from fastapi.testclient import TestClient
+    import main, worker
+
+    results = []
+    with SessionLocal() as db:
+        user_email = db.execute(text("SELECT email FROM users WHERE email LIKE :p ORDER BY email LIMIT 1"),
+                                {"p": f"%@{EMAIL_DOMAIN}"}).scalar_one()
+        account = db.execute(select(Account).join(Campaign, Campaign.account_id == Account.id)
+                             .where(Account.status == "active").limit(1)).scalars().first()
+        campaigns = db.execute(select(Campaign).where(Campaign.account_id == account.id,
+                                                      Campaign.active == True)).scalars().all()
+        due = sum(1 for c in campaigns for _ in due_contacts(db, c))
+
+        def due_all():
+            for camp in campaigns:
+                for _ in due_contacts(db, camp):
+                    pass
+        results.append(await measure("due_contacts", due_all, runs, campaigns=len(campaigns), due=due))
+        results.append(await measure("forecast_due", lambda: forecast_due(db, account.id), runs))
+        db.expunge_all()
+
+    results.append(await measure("defer_outside_window",
+                                 _rolled_back(lambda db: defer_outside_window(db, account.id)), runs))
+    results.append(await measure("shape_due", _rolled_back(lambda db: shape_due(db, account)), runs))
+    results.append(await measure("reschedule_campaign",
+                                 _rolled_back(lambda db: reschedule_campaign(db, campaigns[0].id)), runs))
+
+    main.DB_PROFILE_HEADER = True
+    client = TestClient(main.app)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user_email})}"}
+
+    def get(path):
+        def call():
+            response = client.get(path, headers=headers)
+            response.raise_for_status()
+            return int(response.headers["X-DB-Queries"])
+        return call
+    results.append(await measure("api_dashboard", get("/api/dashboard"), runs))
+    results.append(await measure("api_contacts", get("/api/contacts"), runs))
+    results.append(await measure("api_contact_search", get("/api/contacts/search?q=bench42"), runs))
+    results.append(await measure("api_contact_search_typo", get("/api/contacts/search?q=bnech42"), runs))
+
+    sent_before = len(fake.sent)
+    # The tick body: worker.tick opens a scope of its own, which would hide
+    # its statements from the count
+    results.append(await measure("worker_tick", worker._tick, tick_runs))
+    results[-1]["sends"] = len(fake.sent) - sent_before
+    for r in results:
+        r["scale"] = contacts
+    return results
+
+async def main_async(args) -> dict:
+    fake = install(FakeGateway(latency=args.send_latency))
+    results, seeding = [], []
+    with engine.connect() as conn:
+        check_dedicated_db(conn)
+    for contacts in args.scales:
+        with engine.begin() as conn:
+            stale = bench_user_ids(conn)
+            if stale:
+                cleanup(conn, stale)
+        print(f"⏱️ seeding {contacts} contacts...")
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            user_ids = seed(conn, contacts)
+        # Seeded behind the API's back: no NOTIFY tells the worker's cache
+        CAMPAIGNS.invalidate()
+        seeding.append({"scale": contacts, "seconds": round(time.perf_counter() - start, 2)})
+        try:
+            for r in await run_scale(contacts, args.runs, args.tick_runs, fake):
+                print(json.dumps(r))
+                results.append(r)
+        finally:
+            if not args.keep:
+                with engine.begin() as conn:
+                    cleanup(conn, user_ids)
+    with engine.begin() as conn:
+        # Benchmark ticks must not pass for a live worker on /readyz
+        conn.execute(text("DELETE FROM worker_heartbeats WHERE worker_id = :id"), {"id": WORKER_ID})
+    return {"benchmark": "scheduler", "commit": _commit(), "created_at": datetime.utcnow().isoformat(),
+            "seeding": seeding, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--runs", type=int, default=5, help="repetitions of each read-only measurement")
+    parser.add_argument("--tick-runs", type=int, default=3)
+    parser.add_argument("--send-latency", type=float, default=0.0, help="fake gateway latency per call (s)")
+    parser.add_argument("--out", help="write results JSON here (default: stdout only)")
+    parser.add_argument("--keep", action="store_true", help="keep the last scale's seeded rows")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Time-warp simulator: replay days of campaign sequencing in minutes.
+
+Seeds fresh synthetic tenants (every contact enrolled at step 1), swaps the
+scheduling clock for a virtual one and the Telegram gateway for the in-memory
+fake, then runs the worker's send cycle tick by tick. Idle stretches are
+skipped: after each tick the clock jumps straight to the first tick at or
+after the earliest ``next_due_at``. Replies are injected deterministically
+(``--reply-rate``, ``--seed``) after sends.
+
+    python -m benchmarks.timewarp --contacts 100000 --days 30 --out timewarp.json
+
+The report covers throughput (virtual and wall clock), the final step
+distribution, and correctness checks: duplicate (contact, step) sends, gaps in
+a contact's step sequence, sends after a reply, gateway sends without a
+messages_sent row, and contacts still overdue at the end. Same database
+requirements as benchmarks.scheduler.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, json, math, random, time
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+
+import clock
+import services
+from db import SessionLocal, engine
+from models import Account
+from partitions import ensure_partitions
+from services import run_send_cycle
+from benchmarks.fake_telegram import FakeGateway, install
+from benchmarks.scheduler import check_dedicated_db, bench_user_ids, seed, cleanup
+
+class VirtualClock:
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def __call__(self) -> datetime:
+        return self.now
+
+def _next_due(db, now: datetime) -> datetime | None:
+    """Earliest moment any enrolled contact becomes due (``now`` if some already are)"""
+    return db.execute(text("""
+        SELECT MIN(COALESCE(c.next_due_at, :now))
+        FROM contacts c JOIN campaigns cp ON cp.id = c.campaign_id
+        WHERE cp.active AND NOT c.replied AND c.current_step <= cp.max_steps
+    """), {"now": now}).scalar()
+
+def _inject_replies(db, sent_at: datetime, rate: float, rng: random.Random) -> dict[str, datetime]:
+    """Mark a deterministic sample of the contacts messaged at ``sent_at`` as replied"""
+    if rate <= 0:
+        return {}
+    ids = sorted(str(r[0]) for r in db.execute(
+        text("SELECT contact_id FROM messages_sent WHERE sent_at = :t"), {"t": sent_at}))
+    replied = [cid for cid in ids if rng.random() < rate]
+    if replied:
+        db.execute(text("UPDATE contacts SET replied = true WHERE id = ANY(CAST(:ids AS uuid[]))"),
+                   {"ids": replied})
+        db.commit()
+    return {cid: sent_at for cid in replied}
+
+def _checks(db, users: list[str], end: datetime, tick: int, replied_at: dict[str, datetime],
+            gateway_sends: int) -> dict:
+    params = {"users": users}
+    logged = db.execute(text("SELECT count(*) FROM messages_sent WHERE user_id = ANY(CAST(:users AS uuid[]))"),
+                        params).scalar()
+    duplicates = db.execute(text("""
+        SELECT count(*) FROM (
+            SELECT 1 FROM messages_sent WHERE user_id = ANY(CAST(:users AS uuid[]))
+            GROUP BY contact_id, step_number HAVING count(*) > 1
+        ) d
+    """), params).scalar()
+    gaps = db.execute(text("""
+        SELECT count(*) FROM (
+            SELECT 1 FROM messages_sent WHERE user_id = ANY(CAST(:users AS uuid[]))
+            GROUP BY contact_id
+            HAVING min(step_number) <> 1 OR max(step_number) <> count(DISTINCT step_number)
+        ) g
+    """), params).scalar()
+    after_reply = 0
+    if replied_at:
+        rows = db.execute(text("""
+            SELECT contact_id, sent_at FROM messages_sent
+            WHERE contact_id = ANY(CAST(:ids AS uuid[]))
+        """), {"ids": list(replied_at)}).all()
+        after_reply = sum(1 for cid, sent_at in rows if sent_at > replied_at[str(cid)])
+    # Two ticks of slack before calling a contact stuck
+    overdue = db.execute(text("""
+        SELECT count(*) FROM contacts c JOIN campaigns cp ON cp.id = c.campaign_id
+        WHERE c.user_id = ANY(CAST(:users AS uuid[])) AND cp.active AND NOT c.replied
+          AND c.current_step <= cp.max_steps
+          AND COALESCE(c.next_due_at, '-infinity') < :cutoff
+    """), {**params, "cutoff": end - timedelta(seconds=2 * tick)}).scalar()
+    steps = db.execute(text("""
+        SELECT current_step, replied, count(*) FROM contacts
+        WHERE user_id = ANY(CAST(:users AS uuid[]))
+        GROUP BY 1, 2 ORDER BY 1, 2
+    """), params).all()
+    return {
+        "messages_logged": logged,
+        "gateway_sends": gateway_sends,
+        "unlogged_sends": gateway_sends - logged,
+        "duplicate_sends": duplicates,
+        "contacts_with_step_gaps": gaps,
+        "sends_after_reply": after_reply,
+        "overdue_at_end": overdue,
+        "step_distribution": [{"current_step": s, "replied": r, "contacts": n} for s, r, n in steps],
+    }
+
+async def simulate(args) -> dict:
+    fake = install(FakeGateway())
+    services.SEND_JITTER_SECONDS = args.jitter
+    rng = random.Random(args.seed)
+    # Shaping allowances are sized for WORKER_TICK, so virtual ticks use it too
+    tick = services.WORKER_TICK
+    start = datetime.utcnow().replace(microsecond=0)
+    end = start + timedelta(days=args.days)
+    virtual = VirtualClock(start)
+
+    with engine.begin() as conn:
+        check_dedicated_db(conn)
+        stale = bench_user_ids(conn)
+        if stale:
+            cleanup(conn, stale)
+        ensure_partitions(conn, months_ahead=math.ceil(args.days / 28) + 1, now=start)
+        print(f"⏱️ seeding {args.contacts} contacts...")
+        users = seed(conn, args.contacts, fresh=True)
+
+    clock.set_clock(virtual)
+    ticks = skipped = 0
+    replied_at: dict[str, datetime] = {}
+    sends_per_day: dict[str, int] = {}
+    wall_start = time.perf_counter()
+    try:
+        while virtual.now < end:
+            with SessionLocal() as db:
+                accounts = db.execute(select(Account).where(Account.status == "active")).scalars().all()
+            before = len(fake.sent)
+            await run_send_cycle(list(accounts))
+            ticks += 1
+            day = virtual.now.date().isoformat()
+            sends_per_day[day] = sends_per_day.get(day, 0) + len(fake.sent) - before
+            with SessionLocal() as db:
+                if len(fake.sent) > before:
+                    replied_at.update(_inject_replies(db, virtual.now, args.reply_rate, rng))
+                due = _next_due(db, virtual.now)
+            if due is None:
+                break
+            # Jump to the first tick boundary at or after the next due time
+            gap = max(tick, math.ceil((due - virtual.now).total_seconds() / tick) * tick)
+            skipped += gap // tick - 1
+            virtual.now += timedelta(seconds=gap)
+        wall = time.perf_counter() - wall_start
+        simulated_end = min(virtual.now, end)
+        with SessionLocal() as db:
+            checks = _checks(db, users, simulated_end, tick, replied_at, len(fake.sent))
+    finally:
+        clock.set_clock(None)
+        if not args.keep:
+            with engine.begin() as conn:
+                cleanup(conn, users)
+
+    virtual_days = (simulated_end - start).total_seconds() / 86400
+    return {
+        "benchmark": "timewarp",
+        "created_at": datetime.utcnow().isoformat(),
+        "params": {"contacts": args.contacts, "days": args.days, "tick": tick, "reply_rate": args.reply_rate,
+                   "seed": args.seed, "jitter": args.jitter},
+        "ticks_run": ticks,
+        "ticks_skipped": skipped,
+        "wall_seconds": round(wall, 2),
+        "virtual_days": round(virtual_days, 3),
+        "sends": len(fake.sent),
+        "sends_per_wall_second": round(len(fake.sent) / wall, 1) if wall else None,
+        "sends_per_virtual_day": round(len(fake.sent) / virtual_days, 1) if virtual_days else None,
+        "sends_per_day": sends_per_day,
+        "replies_injected": len(replied_at),
+        **checks,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contacts", type=int, default=10_000)
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--reply-rate", type=float, default=0.05, help="chance a messaged contact replies")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="send jitter seconds (non-zero makes shaping use Postgres random())")
+    parser.add_argument("--out", help="write the report JSON here (default: stdout only)")
+    parser.add_argument("--keep", action="store_true", help="keep the simulated rows")
+    args = parser.parse_args()
+
+    report = asyncio.run(simulate(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark: varchar vs native uuid keys on a messages_sent-shaped table.
+
+Loads the same number of rows into three scratch tables (varchar + uuid4,
+uuid + uuid4, uuid + uuid7) with COPY in batches, then reports insert
+throughput and table/primary-key/FK-index sizes as JSON.
+
+    python -m benchmarks.uuid_keys --rows 10000000 --out uuid_keys.json
+
+The scratch tables are dropped afterwards unless --keep is given.
+"""
+
+from __future__ import annotations
+import argparse, io, json, time, uuid
+from datetime import datetime
+from sqlalchemy import text
+
+from db import engine
+from models import uuid7
+
+VARIANTS = {
+    "varchar_uuid4": ("VARCHAR", lambda: str(uuid.uuid4())),
+    "uuid_uuid4": ("UUID", lambda: str(uuid.uuid4())),
+    "uuid_uuid7": ("UUID", lambda: str(uuid7())),
+}
+
+def run_variant(conn, name: str, key_type: str, make_id, rows: int, batch: int) -> dict:
+    table = f"bench_messages_{name}"
+    conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+    conn.execute(text(f"""
+        CREATE TABLE {table} (
+            id {key_type} PRIMARY KEY,
+            contact_id {key_type} NOT NULL,
+            step_number INTEGER NOT NULL,
+            sent_at TIMESTAMP NOT NULL
+        )
+    """))
+    conn.execute(text(f"CREATE INDEX {table}_contact ON {table} (contact_id)"))
+    # Realistic FK fan-in: ~10 messages per contact
+    contacts = [make_id() for _ in range(max(1, rows // 10))]
+    now = datetime.utcnow().isoformat()
+    cursor = conn.connection.cursor()
+    elapsed = 0.0
+    done = 0
+    while done < rows:
+        n = min(batch, rows - done)
+        buf = io.StringIO()
+        for i in range(n):
+            buf.write(f"{make_id()}\t{contacts[(done + i) % len(contacts)]}\t{(done + i) % 3 + 1}\t{now}\n")
+        buf.seek(0)
+        start = time.perf_counter()
+        cursor.copy_expert(f"COPY {table} (id, contact_id, step_number, sent_at) FROM STDIN", buf)
+        elapsed += time.perf_counter() - start
+        done += n
+    cursor.close()
+    sizes = conn.execute(text(f"""
+        SELECT pg_relation_size('{table}'),
+               pg_relation_size('{table}_pkey'),
+               pg_relation_size('{table}_contact')
+    """)).one()
+    return {
+        "variant": name,
+        "rows": rows,
+        "insert_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed) if elapsed else None,
+        "table_bytes": sizes[0],
+        "pkey_index_bytes": sizes[1],
+        "contact_index_bytes": sizes[2],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--batch", type=int, default=100_000)
+    parser.add_argument("--out", help="write results JSON here (default: stdout only)")
+    parser.add_argument("--keep", action="store_true", help="keep scratch tables")
+    args = parser.parse_args()
+
+    results = []
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        for name, (key_type, make_id) in VARIANTS.items():
+            print(f"⏱️ {name}: loading {args.rows} rows...")
+            results.append(run_variant(conn, name, key_type, make_id, args.rows, args.batch))
+            print(json.dumps(results[-1]))
+            if not args.keep:
+                conn.execute(text(f"DROP TABLE IF EXISTS bench_messages_{name}"))
+
+    report = {"benchmark": "uuid_keys", "created_at": datetime.utcnow().isoformat(), "results": results}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Worker-side cache of active campaigns and their steps.
+
+Each campaign row carries a ``version`` that the API bumps on every campaign
+or step edit (and announces over NOTIFY). The cache keeps immutable snapshots;
+a refresh reads only (id, account_id, version) of active campaigns and reloads
+the campaigns whose version changed. Refreshes happen when a NOTIFY marked the
+cache dirty, or every CAMPAIGN_CACHE_SECONDS as a safety net for missed
+events, so steady-state ticks run no configuration queries.
+"""
+from __future__ import annotations
+import os, time
+from typing import NamedTuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+
+from models import Campaign
+
+CAMPAIGN_CACHE_SECONDS = float(os.getenv("CAMPAIGN_CACHE_SECONDS", "300"))
+
+class StepConfig(NamedTuple):
+    step_number: int
+    message: str
+    interval_seconds: int | None
+    media_id: str | None
+
+class CampaignConfig(NamedTuple):
+    """Read-only view of a campaign; attribute names match the Campaign model"""
+    id: str
+    user_id: str
+    account_id: str
+    interval_seconds: int
+    max_steps: int
+    priority: int
+    version: int
+    steps: dict[int, StepConfig]
+
+def _snapshot(camp: Campaign) -> CampaignConfig:
+    steps = {s.step_number: StepConfig(s.step_number, s.message, s.interval_seconds, s.media_id) for s in camp.steps}
+    return CampaignConfig(camp.id, camp.user_id, camp.account_id, camp.interval_seconds, camp.max_steps,
+                          camp.priority or 1, camp.version or 1, steps)
+
+class CampaignCache:
+    def __init__(self, max_age: float = CAMPAIGN_CACHE_SECONDS):
+        self.max_age = max_age
+        self._campaigns: dict[str, CampaignConfig] = {}
+        self._by_account: dict[str, list[CampaignConfig]] = {}
+        self._checked_at: float | None = None
+
+    def invalidate(self):
+        """Re-check versions on the next lookup"""
+        self._checked_at = None
+
+    def for_account(self, db: Session, account_id: str) -> list[CampaignConfig]:
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.max_age:
+            self.refresh(db)
+        return self._by_account.get(account_id, [])
+
+    def refresh(self, db: Session) -> int:
+        """Sync with the database; returns how many campaigns were (re)loaded"""
+        versions = db.execute(select(Campaign.id, Campaign.version).where(Campaign.active == True)).all()
+        stale = [cid for cid, version in versions
+                 if cid not in self._campaigns or self._campaigns[cid].version != (version or 1)]
+        fresh = dict.fromkeys(cid for cid, _ in versions)
+        campaigns = {cid: self._campaigns[cid] for cid in fresh if cid not in stale}
+        if stale:
+            loaded = db.execute(select(Campaign).where(Campaign.id.in_(stale))
+                                .options(selectinload(Campaign.steps))).scalars()
+            for camp in loaded:
+                # Deactivated between the two queries: skip it
+                if camp.active:
+                    campaigns[camp.id] = _snapshot(camp)
+        by_account: dict[str, list[CampaignConfig]] = {}
+        for config in campaigns.values():
+            by_account.setdefault(config.account_id, []).append(config)
+        self._campaigns, self._by_account = campaigns, by_account
+        self._checked_at = time.monotonic()
+        return len(stale)
+
+CAMPAIGNS = CampaignCache()
@@ -0,0 +1,104 @@
+"""
+Per-account circuit breaker for Telegram calls made by the worker.
+
+Errors are classified by the remote exception name (GatewayError.type):
+
+- fatal (revoked, banned or unusable session, PeerFlood): the account is moved to
+  ``error`` status with the reason and drops out of every later tick;
+- transient (timeouts, connection and server errors, FloodWait): after
+  CIRCUIT_THRESHOLD consecutive failures the circuit opens for
+  CIRCUIT_BASE_SECONDS, doubling on each further failure up to
+  CIRCUIT_MAX_SECONDS (never shorter than a FloodWait Telegram asked for).
+
+Anything else (blocked by the contact, invalid peer...) concerns one contact,
+not the account, and leaves the circuit alone. Open circuits are checked in
+memory, so a skipped account costs no query and no gateway call.
+"""
+from __future__ import annotations
+import math, os, re, time
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from models import Account
+from metrics import CIRCUIT_OPEN
+
+CIRCUIT_THRESHOLD = int(os.getenv("CIRCUIT_THRESHOLD", "3"))
+CIRCUIT_BASE_SECONDS = float(os.getenv("CIRCUIT_BASE_SECONDS", "60"))
+CIRCUIT_MAX_SECONDS = float(os.getenv("CIRCUIT_MAX_SECONDS", "3600"))
+
+FATAL_ERRORS = {
+    "AuthKeyUnregisteredError", "AuthKeyDuplicatedError", "SessionRevokedError", "SessionExpiredError",
+    "UserDeactivatedError", "UserDeactivatedBanError", "PhoneNumberBannedError", "PeerFloodError",
+    # Not verified yet, or the stored session can't be loaded (telethon_manager)
+    "SessionUnusableError",
+}
+TRANSIENT_ERRORS = {
+    "TimeoutError", "ConnectionError", "ConnectionRefusedError", "ConnectionResetError", "OSError",
+    "ServerError", "RpcCallFailError", "RPCError", "FloodWaitError", "SlowModeWaitError",
+}
+_WAIT_SECONDS = re.compile(r"wait of (\d+) seconds")
+
+def classify(error: str) -> str | None:
+    """``"fatal"``, ``"transient"`` or None for contact-level errors"""
+    if error in FATAL_ERRORS:
+        return "fatal"
+    if error in TRANSIENT_ERRORS:
+        return "transient"
+    return None
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = CIRCUIT_THRESHOLD, base: float = CIRCUIT_BASE_SECONDS,
+                 max_seconds: float = CIRCUIT_MAX_SECONDS):
+        self.threshold, self.base, self.max_seconds = threshold, base, max_seconds
+        self._failures: dict[str, int] = {}
+        self._open_until: dict[str, float] = {}
+
+    def allows(self, account_id: str) -> bool:
+        """False while the account's circuit is open"""
+        return time.monotonic() >= self._open_until.get(account_id, 0)
+
+    def success(self, account_id: str):
+        self._failures.pop(account_id, None)
+        if self._open_until.pop(account_id, None) is not None:
+            CIRCUIT_OPEN.labels(account_id).set(0)
+
+    def failure(self, account_id: str, at_least: float = 0) -> float | None:
+        """Count a transient failure; returns the open duration if it (re)opened"""
+        failures = self._failures[account_id] = self._failures.get(account_id, 0) + 1
+        if failures < self.threshold and not at_least:
+            return None
+        delay = max(min(self.base * 2 ** max(failures - self.threshold, 0), self.max_seconds), at_least)
+        self._open_until[account_id] = time.monotonic() + delay
+        CIRCUIT_OPEN.labels(account_id).set(1)
+        return delay
+
+    def trip(self, account_id: str):
+        """Open until forgotten (the account left ``active``)"""
+        self._open_until[account_id] = math.inf
+        CIRCUIT_OPEN.labels(account_id).set(1)
+
+    def forget(self, keep: set[str]):
+        """Drop state of accounts not in ``keep``, so a re-verified account starts closed"""
+        for account_id in (self._failures.keys() | self._open_until.keys()) - keep:
+            self._failures.pop(account_id, None)
+            if self._open_until.pop(account_id, None) is not None:
+                CIRCUIT_OPEN.labels(account_id).set(0)
+
+    def record(self, db: Session, account_id: str, error: str, message: str = "") -> str | None:
+        """Classify a failed call for ``account_id`` and act on it; commits fatal errors"""
+        kind = classify(error)
+        if kind == "fatal":
+            reason = f"{error}: {message}" if message else error
+            db.execute(update(Account).where(Account.id == account_id)
+                       .values(status="error", status_reason=reason[:500]))
+            db.commit()
+            self.trip(account_id)
+            print(f"[worker] account {account_id} disabled: {reason}")
+        elif kind == "transient":
+            wait = _WAIT_SECONDS.search(message) if error == "FloodWaitError" else None
+            delay = self.failure(account_id, float(wait.group(1)) if wait else 0)
+            if delay:
+                print(f"[worker] circuit open for account {account_id} for {delay:.0f}s after {error}")
+        return kind
+
+CIRCUITS = CircuitBreaker()
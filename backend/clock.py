@@ -0,0 +1,19 @@
+"""
+Current UTC time for the scheduling code.
+
+Everything in services that asks "what time is it" goes through ``utcnow()``,
+so the time-warp simulator can replace the wall clock with a virtual one.
+"""
+from __future__ import annotations
+from datetime import datetime
+from typing import Callable
+
+_now: Callable[[], datetime] = datetime.utcnow
+
+def utcnow() -> datetime:
+    return _now()
+
+def set_clock(now: Callable[[], datetime] | None):
+    """Use ``now`` as the clock; None restores the wall clock"""
+    global _now
+    _now = now or datetime.utcnow
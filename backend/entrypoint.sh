@@ -28,35 +28,12 @@ done
 
 echo "✅ Database connection confirmed!"
 
-# Always run migrations (they are idempotent)
-echo "🔄 Running database migrations..."
-python migrate_all.py
-
-# Check if migrations were successful by testing basic functionality
-echo "🧪 Testing database schema..."
-python -c "
-try:
-    from sqlalchemy import create_engine, text
-    import os
-    
-    # Test database connection and basic tables
-    url = 'postgresql://{}:{}@{}:{}/{}'.format(
-        os.getenv('DB_USER', 'tg'),
-        os.getenv('DB_PASS', 'Test123'),
-        os.getenv('DB_HOST', 'db'),
-        os.getenv('DB_PORT', '5432'),
-        os.getenv('DB_NAME', 'tg')
-    )
-    
-    engine = create_engine(url)
-    with engine.connect() as conn:
-        # Test if we can query basic tables
-        conn.execute(text('SELECT 1'))
-        print('✅ Database schema is functional')
-except Exception as e:
-    print(f'⚠️ Database schema test failed: {e}')
-    print('🚀 Continuing anyway - application will handle missing tables')
-"
+# Versioned migrations: a single version check when the schema is current.
+# Concurrent containers serialize on an advisory lock inside the runner.
+if [ "${RUN_MIGRATIONS:-true}" = "true" ]; then
+  echo "🔄 Checking database schema version..."
+  python migrations.py
+fi
 
 echo "🚀 Starting application..."
 
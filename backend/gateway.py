@@ -0,0 +1,192 @@
+"""
+Telegram gateway: the only process that owns TelegramClients.
+
+The API and the worker reach it through gateway_client.GATEWAY over a Unix
+socket. Each line on the socket is a JSON request (or a JSON array of requests
+for a batch); the response line mirrors it. Requests carry account ids only,
+sessions never leave this process.
+"""
+from __future__ import annotations
+import asyncio, json, os, signal, time
+from typing import Any, Awaitable, Callable, Dict
+from sqlalchemy import select
+
+# Use absolute imports
+from db import SessionLocal
+from models import Account
+from telethon_manager import MANAGER
+from inbox import INBOX
+from metrics import start_metrics_server
+
+SOCKET_PATH = os.getenv("TG_GATEWAY_SOCKET", "/run/tg_gateway/gateway.sock")
+CALL_TIMEOUT = float(os.getenv("TG_GATEWAY_CALL_TIMEOUT", "30"))
+# Calls stop this long before the client's deadline so the response still reaches it
+DEADLINE_MARGIN_SECONDS = 1.0
+# Upper bound on MTProto calls in flight, across all connections
+CONCURRENCY = int(os.getenv("TG_GATEWAY_CONCURRENCY", "16"))
+# On SIGTERM, how long in-flight calls get to finish before clients disconnect
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", str(CALL_TIMEOUT)))
+# Batched frames (e.g. user info for a whole dashboard) exceed asyncio's 64KB default
+FRAME_LIMIT = 16 * 1024 * 1024
+
+def _get_account(account_id: str) -> Account | None:
+    with SessionLocal() as db:
+        return db.get(Account, account_id)
+
+async def _load_account(account_id: str) -> Account:
+    # Blocking driver call: keep it off the loop every RPC shares
+    acc = await asyncio.to_thread(_get_account, account_id)
+    if not acc:
+        raise ValueError("Account not found")
+    return acc
+
+# --- RPC methods ---
+
+async def send_code(account_id: str, phone: str) -> None:
+    await MANAGER.send_code(account_id, phone)
+
+async def verify_code(account_id: str, code: str, password: str | None = None) -> str:
+    return await MANAGER.verify_code(await _load_account(account_id), code, password)
+
+async def resolve_user_identifier(account_id: str, identifier: str) -> int:
+    return await MANAGER.resolve_user_identifier(await _load_account(account_id), identifier)
+
+async def get_user_info(account_id: str, user_id: int) -> dict:
+    return await MANAGER.get_user_info(await _load_account(account_id), user_id)
+
+async def send_message(account_id: str, user_id: int, message: str, media_id: str | None = None) -> int:
+    sent = await MANAGER.send_message(await _load_account(account_id), user_id, message, media_id)
+    return sent.id
+
+async def ensure_reply_handler(account_id: str) -> None:
+    await MANAGER.ensure_reply_handler(await _load_account(account_id))
+
+async def ping() -> str:
+    return "pong"
+
+async def status() -> dict:
+    """Telegram client pool state"""
+    clients = list(MANAGER.clients.values())
+    return {
+        "clients": len(clients),
+        "connected": sum(1 for c in clients if c.is_connected()),
+        "logins_pending": len(MANAGER.login_clients),
+        "reply_handlers": len(MANAGER.reply_handlers_installed),
+    }
+
+METHODS: Dict[str, Callable[..., Awaitable[Any]]] = {
+    fn.__name__: fn for fn in (
+        send_code, verify_code, resolve_user_identifier, get_user_info,
+        send_message, ensure_reply_handler, ping, status,
+    )
+}
+
+# --- Server ---
+
+_semaphore: asyncio.Semaphore | None = None
+# Frames being served on any connection; drained on shutdown
+_requests: set[asyncio.Task] = set()
+_stopping = asyncio.Event()
+
+async def _call(fn: Callable[..., Awaitable[Any]], params: dict, deadline: float) -> Any:
+    async with _semaphore:
+        # The caller may have given up while we queued: a send nobody awaits
+        # would be retried by the worker and reach the contact twice
+        if time.time() >= deadline:
+            raise TimeoutError("Client deadline passed while queued")
+        return await fn(**params)
+
+async def dispatch(request: dict) -> dict:
+    """Serve one request. CALL_TIMEOUT (or the client's earlier ``deadline``,
+    a Unix timestamp) covers the wait for a concurrency slot as well as the call."""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(CONCURRENCY)
+    response: dict = {"id": request.get("id")}
+    fn = METHODS.get(request.get("method"))
+    deadline = time.time() + CALL_TIMEOUT
+    if request.get("deadline") is not None:
+        deadline = min(deadline, request["deadline"] - DEADLINE_MARGIN_SECONDS)
+    try:
+        if fn is None:
+            raise ValueError(f"Unknown gateway method: {request.get('method')}")
+        if _stopping.is_set():
+            raise ConnectionError("Gateway is shutting down")
+        if time.time() >= deadline:
+            raise TimeoutError("Client deadline passed before the call started")
+        response["result"] = await asyncio.wait_for(_call(fn, request.get("params", {}), deadline),
+                                                    deadline - time.time())
+    except Exception as e:
+        response["error"] = {"type": type(e).__name__, "message": str(e)}
+    return response
+
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    write_lock = asyncio.Lock()
+
+    async def respond(line: bytes):
+        payload = json.loads(line)
+        if isinstance(payload, list):
+            result = await asyncio.gather(*(dispatch(r) for r in payload))
+        else:
+            result = await dispatch(payload)
+        async with write_lock:
+            writer.write(json.dumps(result).encode() + b"\n")
+            await writer.drain()
+
+    # Frames on one connection are served concurrently: a slow send_code
+    # must not hold up the get_user_info calls queued behind it
+    tasks: set[asyncio.Task] = set()
+    try:
+        while line := await reader.readline():
+            task = asyncio.create_task(respond(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            _requests.add(task)
+            task.add_done_callback(_requests.discard)
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+
+async def install_reply_handlers():
+    """Listen for replies on every active account as soon as the gateway starts"""
+    with SessionLocal() as db:
+        accounts = db.execute(select(Account).where(Account.status == "active")).scalars().all()
+    for acc in accounts:
+        try:
+            await MANAGER.ensure_reply_handler(acc)
+        except Exception as e:
+            print(f"[gateway] reply handler for {acc.id} failed: {e}")
+
+async def main():
+    os.makedirs(os.path.dirname(SOCKET_PATH), exist_ok=True)
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+    server = await asyncio.start_unix_server(_handle_connection, path=SOCKET_PATH, limit=FRAME_LIMIT)
+    print(f"[gateway] listening on {SOCKET_PATH}")
+    start_metrics_server()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await install_reply_handlers()
+    await stop.wait()
+    await shutdown(server)
+
+async def shutdown(server: asyncio.AbstractServer):
+    """Refuse new calls, let in-flight ones (a send_message especially) finish
+    and reach their caller, disconnect every TelegramClient, flush the inbox"""
+    print(f"[gateway] stopping: draining {len(_requests)} in-flight call(s)")
+    _stopping.set()
+    server.close()
+    if _requests:
+        _, pending = await asyncio.wait(set(_requests), timeout=SHUTDOWN_GRACE_SECONDS)
+        if pending:
+            print(f"[gateway] {len(pending)} call(s) still running after {SHUTDOWN_GRACE_SECONDS}s")
+    await MANAGER.disconnect_all()
+    # No more updates can arrive: store the replies still queued
+    await INBOX.close(SHUTDOWN_GRACE_SECONDS)
+    print("[gateway] stopped")
+
+if __name__ == "__main__":
+    asyncio.run(main())
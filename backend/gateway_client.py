@@ -0,0 +1,142 @@
+"""
+Async RPC client for the Telegram gateway (see gateway.py).
+
+Calls issued in the same event-loop iteration are coalesced into a single
+batch frame, so ``asyncio.gather`` over many ``get_user_info`` calls costs one
+round trip. Every call has a timeout, sent along as a deadline so the gateway
+drops calls still queued when the caller has given up. With
+``TG_GATEWAY_SOCKET`` set to an empty string the calls are dispatched
+in-process instead (local development).
+"""
+from __future__ import annotations
+import asyncio, itertools, json, os, time
+from typing import Any
+
+SOCKET_PATH = os.getenv("TG_GATEWAY_SOCKET", "/run/tg_gateway/gateway.sock")
+TIMEOUT = float(os.getenv("TG_GATEWAY_TIMEOUT", "35"))
+FRAME_LIMIT = 16 * 1024 * 1024
+
+class GatewayError(Exception):
+    """Gateway call failed; ``type`` is the exception class name raised remotely"""
+    def __init__(self, type_: str, message: str):
+        super().__init__(message)
+        self.type = type_
+
+class SessionError(GatewayError, ValueError):
+    """The account's stored session is unusable (SessionUnusableError remotely).
+    Still a ValueError, so API callers keep answering 400"""
+
+def _remote_error(err: dict) -> Exception:
+    # Keep ValueError semantics: callers map it to a 400
+    if err["type"] == "ValueError":
+        return ValueError(err["message"])
+    if err["type"] == "SessionUnusableError":
+        return SessionError(err["type"], err["message"])
+    return GatewayError(err["type"], err["message"])
+
+class GatewayClient:
+    def __init__(self, socket_path: str = SOCKET_PATH, timeout: float = TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._outbox: list[dict] = []
+        self._flush_scheduled = False
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._read_task: asyncio.Task | None = None
+        self._connect_lock: asyncio.Lock | None = None
+
+    async def _connect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path, limit=FRAME_LIMIT)
+            self._read_task = asyncio.create_task(self._read_loop(self._reader))
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while line := await reader.readline():
+                payload = json.loads(line)
+                for response in payload if isinstance(payload, list) else [payload]:
+                    fut = self._pending.pop(response.get("id"), None)
+                    if fut is None or fut.done():
+                        continue
+                    if "error" in response:
+                        fut.set_exception(_remote_error(response["error"]))
+                    else:
+                        fut.set_result(response.get("result"))
+        finally:
+            self._writer = None
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(GatewayError("ConnectionError", "Gateway connection closed"))
+            self._pending.clear()
+
+    def _flush(self):
+        self._flush_scheduled = False
+        batch, self._outbox = self._outbox, []
+        if not batch:
+            return
+        if self._writer is None:
+            for request in batch:
+                fut = self._pending.pop(request["id"], None)
+                if fut is not None and not fut.done():
+                    fut.set_exception(GatewayError("ConnectionError", "Gateway connection closed"))
+            return
+        frame = batch if len(batch) > 1 else batch[0]
+        self._writer.write(json.dumps(frame).encode() + b"\n")
+
+    async def call(self, method: str, **params) -> Any:
+        if not self.socket_path:
+            import gateway
+            response = await gateway.dispatch({"method": method, "params": params})
+            if "error" in response:
+                raise _remote_error(response["error"])
+            return response["result"]
+
+        try:
+            await self._connect()
+        except OSError as e:
+            raise GatewayError("ConnectionError", f"Telegram gateway unavailable: {e}") from e
+        request_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = fut
+        # Wall-clock: the gateway runs on the same host
+        self._outbox.append({"id": request_id, "method": method, "params": params,
+                             "deadline": time.time() + self.timeout})
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+        try:
+            return await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(request_id, None)
+            raise GatewayError("TimeoutError", f"Gateway call {method} timed out after {self.timeout}s")
+
+    # --- Typed helpers mirroring gateway.METHODS ---
+
+    async def send_code(self, account_id: str, phone: str) -> None:
+        await self.call("send_code", account_id=account_id, phone=phone)
+
+    async def verify_code(self, account_id: str, code: str, password: str | None) -> str:
+        return await self.call("verify_code", account_id=account_id, code=code, password=password)
+
+    async def resolve_user_identifier(self, account_id: str, identifier: str) -> int:
+        return await self.call("resolve_user_identifier", account_id=account_id, identifier=identifier)
+
+    async def get_user_info(self, account_id: str, user_id: int) -> dict:
+        return await self.call("get_user_info", account_id=account_id, user_id=user_id)
+
+    async def send_message(self, account_id: str, user_id: int, message: str, media_id: str | None = None) -> int:
+        return await self.call("send_message", account_id=account_id, user_id=user_id, message=message, media_id=media_id)
+
+    async def ensure_reply_handler(self, account_id: str) -> None:
+        await self.call("ensure_reply_handler", account_id=account_id)
+
+    async def status(self) -> dict:
+        return await self.call("status")
+
+GATEWAY = GatewayClient()
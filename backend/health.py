@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Health signals for the API, worker and gateway.
+
+The worker upserts a ``worker_heartbeats`` row after every tick; /readyz and
+``python health.py worker`` treat it as stale after WORKER_STALE_SECONDS.
+``python health.py gateway`` pings the gateway socket. Both CLI checks exit
+non-zero when unhealthy, for Docker healthchecks.
+"""
+from __future__ import annotations
+import asyncio, os, socket, sys
+from datetime import datetime
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from db import SessionLocal, engine
+from models import WorkerHeartbeat
+
+WORKER_TICK = int(os.getenv("WORKER_TICK", "30"))
+WORKER_STALE_SECONDS = float(os.getenv("WORKER_STALE_SECONDS", str(3 * WORKER_TICK + 60)))
+WORKER_ID = os.getenv("HOSTNAME") or socket.gethostname()
+
+def record_heartbeat(db: Session, started_at: datetime, tick_seconds: float | None = None,
+                     backlog: int | None = None):
+    """Upsert this worker's heartbeat in its own statement"""
+    db.execute(text("""
+        INSERT INTO worker_heartbeats (worker_id, started_at, beat_at, last_tick_seconds, backlog)
+        VALUES (:worker_id, :started_at, :now, :tick_seconds, :backlog)
+        ON CONFLICT (worker_id) DO UPDATE
+        SET started_at = EXCLUDED.started_at, beat_at = EXCLUDED.beat_at,
+            last_tick_seconds = COALESCE(EXCLUDED.last_tick_seconds, worker_heartbeats.last_tick_seconds),
+            backlog = COALESCE(EXCLUDED.backlog, worker_heartbeats.backlog)
+    """), {"worker_id": WORKER_ID, "started_at": started_at, "now": datetime.utcnow(),
+           "tick_seconds": tick_seconds, "backlog": backlog})
+    db.commit()
+
+def database_status() -> dict:
+    pool = engine.pool
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return {"ok": True, "pool_size": pool.size(), "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(), "overflow": max(pool.overflow(), 0)}
+
+def worker_status(db: Session, worker_id: str | None = None) -> dict:
+    """Most recent heartbeat (of ``worker_id``, or of any worker)"""
+    q = select(WorkerHeartbeat).order_by(WorkerHeartbeat.beat_at.desc()).limit(1)
+    if worker_id:
+        q = q.where(WorkerHeartbeat.worker_id == worker_id)
+    beat = db.execute(q).scalar_one_or_none()
+    if beat is None:
+        return {"ok": False, "error": "no heartbeat recorded"}
+    lag = (datetime.utcnow() - beat.beat_at).total_seconds()
+    return {"ok": lag <= WORKER_STALE_SECONDS, "worker_id": beat.worker_id, "lag_seconds": round(lag, 1),
+            "last_tick_seconds": beat.last_tick_seconds, "backlog": beat.backlog}
+
+async def _ping_gateway() -> bool:
+    from gateway_client import GATEWAY
+    return await GATEWAY.call("ping") == "pong"
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if target == "worker":
+            with SessionLocal() as db:
+                result = worker_status(db, WORKER_ID)
+            ok = result["ok"]
+        elif target == "gateway":
+            ok = asyncio.run(_ping_gateway())
+        else:
+            print("usage: health.py worker|gateway")
+            sys.exit(2)
+    except Exception as e:
+        print(f"❌ {target} unhealthy: {e}")
+        sys.exit(1)
+    if not ok:
+        print(f"❌ {target} unhealthy: {result}" if target == "worker" else f"❌ {target} unhealthy")
+    sys.exit(0 if ok else 1)
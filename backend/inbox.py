@@ -0,0 +1,126 @@
+"""
+Batched ingestion of incoming Telegram messages.
+
+Reply handlers only enqueue; one consumer task drains the queue every
+INBOX_FLUSH_SECONDS (or as soon as INBOX_BATCH_SIZE messages are waiting) and
+stores the batch in three statements, in a worker thread so the event loop
+keeps serving Telegram updates. Tracked contacts are looked up for the whole
+batch at once, their private messages go to ``messages_received`` (re-delivered
+messages are ignored) and they are flagged ``replied``.
+"""
+from __future__ import annotations
+import asyncio, os
+from datetime import datetime
+from typing import NamedTuple
+from sqlalchemy import select, update, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from db import SessionLocal
+from models import Contact, MessageReceived, new_id
+from metrics import REPLY_EVENTS
+
+INBOX_BATCH_SIZE = int(os.getenv("INBOX_BATCH_SIZE", "500"))
+INBOX_FLUSH_SECONDS = float(os.getenv("INBOX_FLUSH_SECONDS", "1"))
+# Handlers wait (backpressure) once this many messages are queued
+INBOX_QUEUE_SIZE = int(os.getenv("INBOX_QUEUE_SIZE", "10000"))
+INBOX_RETRIES = 3
+
+class Incoming(NamedTuple):
+    account_id: str
+    telegram_user_id: int
+    telegram_message_id: int
+    message: str | None
+    received_at: datetime      # naive UTC
+    private: bool
+
+def store_batch(db: Session, batch: list[Incoming]) -> dict[str, int]:
+    """Persist a batch; returns REPLY_EVENTS counts by result"""
+    pairs = {(m.account_id, m.telegram_user_id) for m in batch}
+    contacts: dict[tuple[str, int], list] = {}
+    for row in db.execute(select(Contact.id, Contact.user_id, Contact.account_id, Contact.telegram_user_id,
+                                 Contact.replied)
+                          .where(tuple_(Contact.account_id, Contact.telegram_user_id).in_(pairs))):
+        contacts.setdefault((row.account_id, row.telegram_user_id), []).append(row)
+
+    rows, to_flag, counts = [], set(), {"replied": 0, "already_replied": 0, "untracked": 0}
+    for m in batch:
+        matched = contacts.get((m.account_id, m.telegram_user_id), [])
+        if not matched:
+            counts["untracked"] += 1
+            continue
+        if m.private:
+            rows.extend({"id": new_id(), "user_id": c.user_id, "account_id": m.account_id, "contact_id": c.id,
+                         "telegram_message_id": m.telegram_message_id, "message": m.message,
+                         "received_at": m.received_at} for c in matched)
+        newly = {c.id for c in matched if not c.replied} - to_flag
+        counts["replied" if newly else "already_replied"] += 1
+        to_flag |= newly
+    if rows:
+        db.execute(insert(MessageReceived).on_conflict_do_nothing(
+            index_elements=["contact_id", "telegram_message_id"]), rows)
+    if to_flag:
+        db.execute(update(Contact).where(Contact.id.in_(to_flag), Contact.replied == False).values(replied=True))
+    db.commit()
+    return counts
+
+def _store(batch: list[Incoming]) -> dict[str, int]:
+    with SessionLocal() as db:
+        return store_batch(db, batch)
+
+class Inbox:
+    def __init__(self, batch_size: int = INBOX_BATCH_SIZE, flush_seconds: float = INBOX_FLUSH_SECONDS,
+                 max_size: int = INBOX_QUEUE_SIZE):
+        self.batch_size, self.flush_seconds, self.max_size = batch_size, flush_seconds, max_size
+        self._queue: asyncio.Queue[Incoming] | None = None
+        self._task: asyncio.Task | None = None
+
+    async def put(self, message: Incoming):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_size)
+            self._task = asyncio.create_task(self._run())
+        await self._queue.put(message)
+
+    async def _next_batch(self) -> list[Incoming]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            for attempt in range(1, INBOX_RETRIES + 1):
+                try:
+                    counts = await asyncio.to_thread(_store, batch)
+                except Exception as e:
+                    print(f"[gateway] storing {len(batch)} incoming message(s) failed (attempt {attempt}): {e}")
+                    if attempt < INBOX_RETRIES:
+                        await asyncio.sleep(attempt)
+                    continue
+                for result, n in counts.items():
+                    if n:
+                        REPLY_EVENTS.labels(result).inc(n)
+                break
+            for _ in batch:
+                self._queue.task_done()
+
+    async def close(self, timeout: float | None = None):
+        """Store what is queued (up to ``timeout`` seconds), then stop"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"[gateway] {self._queue.qsize()} incoming message(s) not stored at shutdown")
+        self._task.cancel()
+        self._queue = self._task = None
+
+INBOX = Inbox()
@@ -1,23 +1,42 @@
 from __future__ import annotations
-import os, uuid
-from fastapi import FastAPI, Depends, HTTPException, status
+import os, asyncio
+from fastapi import FastAPI, Depends, HTTPException, Query, status, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from sqlalchemy import select, delete
+from fastapi.responses import JSONResponse, Response
+from starlette.routing import Match
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+import time
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import select, delete, func
+from sqlalchemy.exc import DataError
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Literal
+from uuid import UUID
 
 # Use absolute imports
 from db import SessionLocal
-from models import User, Account, Campaign, CampaignStep, Contact, MessageLog
-from telethon_manager import MANAGER, _xor, SESSION_SECRET
+from models import (User, Account, Campaign, CampaignStep, Contact, MessageLog, MessageReceived, MediaFile, MediaUpload,
+                    Tag, ContactTag, Segment, new_id)
+from telethon_manager import _xor, SESSION_SECRET
+from gateway_client import GATEWAY
+from notifications import notify_campaign, notify_contacts, notify_profile
+from services import reschedule_campaign, forecast_due, conversation
+from search import search_contacts, MIN_QUERY_LENGTH
+from segments import set_contact_tags, tagged, count_segment, enroll_segment
+import media_store
+from message_templates import validate as validate_template, TemplateError
+from metrics import REQUEST_LATENCY
+from query_stats import profile_scope, DB_PROFILE_HEADER
+import profiler
+import health
 from schemas import *
 from auth import (
     get_password_hash, 
     verify_password, 
     create_access_token, 
     get_current_active_user, 
+    get_admin_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 
@@ -32,6 +51,89 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _route_target(request) -> str | None:
+    """"<METHOD> <route path>" of the route the request will hit"""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return f"{request.method} {route.path}"
+    return None
+
+@app.middleware("http")
+async def record_request_stats(request, call_next):
+    start = time.perf_counter()
+    target = _route_target(request) if profiler.armed() else None
+    with profile_scope(f"{request.method} {request.url.path}") as stats, profiler.sample(target):
+        response = await call_next(request)
+    if DB_PROFILE_HEADER:
+        response.headers["X-DB-Queries"] = str(stats.count)
+        response.headers["Server-Timing"] = f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"'
+    # Route template (e.g. /api/contacts/{contact_id}) keeps label cardinality bounded
+    route = request.scope.get("route")
+    REQUEST_LATENCY.labels(request.method, route.path if route else "unmatched", response.status_code).observe(
+        time.perf_counter() - start)
+    return response
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    """Liveness: the process serves requests (no dependencies touched)"""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: database and gateway reachable; worker heartbeat reported
+    but not required to serve the API"""
+    checks = {}
+    try:
+        checks["database"] = health.database_status()
+    except Exception as e:
+        checks["database"] = {"ok": False, "error": str(e)}
+    try:
+        checks["gateway"] = {"ok": True, **await asyncio.wait_for(GATEWAY.status(), 5)}
+    except Exception as e:
+        checks["gateway"] = {"ok": False, "error": str(e)}
+    if checks["database"]["ok"]:
+        with SessionLocal() as db:
+            checks["worker"] = health.worker_status(db)
+    ready = checks["database"]["ok"] and checks["gateway"]["ok"]
+    status_text = "ok" if ready and checks.get("worker", {}).get("ok") else ("degraded" if ready else "unavailable")
+    return JSONResponse({"status": status_text, "checks": checks}, status_code=200 if ready else 503)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def _campaign_changed(db: Session, camp: Campaign):
+    """Bump the config version and tell the worker to pick it up"""
+    camp.version = (camp.version or 1) + 1
+    notify_campaign(db, camp.account_id, camp.id)
+
+def _check_template(message: str):
+    try:
+        validate_template(message)
+    except TemplateError as e:
+        raise HTTPException(400, f"Invalid message template: {e}")
+
+def _check_step_media(db: Session, media_id: str | None, user: User):
+    if media_id is None:
+        return
+    media = db.execute(select(MediaFile).where(MediaFile.id == media_id, MediaFile.user_id == user.id)).scalar_one_or_none()
+    if not media:
+        raise HTTPException(400, "Attachment not found")
+
+def _check_send_window(camp: Campaign):
+    if (camp.send_hour_start is None) != (camp.send_hour_end is None):
+        raise HTTPException(400, "send_hour_start and send_hour_end must be set together")
+    if camp.send_hour_start is not None and camp.send_hour_start >= camp.send_hour_end:
+        raise HTTPException(400, "send_hour_start must be before send_hour_end")
+
+@app.exception_handler(DataError)
+async def invalid_id_handler(request, exc: DataError):
+    # Ids are native uuid columns: a malformed path id can't match any row
+    if "invalid input syntax for type uuid" in str(exc.orig):
+        return JSONResponse(status_code=404, content={"detail": "Not found"})
+    raise exc
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -55,7 +157,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     # Create new user
     hashed_password = get_password_hash(user_data.password)
     user = User(
-        id=str(uuid.uuid4()),
+        id=new_id(),
         email=user_data.email,
         hashed_password=hashed_password
     )
@@ -102,55 +204,34 @@ async def get_dashboard(current_user: User = Depends(get_current_active_user), d
     
     # Get data filtered by user
     accounts = db.execute(select(Account).where(Account.user_id == current_user.id)).scalars().all()
-    campaigns = db.execute(select(Campaign).where(Campaign.user_id == current_user.id)).scalars().all()
+    campaigns = db.execute(select(Campaign).where(Campaign.user_id == current_user.id)
+                           .options(selectinload(Campaign.steps))).scalars().all()
     contacts = db.execute(select(Contact).where(Contact.user_id == current_user.id)).scalars().all()
     
-    # Enrich contacts with user info and next message time
+    # Telegram profiles come from the columns cached when each contact was
+    # added (or later by the worker's backfill): the dashboard makes no
+    # gateway calls
     enriched_contacts = []
     for contact in contacts:
-        # Get account for this contact
-        account = next((acc for acc in accounts if acc.id == contact.account_id), None)
-        if not account or account.status != "active":
-            enriched_contacts.append(ContactResponse(
-                id=contact.id,
-                user_id=contact.user_id,
-                account_id=contact.account_id,
-                telegram_user_id=contact.telegram_user_id,
-                name=contact.name,
-                tag=contact.tag,
-                current_step=contact.current_step,
-                replied=contact.replied,
-                last_message_at=contact.last_message_at
-            ))
-            continue
-            
-        # Get user info from Telegram
-        try:
-            user_info_dict = await MANAGER.get_user_info(account, contact.telegram_user_id)
-            user_info = UserInfo(**user_info_dict)
-        except:
-            user_info = UserInfo(
-                id=contact.telegram_user_id,
-                first_name=None,
-                last_name=None,
-                username=None,
-                phone=None,
-                is_bot=False,
-                is_verified=False,
-                full_name=f"User {contact.telegram_user_id}"
-            )
-        
-        # Calculate next message time (use the specific assigned campaign)
+        full_name = f"{contact.first_name or ''} {contact.last_name or ''}".strip()
+        user_info = UserInfo(
+            id=contact.telegram_user_id,
+            first_name=contact.first_name,
+            last_name=contact.last_name,
+            username=contact.username,
+            phone=contact.phone,
+            is_bot=False,
+            is_verified=False,
+            full_name=full_name or f"User {contact.telegram_user_id}"
+        )
+
+        # Next message time (use the specific assigned campaign); next_due_at
+        # already accounts for step intervals and sending windows
         campaign = next((c for c in campaigns if c.id == contact.campaign_id), None)
         next_message_time = None
-        if campaign and contact.last_message_at and not contact.replied and contact.current_step <= campaign.max_steps:
-            # Use per-step interval if available
-            step = next((s for s in campaign.steps if s.step_number == contact.current_step), None)
-            interval_seconds = step.interval_seconds if (step and step.interval_seconds is not None) else campaign.interval_seconds
-            next_time = contact.last_message_at + timedelta(seconds=interval_seconds)
-            next_message_time = next_time.isoformat()
-        elif campaign and not contact.last_message_at and not contact.replied:
-            next_message_time = "now"
+        if (campaign and not contact.replied and not contact.finished
+                and contact.current_step <= campaign.max_steps):
+            next_message_time = contact.next_due_at.isoformat() if contact.next_due_at else "now"
             
         enriched_contacts.append(ContactResponse(
             id=contact.id,
@@ -161,6 +242,7 @@ async def get_dashboard(current_user: User = Depends(get_current_active_user), d
             tag=contact.tag,
             current_step=contact.current_step,
             replied=contact.replied,
+            finished=contact.finished,
             last_message_at=contact.last_message_at,
             user_info=user_info,
             next_message_time=next_message_time
@@ -177,7 +259,7 @@ async def get_dashboard(current_user: User = Depends(get_current_active_user), d
 async def create_account(account_data: AccountCreate, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     """Create new account and send verification code"""
     acc = Account(
-        id=str(uuid.uuid4()), 
+        id=new_id(), 
         user_id=current_user.id,
         phone=account_data.phone, 
         status="pending_code"
@@ -186,7 +268,7 @@ async def create_account(account_data: AccountCreate, current_user: User = Depen
     db.commit()
     
     try:
-        await MANAGER.send_code(acc.id, acc.phone)
+        await GATEWAY.send_code(acc.id, acc.phone)
         return AccountResponse.model_validate(acc)
     except Exception as e:
         db.delete(acc)
@@ -207,10 +289,11 @@ async def verify_account(account_id: str, verify_data: AccountVerify, current_us
     print(f"Found account: {acc.phone}, status: {acc.status}")
     
     try:
-        session_str = await MANAGER.verify_code(acc, verify_data.code, verify_data.password)
+        session_str = await GATEWAY.verify_code(acc.id, verify_data.code, verify_data.password)
         # Store encoded session string for safety/compatibility
         acc.string_session = _xor(session_str, SESSION_SECRET)
         acc.status = "active"
+        acc.status_reason = None
         db.commit()
         print(f"Verification successful for account {account_id}")
         return AccountResponse.model_validate(acc)
@@ -237,10 +320,20 @@ def update_account(account_id: str, account_data: AccountUpdate, current_user: U
         acc.name = account_data.name
     if account_data.tag is not None:
         acc.tag = account_data.tag
+    if "send_rate_per_minute" in account_data.model_fields_set:
+        acc.send_rate_per_minute = account_data.send_rate_per_minute
     acc.updated_at = datetime.utcnow()
     db.commit()
     return AccountResponse.model_validate(acc)
 
+@app.get("/api/accounts/{account_id}/forecast", response_model=SendForecast)
+def get_account_forecast(account_id: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Sends due for the account in the next hour, day and week"""
+    acc = db.execute(select(Account.id).where(Account.id == account_id, Account.user_id == current_user.id)).scalar_one_or_none()
+    if not acc:
+        raise HTTPException(404, "Account not found")
+    return SendForecast(account_id=account_id, **forecast_due(db, account_id))
+
 @app.delete("/api/accounts/{account_id}")
 def delete_account(account_id: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     """Delete account and all related data"""
@@ -257,7 +350,11 @@ def delete_account(account_id: str, current_user: User = Depends(get_current_act
             db.delete(step)
         db.delete(campaign)
     
-    # Delete contacts
+    # Delete contacts with their sent and stored messages, and the account's
+    # cached media uploads
+    db.execute(delete(MessageLog).where(MessageLog.account_id == account_id, MessageLog.user_id == current_user.id))
+    db.execute(delete(MessageReceived).where(MessageReceived.account_id == account_id, MessageReceived.user_id == current_user.id))
+    db.execute(delete(MediaUpload).where(MediaUpload.account_id == account_id))
     contacts = db.execute(select(Contact).where(Contact.account_id == account_id, Contact.user_id == current_user.id)).scalars().all()
     for contact in contacts:
         db.delete(contact)
@@ -276,21 +373,29 @@ def create_campaign(campaign_data: CampaignCreate, current_user: User = Depends(
         raise HTTPException(404, "Account not found")
     
     camp = Campaign(
-        id=str(uuid.uuid4()),
+        id=new_id(),
         user_id=current_user.id,
         account_id=campaign_data.account_id,
         name=campaign_data.name,
         interval_seconds=campaign_data.interval_seconds,
-        max_steps=campaign_data.max_steps
+        max_steps=campaign_data.max_steps,
+        priority=campaign_data.priority,
+        timezone=campaign_data.timezone,
+        send_days=campaign_data.send_days if campaign_data.send_days is not None else 127,
+        send_hour_start=campaign_data.send_hour_start,
+        send_hour_end=campaign_data.send_hour_end
     )
+    _check_send_window(camp)
     db.add(camp)
+    notify_campaign(db, camp.account_id, camp.id)
     db.commit()
     return CampaignResponse.model_validate(camp)
 
 @app.get("/api/campaigns", response_model=List[CampaignResponse])
 def get_campaigns(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     """Get all campaigns with steps for current user"""
-    campaigns = db.execute(select(Campaign).where(Campaign.user_id == current_user.id)).scalars().all()
+    campaigns = db.execute(select(Campaign).where(Campaign.user_id == current_user.id)
+                           .options(selectinload(Campaign.steps))).scalars().all()
     return [CampaignResponse.model_validate(camp) for camp in campaigns]
 
 @app.put("/api/campaigns/{campaign_id}", response_model=CampaignResponse)
@@ -305,8 +410,17 @@ def update_campaign(campaign_id: str, campaign_data: CampaignUpdate, current_use
         camp.name = campaign_data.name
     if campaign_data.interval_seconds is not None:
         camp.interval_seconds = campaign_data.interval_seconds
+    # Window fields: an explicit null clears the window
+    for field in ("timezone", "send_days", "send_hour_start", "send_hour_end"):
+        if field in campaign_data.model_fields_set:
+            setattr(camp, field, getattr(campaign_data, field))
+    if camp.send_days is None:
+        camp.send_days = 127
+    _check_send_window(camp)
     if campaign_data.active is not None:
         camp.active = campaign_data.active
+    if campaign_data.priority is not None:
+        camp.priority = campaign_data.priority
     if campaign_data.account_id is not None:
         # Verify new account belongs to current user
         account = db.execute(select(Account).where(Account.id == campaign_data.account_id, Account.user_id == current_user.id)).scalar_one_or_none()
@@ -314,6 +428,10 @@ def update_campaign(campaign_id: str, campaign_data: CampaignUpdate, current_use
             raise HTTPException(400, "Account not found or doesn't belong to you")
         camp.account_id = campaign_data.account_id
     
+    if campaign_data.interval_seconds is not None:
+        db.flush()
+        reschedule_campaign(db, camp.id)
+    _campaign_changed(db, camp)
     db.commit()
     return CampaignResponse.model_validate(camp)
 
@@ -329,6 +447,7 @@ def delete_campaign(campaign_id: str, current_user: User = Depends(get_current_a
     for step in steps:
         db.delete(step)
     
+    notify_campaign(db, camp.account_id, camp.id)
     db.delete(camp)
     db.commit()
     return {"message": "Campaign deleted successfully"}
@@ -349,16 +468,22 @@ def add_campaign_step(campaign_id: str, step_data: CampaignStepCreate, current_u
     if not campaign:
         raise HTTPException(404, "Campaign not found")
     
+    _check_template(step_data.message)
+    _check_step_media(db, step_data.media_id, current_user)
     # Normalize interval: <=0 means use default (None)
     normalized_interval = step_data.interval_seconds if (step_data.interval_seconds is None or step_data.interval_seconds > 0) else None
     step = CampaignStep(
-        id=str(uuid.uuid4()),
+        id=new_id(),
         campaign_id=campaign_id,
         step_number=step_data.step_number,
         message=step_data.message,
-        interval_seconds=normalized_interval
+        interval_seconds=normalized_interval,
+        media_id=step_data.media_id
     )
     db.add(step)
+    db.flush()
+    reschedule_campaign(db, campaign_id)
+    _campaign_changed(db, campaign)
     db.commit()
     return CampaignStepResponse.model_validate(step)
 
@@ -374,9 +499,17 @@ def update_campaign_step(campaign_id: str, step_id: str, step_data: CampaignStep
     if not step or step.campaign_id != campaign_id:
         raise HTTPException(404, "Step not found")
     
+    _check_template(step_data.message)
+    _check_step_media(db, step_data.media_id, current_user)
     step.step_number = step_data.step_number
     step.message = step_data.message
+    # Omitted keeps the current attachment; an explicit null removes it
+    if "media_id" in step_data.model_fields_set:
+        step.media_id = step_data.media_id
     step.interval_seconds = step_data.interval_seconds if (step_data.interval_seconds is None or step_data.interval_seconds > 0) else None
+    db.flush()
+    reschedule_campaign(db, campaign_id)
+    _campaign_changed(db, campaign)
     db.commit()
     return CampaignStepResponse.model_validate(step)
 
@@ -393,9 +526,38 @@ def delete_campaign_step(campaign_id: str, step_id: str, current_user: User = De
         raise HTTPException(404, "Step not found")
     
     db.delete(step)
+    db.flush()
+    reschedule_campaign(db, campaign_id)
+    _campaign_changed(db, campaign)
     db.commit()
     return {"message": "Step deleted successfully"}
 
+# Media endpoints
+@app.post("/api/media", response_model=MediaResponse)
+def upload_media(file: UploadFile = File(...), current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Upload an attachment for campaign steps (stored once per content hash)"""
+    try:
+        sha256, size = media_store.store(file.file)
+    except ValueError as e:
+        raise HTTPException(413, str(e))
+    media = MediaFile(
+        id=new_id(),
+        user_id=current_user.id,
+        sha256=sha256,
+        filename=file.filename or sha256,
+        mime_type=file.content_type,
+        size=size
+    )
+    db.add(media)
+    db.commit()
+    return MediaResponse.model_validate(media)
+
+@app.get("/api/media", response_model=List[MediaResponse])
+def get_media(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """List attachments uploaded by current user"""
+    media = db.execute(select(MediaFile).where(MediaFile.user_id == current_user.id)).scalars().all()
+    return [MediaResponse.model_validate(m) for m in media]
+
 @app.post("/api/campaigns/{campaign_id}/contacts/{contact_id}")
 def assign_contact_to_campaign(campaign_id: str, contact_id: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     """Assign contact to campaign"""
@@ -412,7 +574,11 @@ def assign_contact_to_campaign(campaign_id: str, contact_id: str, current_user:
     contact.campaign_id = campaign_id
     contact.current_step = 1
     contact.replied = False
+    contact.finished = False
     contact.last_message_at = None
+    contact.next_due_at = None
+    contact.send_failures = 0
+    notify_contacts(db, contact.account_id, [contact.id])
     db.commit()
     
     return {"message": "Contact assigned to campaign successfully"}
@@ -434,6 +600,88 @@ def remove_contact_from_campaign(campaign_id: str, contact_id: str, current_user
     
     return {"message": "Contact removed from campaign successfully"}
 
+@app.post("/api/campaigns/{campaign_id}/segments/{segment_id}")
+def enroll_segment_in_campaign(campaign_id: str, segment_id: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Assign every contact of the segment (on the campaign's account) to the campaign in one UPDATE"""
+    campaign = db.execute(select(Campaign).where(Campaign.id == campaign_id, Campaign.user_id == current_user.id)).scalar_one_or_none()
+    if not campaign:
+        raise HTTPException(404, "Campaign not found")
+    segment = db.execute(select(Segment).where(Segment.id == segment_id, Segment.user_id == current_user.id)).scalar_one_or_none()
+    if not segment:
+        raise HTTPException(404, "Segment not found")
+    enrolled = enroll_segment(db, segment, campaign)
+    if enrolled:
+        # One campaign-wide wake-up instead of chunks of contact ids
+        notify_campaign(db, campaign.account_id, campaign.id)
+    db.commit()
+    return {"message": f"{enrolled} contacts assigned to campaign", "enrolled": enrolled}
+
+# Tag and segment endpoints
+@app.get("/api/tags", response_model=List[TagResponse])
+def get_tags(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Tags of the current user with how many contacts carry each"""
+    rows = db.execute(
+        select(Tag.id, Tag.name, func.count(ContactTag.contact_id))
+        .outerjoin(ContactTag, ContactTag.tag_id == Tag.id)
+        .where(Tag.user_id == current_user.id)
+        .group_by(Tag.id, Tag.name)
+        .order_by(Tag.name)
+    ).all()
+    return [TagResponse(id=tag_id, name=name, contacts=contacts) for tag_id, name, contacts in rows]
+
+def _check_segment_refs(db: Session, data: SegmentCreate, user_id: str):
+    refs = ((Account, data.account_id, "Account"), (Tag, data.tag_id, "Tag"), (Campaign, data.campaign_id, "Campaign"))
+    for model, ref_id, label in refs:
+        if ref_id and not db.execute(select(model.id).where(model.id == ref_id, model.user_id == user_id)).scalar_one_or_none():
+            raise HTTPException(400, f"{label} not found")
+
+@app.post("/api/segments", response_model=SegmentResponse)
+def create_segment(segment_data: SegmentCreate, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Save a contact filter"""
+    _check_segment_refs(db, segment_data, current_user.id)
+    segment = Segment(id=new_id(), user_id=current_user.id, **segment_data.model_dump())
+    db.add(segment)
+    db.commit()
+    return SegmentResponse.model_validate(segment)
+
+@app.get("/api/segments", response_model=List[SegmentResponse])
+def get_segments(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    segments = db.execute(select(Segment).where(Segment.user_id == current_user.id).order_by(Segment.name)).scalars().all()
+    return [SegmentResponse.model_validate(segment) for segment in segments]
+
+@app.get("/api/segments/{segment_id}/count")
+def get_segment_count(segment_id: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """How many contacts currently match the segment"""
+    segment = db.execute(select(Segment).where(Segment.id == segment_id, Segment.user_id == current_user.id)).scalar_one_or_none()
+    if not segment:
+        raise HTTPException(404, "Segment not found")
+    return {"segment_id": segment_id, "contacts": count_segment(db, segment)}
+
+@app.delete("/api/segments/{segment_id}")
+def delete_segment(segment_id: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    segment = db.execute(select(Segment).where(Segment.id == segment_id, Segment.user_id == current_user.id)).scalar_one_or_none()
+    if not segment:
+        raise HTTPException(404, "Segment not found")
+    db.delete(segment)
+    db.commit()
+    return {"message": "Segment deleted successfully"}
+
+# Admin endpoints
+@app.post("/api/admin/profile")
+def arm_profiler(req: ProfileRequest, admin: User = Depends(get_admin_user), db: Session = Depends(get_db)):
+    """Sample the next ``runs`` worker ticks (target "tick") or requests to a route"""
+    if req.target == "tick":
+        notify_profile(db, req.target, req.runs)
+        db.commit()
+    else:
+        profiler.arm(req.target, req.runs)
+    return {"target": req.target, "runs": req.runs, "profile_dir": profiler.PROFILE_DIR}
+
+@app.get("/api/admin/profile")
+def get_profiler(admin: User = Depends(get_admin_user)):
+    """Routes armed in this API process"""
+    return {"armed": profiler.armed(), "profile_dir": profiler.PROFILE_DIR}
+
 # Contact endpoints
 @app.get("/api/debug/user-info")
 def debug_user_info(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
@@ -469,20 +717,29 @@ async def create_contact(contact_data: ContactCreate, current_user: User = Depen
             raise HTTPException(status_code=403, detail="Access denied: Campaign does not belong to current user")
 
     try:
-        # Resolve identifier to user ID
-        telegram_user_id = await MANAGER.resolve_user_identifier(account, contact_data.identifier.strip())
+        # Resolve identifier to user ID and cache the profile for templates
+        telegram_user_id = await GATEWAY.resolve_user_identifier(account.id, contact_data.identifier.strip())
+        profile = await GATEWAY.get_user_info(account.id, telegram_user_id)
         
         # Create contact
         contact = Contact(
-            id=str(uuid.uuid4()),
+            id=new_id(),
             user_id=current_user.id,
             account_id=contact_data.account_id,
             campaign_id=contact_data.campaign_id,
             telegram_user_id=telegram_user_id,
             name=contact_data.name,
-            tag=contact_data.tag
+            timezone=contact_data.timezone,
+            first_name=profile.get("first_name"),
+            last_name=profile.get("last_name"),
+            username=profile.get("username"),
+            phone=profile.get("phone"),
+            profile_fetched_at=datetime.utcnow()
         )
         db.add(contact)
+        set_contact_tags(db, contact, contact_data.tag)
+        if contact.campaign_id:
+            notify_contacts(db, contact.account_id, [contact.id])
         db.commit()
         
         return ContactResponse.model_validate(contact)
@@ -497,11 +754,28 @@ async def create_contact(contact_data: ContactCreate, current_user: User = Depen
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/contacts", response_model=List[ContactResponse])
-def get_contacts(current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
-    """Get all contacts for current user"""
-    contacts = db.execute(select(Contact).where(Contact.user_id == current_user.id)).scalars().all()
+def get_contacts(tag_id: str | None = None, limit: int | None = Query(None, ge=1, le=500), offset: int = Query(0, ge=0),
+                 current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Get contacts for current user, optionally only those carrying ``tag_id``;
+    with ``limit``, one page of them in descending id order"""
+    q = select(Contact).where(Contact.user_id == current_user.id)
+    if tag_id:
+        q = q.where(tagged(tag_id))
+    if limit is not None:
+        # UUIDv7 ids: newest first (keys converted from uuid4 sort anywhere)
+        q = q.order_by(Contact.id.desc()).limit(limit).offset(offset)
+    contacts = db.execute(q).scalars().all()
     return [ContactResponse.model_validate(contact) for contact in contacts]
 
+@app.get("/api/contacts/search", response_model=ContactSearchPage)
+def search_contacts_endpoint(q: str = Query(..., min_length=MIN_QUERY_LENGTH, max_length=100), limit: int = Query(20, ge=1, le=100),
+                             offset: int = Query(0, ge=0),
+                             current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Typo-tolerant search over name, tag, Telegram name, username, phone and user id"""
+    contacts = search_contacts(db, current_user.id, q, limit, offset)
+    return ContactSearchPage(items=[ContactResponse.model_validate(c) for c in contacts[:limit]],
+                             next_offset=offset + limit if len(contacts) > limit else None)
+
 @app.put("/api/contacts/{contact_id}", response_model=ContactResponse)
 def update_contact(contact_id: str, contact_data: ContactUpdate, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     """Update contact name, tag and campaign assignment"""
@@ -512,7 +786,9 @@ def update_contact(contact_id: str, contact_data: ContactUpdate, current_user: U
     if contact_data.name is not None:
         contact.name = contact_data.name
     if contact_data.tag is not None:
-        contact.tag = contact_data.tag
+        set_contact_tags(db, contact, contact_data.tag)
+    if "timezone" in contact_data.model_fields_set:
+        contact.timezone = contact_data.timezone
     if contact_data.campaign_id is not None:
         # Verify campaign belongs to current user and same account
         if contact_data.campaign_id:
@@ -524,11 +800,32 @@ def update_contact(contact_id: str, contact_data: ContactUpdate, current_user: U
         if contact_data.campaign_id:
             contact.current_step = 1
             contact.replied = False
+            contact.finished = False
             contact.last_message_at = None
+            contact.next_due_at = None
+            contact.send_failures = 0
+            notify_contacts(db, contact.account_id, [contact.id])
     
     db.commit()
     return ContactResponse.model_validate(contact)
 
+@app.get("/api/contacts/{contact_id}/conversation", response_model=ConversationPage)
+def get_contact_conversation(contact_id: str, before: datetime | None = None,
+                             before_direction: Literal["out", "in"] | None = None, before_id: UUID | None = None,
+                             limit: int = Query(50, ge=1, le=200),
+                             current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """Follow-ups sent and replies received, newest first; pass the previous
+    page's next_before* values to continue after its last message"""
+    contact = db.execute(select(Contact.id).where(Contact.id == contact_id, Contact.user_id == current_user.id)).scalar_one_or_none()
+    if not contact:
+        raise HTTPException(404, "Contact not found")
+    messages = conversation(db, contact_id, before, before_direction, str(before_id) if before_id else None, limit)
+    if len(messages) < limit:
+        return ConversationPage(contact_id=contact_id, messages=messages)
+    last = messages[-1]
+    return ConversationPage(contact_id=contact_id, messages=messages, next_before=last["at"],
+                            next_before_direction=last["direction"], next_before_id=last["id"])
+
 @app.delete("/api/contacts/{contact_id}")
 def delete_contact(contact_id: str, current_user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
     """Delete contact"""
@@ -538,6 +835,7 @@ def delete_contact(contact_id: str, current_user: User = Depends(get_current_act
     
     # Delete related messages first
     db.execute(delete(MessageLog).where(MessageLog.contact_id == contact_id, MessageLog.user_id == current_user.id))
+    db.execute(delete(MessageReceived).where(MessageReceived.contact_id == contact_id, MessageReceived.user_id == current_user.id))
     
     # Delete the contact
     db.delete(contact)
@@ -0,0 +1,47 @@
+"""
+Content-addressed storage for step attachments.
+
+Blobs live under MEDIA_DIR at ``<sha256[:2]>/<sha256>``, so identical files
+uploaded by different users or steps are stored once. The API writes them; the
+gateway reads them when it needs to upload to Telegram (both containers mount
+the same volume).
+"""
+from __future__ import annotations
+import hashlib, os, tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "/app/media")
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(50 * 1024 * 1024)))
+CHUNK = 1024 * 1024
+
+def path_for(sha256: str) -> Path:
+    return Path(MEDIA_DIR) / sha256[:2] / sha256
+
+def store(stream: BinaryIO, max_bytes: int = MEDIA_MAX_BYTES) -> tuple[str, int]:
+    """Copy ``stream`` into the store; returns (sha256, size). Raises ValueError
+    when the file is larger than ``max_bytes``."""
+    Path(MEDIA_DIR).mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=MEDIA_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := stream.read(CHUNK):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"File is larger than {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+        sha256 = digest.hexdigest()
+        target = path_for(sha256)
+        if target.exists():
+            os.unlink(tmp)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, target)
+        return sha256, size
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
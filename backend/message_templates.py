@@ -0,0 +1,108 @@
+"""
+Personalized step messages.
+
+Syntax:
+    {first_name}                 value (empty string when missing)
+    {first_name|there}           value, or the fallback when empty
+    {#tag}VIP offer {/tag}       fragment rendered only when tag is set
+    {^first_name}Hi!{/first_name} fragment rendered only when it is empty
+    {{ and }}                    literal braces
+
+Templates compile once per distinct text (so once per step version) into a
+small node tree; rendering walks it against a dict built from columns already
+on the Contact row, so sending never needs a Telegram lookup.
+"""
+from __future__ import annotations
+import re
+from functools import lru_cache
+from typing import Callable
+
+from models import Contact
+
+VARIABLES = ("first_name", "last_name", "full_name", "username", "name", "tag", "step")
+
+class TemplateError(ValueError):
+    pass
+
+_TOKEN = re.compile(r"\{\{|\}\}|\{([#^/]?)([a-z_]+)(?:\|([^{}]*))?\}|\{")
+
+def _parse(source: str) -> list:
+    root: list = []
+    stack: list[tuple[str, list]] = [("", root)]
+    pos = 0
+    for m in _TOKEN.finditer(source):
+        if m.start() > pos:
+            stack[-1][1].append(source[pos:m.start()])
+        pos = m.end()
+        token = m.group(0)
+        if token == "{{":
+            stack[-1][1].append("{")
+            continue
+        if token == "}}":
+            stack[-1][1].append("}")
+            continue
+        if token == "{":
+            raise TemplateError(f"Invalid placeholder at position {m.start()}: use {{{{ for a literal brace")
+        kind, name, default = m.group(1), m.group(2), m.group(3)
+        if name not in VARIABLES:
+            raise TemplateError(f"Unknown placeholder '{name}'. Available: {', '.join(VARIABLES)}")
+        if kind == "/":
+            if stack[-1][0] != name:
+                raise TemplateError(f"Unexpected {{/{name}}}")
+            stack.pop()
+        elif kind in ("#", "^"):
+            children: list = []
+            stack[-1][1].append(("if", name, kind == "^", children))
+            stack.append((name, children))
+        else:
+            stack[-1][1].append(("var", name, default or ""))
+    if pos < len(source):
+        stack[-1][1].append(source[pos:])
+    if len(stack) > 1:
+        raise TemplateError(f"Missing {{/{stack[-1][0]}}}")
+    return root
+
+def _render(nodes: list, ctx: dict, out: list):
+    for node in nodes:
+        if type(node) is str:
+            out.append(node)
+        elif node[0] == "var":
+            out.append(ctx.get(node[1]) or node[2])
+        elif bool(ctx.get(node[1])) != node[2]:
+            _render(node[3], ctx, out)
+
+@lru_cache(maxsize=4096)
+def compile_template(source: str) -> Callable[[dict], str]:
+    """Parse once; raises TemplateError for invalid templates"""
+    nodes = _parse(source)
+    if all(type(n) is str for n in nodes):
+        text = "".join(nodes)
+        return lambda ctx: text
+    def render(ctx: dict) -> str:
+        out: list = []
+        _render(nodes, ctx, out)
+        return "".join(out)
+    return render
+
+def validate(source: str):
+    compile_template(source)
+
+def contact_context(c: Contact) -> dict:
+    full_name = " ".join(p for p in (c.first_name, c.last_name) if p)
+    return {
+        "first_name": c.first_name or "",
+        "last_name": c.last_name or "",
+        "full_name": full_name,
+        "username": c.username or "",
+        "name": c.name or c.first_name or "",
+        "tag": c.tag or "",
+        "step": str(c.current_step),
+    }
+
+def render_for_contact(source: str, c: Contact) -> str:
+    try:
+        template = compile_template(source)
+    except TemplateError:
+        # Steps saved before templates existed may contain bare braces
+        return source
+    return template(contact_context(c))
@@ -0,0 +1,56 @@
+"""
+Prometheus metrics shared by the API, worker and gateway.
+
+Each process exposes the default registry: the API at ``/metrics``, the worker
+and gateway through ``start_metrics_server()`` on METRICS_PORT. Metric updates
+are plain in-memory counter/histogram operations; the DB pool gauges are read
+only when Prometheus scrapes.
+"""
+from __future__ import annotations
+import os
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+from db import engine
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+TICK_DURATION = Histogram(
+    "tg_worker_tick_duration_seconds", "Duration of a worker tick",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+DUE_CONTACTS = Gauge("tg_due_contacts", "Contacts due at the last scan of the account", ["account_id"])
+SEND_BACKLOG = Gauge("tg_send_backlog", "Due contacts left unsent by the last cycle (carried over)", ["account_id"])
+MESSAGES_SENT = Counter("tg_messages_sent_total", "Follow-up messages sent", ["account_id"])
+SEND_ERRORS = Counter("tg_send_errors_total", "Follow-up sends that failed", ["account_id", "error"])
+SEND_LATENCY = Histogram(
+    "tg_send_latency_seconds", "Time to send one follow-up through the gateway",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+SCHEDULING_LAG = Histogram(
+    "tg_scheduling_lag_seconds", "Delay between a step falling due (previous send + interval) and the actual send",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 900, 1800, 3600, 4 * 3600, 24 * 3600),
+)
+CIRCUIT_OPEN = Gauge("tg_account_circuit_open", "1 while the account's circuit breaker is open", ["account_id"])
+FLOOD_WAITS = Counter("tg_flood_wait_total", "FloodWait errors returned by Telegram", ["account_id"])
+REPLY_EVENTS = Counter("tg_reply_events_total", "Incoming messages seen by reply handlers", ["result"])
+REQUEST_LATENCY = Histogram(
+    "tg_http_request_duration_seconds", "API request latency by route",
+    ["method", "route", "status"],
+)
+
+class _PoolCollector:
+    """SQLAlchemy pool state, sampled at scrape time"""
+    def collect(self):
+        pool = engine.pool
+        gauge = GaugeMetricFamily("tg_db_pool_connections", "SQLAlchemy connection pool", labels=["state"])
+        gauge.add_metric(["size"], pool.size())
+        gauge.add_metric(["checked_out"], pool.checkedout())
+        gauge.add_metric(["idle"], pool.checkedin())
+        gauge.add_metric(["overflow"], max(pool.overflow(), 0))
+        yield gauge
+
+REGISTRY.register(_PoolCollector())
+
+def start_metrics_server(port: int = METRICS_PORT):
+    start_http_server(port)
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+Versioned migration runner.
+
+Every migration is registered with a version number and recorded in the
+``schema_version`` table once applied. Startup does a single version check and
+only takes the advisory lock when something is actually pending, so API and
+worker containers booting at the same time no longer race on DDL.
+
+Migrations marked ``transactional=False`` run in autocommit mode, which is
+required for ``CREATE INDEX CONCURRENTLY``.
+
+DDL is spelled out as SQL rather than derived from models.py: a migration has
+to build the same schema it built when it was written, whatever the models
+look like by the time it runs.
+"""
+
+from __future__ import annotations
+import sys, time
+from datetime import datetime
+from typing import Callable, NamedTuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from db import engine
+import partitions
+
+# Arbitrary constant shared by every process running migrations
+ADVISORY_LOCK_KEY = 7_311_026
+LOCK_POLL_SECONDS = 1
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    fn: Callable[[Connection], None]
+    transactional: bool
+
+MIGRATIONS: list[Migration] = []
+
+def migration(version: int, name: str, transactional: bool = True):
+    """Register a migration function under ``version``"""
+    def decorator(fn: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, name, fn, transactional))
+        return fn
+    return decorator
+
+def create_index_concurrently(conn: Connection, name: str, table: str, columns: str, where: str | None = None,
+                              using: str = "btree"):
+    """Build an index without blocking writes; drops a leftover invalid build first"""
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}).scalar()
+    if relkind == "p":
+        # Partitioned parents can't be indexed concurrently; the statement
+        # cascades to every partition
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING {using} ({columns})"
+                          + (f" WHERE {where}" if where else "")))
+        return
+    invalid = conn.execute(text("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :name AND NOT i.indisvalid
+    """), {"name": name}).first()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    sql = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING {using} ({columns})"
+    if where:
+        sql += f" WHERE {where}"
+    conn.execute(text(sql))
+
+# --- Migrations ---
+
+# Schema as it stood before versioned migrations, frozen: later tables and
+# columns are created by their own migrations, so a fresh database takes the
+# same path (varchar keys until migration 4) as an existing one.
+BASELINE_TABLES = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        email VARCHAR NOT NULL UNIQUE,
+        hashed_password VARCHAR NOT NULL,
+        is_active BOOLEAN,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS accounts (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        user_id VARCHAR NOT NULL REFERENCES users(id),
+        phone VARCHAR NOT NULL,
+        name VARCHAR,
+        tag VARCHAR,
+        status VARCHAR,
+        string_session TEXT,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS campaigns (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        user_id VARCHAR NOT NULL REFERENCES users(id),
+        account_id VARCHAR NOT NULL REFERENCES accounts(id),
+        name VARCHAR NOT NULL,
+        interval_seconds INTEGER,
+        max_steps INTEGER,
+        active BOOLEAN
+    )""",
+    """CREATE TABLE IF NOT EXISTS campaign_steps (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        campaign_id VARCHAR NOT NULL REFERENCES campaigns(id),
+        step_number INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        interval_seconds INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS contacts (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        user_id VARCHAR NOT NULL REFERENCES users(id),
+        account_id VARCHAR NOT NULL REFERENCES accounts(id),
+        campaign_id VARCHAR REFERENCES campaigns(id),
+        telegram_user_id BIGINT NOT NULL,
+        name VARCHAR,
+        tag VARCHAR,
+        replied BOOLEAN,
+        current_step INTEGER,
+        last_message_at TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS messages_sent (
+        id VARCHAR NOT NULL PRIMARY KEY,
+        user_id VARCHAR NOT NULL REFERENCES users(id),
+        account_id VARCHAR NOT NULL REFERENCES accounts(id),
+        contact_id VARCHAR NOT NULL REFERENCES contacts(id),
+        step_number INTEGER NOT NULL,
+        sent_at TIMESTAMP
+    )""",
+]
+
+@migration(1, "baseline schema")
+def _baseline(conn: Connection):
+    # Fresh databases get the original tables; older ones get the columns the
+    # previous ad-hoc scripts (migrate_*.py) used to add on every boot.
+    for ddl in BASELINE_TABLES:
+        conn.execute(text(ddl))
+    for table in ("accounts", "campaigns", "contacts", "messages_sent"):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS user_id VARCHAR"))
+    conn.execute(text("ALTER TABLE campaign_steps ADD COLUMN IF NOT EXISTS interval_seconds INTEGER"))
+    conn.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS campaign_id VARCHAR REFERENCES campaigns(id)"))
+    for table in ("accounts", "contacts"):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS name VARCHAR"))
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS tag VARCHAR"))
+
+@migration(2, "hot-path indexes", transactional=False)
+def _hot_path_indexes(conn: Connection):
+    create_index_concurrently(conn, "ix_contacts_campaign_due", "contacts", "campaign_id, replied, last_message_at")
+    create_index_concurrently(conn, "ix_contacts_account_tg_user", "contacts", "account_id, telegram_user_id")
+    create_index_concurrently(conn, "ix_contacts_user_id", "contacts", "user_id")
+    create_index_concurrently(conn, "ix_messages_sent_contact_id", "messages_sent", "contact_id")
+    create_index_concurrently(conn, "ix_messages_sent_user_id", "messages_sent", "user_id")
+    create_index_concurrently(conn, "ix_accounts_user_id", "accounts", "user_id")
+    create_index_concurrently(conn, "ix_campaigns_user_id", "campaigns", "user_id")
+    create_index_concurrently(conn, "ix_campaigns_account_active", "campaigns", "account_id, active")
+    create_index_concurrently(conn, "ix_campaign_steps_campaign", "campaign_steps", "campaign_id, step_number")
+
+@migration(3, "partition messages_sent by month")
+def _partition_messages_sent(conn: Connection):
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('messages_sent')")).scalar()
+    if relkind == "r":
+        # Swap the plain table for a partitioned one and copy the rows over
+        conn.execute(text("ALTER TABLE messages_sent RENAME TO messages_sent_legacy"))
+        conn.execute(text("ALTER TABLE messages_sent_legacy RENAME CONSTRAINT messages_sent_pkey TO messages_sent_legacy_pkey"))
+        conn.execute(text("""
+            CREATE TABLE messages_sent (
+                id VARCHAR NOT NULL,
+                user_id VARCHAR NOT NULL REFERENCES users(id),
+                account_id VARCHAR NOT NULL REFERENCES accounts(id),
+                contact_id VARCHAR NOT NULL REFERENCES contacts(id),
+                step_number INTEGER NOT NULL,
+                sent_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+                PRIMARY KEY (id, sent_at)
+            ) PARTITION BY RANGE (sent_at)
+        """))
+        oldest = conn.execute(text("SELECT MIN(sent_at) FROM messages_sent_legacy")).scalar()
+        month = partitions.month_start(oldest or datetime.utcnow())
+        while month <= datetime.utcnow():
+            partitions.create_partition(conn, month)
+            month = partitions.add_months(month, 1)
+        conn.execute(text("""
+            INSERT INTO messages_sent (id, user_id, account_id, contact_id, step_number, sent_at)
+            SELECT id, user_id, account_id, contact_id, step_number,
+                   COALESCE(sent_at, now() AT TIME ZONE 'utc')
+            FROM messages_sent_legacy
+        """))
+        conn.execute(text("DROP TABLE messages_sent_legacy"))
+    partitions.ensure_partitions(conn)
+    # Cascade to every partition
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_sent_contact_id ON messages_sent (contact_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_sent_user_id ON messages_sent (user_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_sent_sent_at ON messages_sent (sent_at)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_sent_account_sent_at ON messages_sent (account_id, sent_at)"))
+
+UUID_COLUMNS = {
+    "users": ["id"],
+    "accounts": ["id", "user_id"],
+    "campaigns": ["id", "user_id", "account_id"],
+    "campaign_steps": ["id", "campaign_id"],
+    "contacts": ["id", "user_id", "account_id", "campaign_id"],
+    "messages_sent": ["id", "user_id", "account_id", "contact_id"],
+}
+
+@migration(4, "native uuid keys")
+def _native_uuid_keys(conn: Connection):
+    pending = [
+        (table, column) for table, columns in UUID_COLUMNS.items() for column in columns
+        if conn.execute(text("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = :t AND column_name = :c
+        """), {"t": table, "c": column}).scalar() not in (None, "uuid")
+    ]
+    if not pending:
+        return
+    # FKs can't span varchar -> uuid mid-conversion: drop them, convert, restore
+    # them with their original definitions. Partition-level FKs follow the parent.
+    fks = conn.execute(text("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contype = 'f' AND conparentid = 0
+          AND conrelid::regclass::text = ANY(:tables)
+    """), {"tables": list(UUID_COLUMNS)}).all()
+    for table, name, _ in fks:
+        conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+    for table, column in pending:
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE uuid USING {column}::uuid"))
+    for table, name, definition in fks:
+        conn.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'))
+
+@migration(5, "send windows and next_due_at")
+def _send_windows(conn: Connection):
+    conn.execute(text("ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS timezone VARCHAR"))
+    conn.execute(text("ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS send_days INTEGER DEFAULT 127"))
+    conn.execute(text("ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS send_hour_start INTEGER"))
+    conn.execute(text("ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS send_hour_end INTEGER"))
+    conn.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS timezone VARCHAR"))
+    conn.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS next_due_at TIMESTAMP"))
+    # Same rule services.step_interval() applies from now on
+    conn.execute(text("""
+        UPDATE contacts c
+        SET next_due_at = c.last_message_at + make_interval(secs => COALESCE(
+            (SELECT s.interval_seconds FROM campaign_steps s
+             WHERE s.campaign_id = c.campaign_id AND s.step_number = c.current_step
+               AND s.interval_seconds > 0),
+            cp.interval_seconds))
+        FROM campaigns cp
+        WHERE cp.id = c.campaign_id AND c.last_message_at IS NOT NULL AND c.next_due_at IS NULL
+    """))
+
+@migration(6, "next-due index", transactional=False)
+def _next_due_index(conn: Connection):
+    create_index_concurrently(conn, "ix_contacts_campaign_next_due", "contacts", "campaign_id, next_due_at", where="NOT replied")
+
+@migration(7, "per-account send rate")
+def _account_send_rate(conn: Connection):
+    conn.execute(text("ALTER TABLE accounts ADD COLUMN IF NOT EXISTS send_rate_per_minute INTEGER"))
+
+@migration(8, "fair scheduling: priorities and daily quotas")
+def _fair_scheduling(conn: Connection):
+    conn.execute(text("ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS priority INTEGER DEFAULT 1"))
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_send_quota INTEGER"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_daily_sends (
+            user_id UUID NOT NULL REFERENCES users(id),
+            day DATE NOT NULL,
+            sent INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        )
+    """))
+
+@migration(9, "step media attachments")
+def _step_media(conn: Connection):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS media_files (
+            id UUID NOT NULL PRIMARY KEY,
+            user_id UUID NOT NULL REFERENCES users(id),
+            sha256 VARCHAR(64) NOT NULL,
+            filename VARCHAR NOT NULL,
+            mime_type VARCHAR,
+            size BIGINT NOT NULL,
+            created_at TIMESTAMP
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_media_files_user_id ON media_files (user_id)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS media_uploads (
+            account_id UUID NOT NULL REFERENCES accounts(id),
+            sha256 VARCHAR(64) NOT NULL,
+            input_media BYTEA NOT NULL,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (account_id, sha256)
+        )
+    """))
+    conn.execute(text("ALTER TABLE campaign_steps ADD COLUMN IF NOT EXISTS media_id UUID REFERENCES media_files(id)"))
+
+@migration(10, "cached contact profile")
+def _contact_profile(conn: Connection):
+    for column in ("first_name", "last_name", "username"):
+        conn.execute(text(f"ALTER TABLE contacts ADD COLUMN IF NOT EXISTS {column} VARCHAR"))
+
+@migration(11, "worker heartbeats")
+def _worker_heartbeats(conn: Connection):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS worker_heartbeats (
+            worker_id VARCHAR NOT NULL PRIMARY KEY,
+            started_at TIMESTAMP NOT NULL,
+            beat_at TIMESTAMP NOT NULL,
+            last_tick_seconds FLOAT
+        )
+    """))
+
+@migration(12, "campaign config versions")
+def _campaign_versions(conn: Connection):
+    conn.execute(text("ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"))
+
+@migration(13, "worker backlog")
+def _worker_backlog(conn: Connection):
+    conn.execute(text("ALTER TABLE worker_heartbeats ADD COLUMN IF NOT EXISTS backlog INTEGER"))
+
+@migration(14, "account status reason")
+def _account_status_reason(conn: Connection):
+    conn.execute(text("ALTER TABLE accounts ADD COLUMN IF NOT EXISTS status_reason VARCHAR"))
+
+@migration(15, "conversation store")
+def _conversation_store(conn: Connection):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS messages_received (
+            id UUID NOT NULL PRIMARY KEY,
+            user_id UUID NOT NULL REFERENCES users(id),
+            account_id UUID NOT NULL REFERENCES accounts(id),
+            contact_id UUID NOT NULL REFERENCES contacts(id),
+            telegram_message_id BIGINT NOT NULL,
+            message TEXT,
+            received_at TIMESTAMP NOT NULL
+        )
+    """))
+    conn.execute(text("""CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_received_contact_message
+                         ON messages_received (contact_id, telegram_message_id)"""))
+    conn.execute(text("""CREATE INDEX IF NOT EXISTS ix_messages_received_contact_received_at
+                         ON messages_received (contact_id, received_at)"""))
+    conn.execute(text("""CREATE INDEX IF NOT EXISTS ix_messages_received_account_received_at
+                         ON messages_received (account_id, received_at)"""))
+    # Propagates to every partition; metadata-only, no rewrite
+    conn.execute(text("ALTER TABLE messages_sent ADD COLUMN IF NOT EXISTS message TEXT"))
+
+@migration(16, "contact search", transactional=False)
+def _contact_search(conn: Connection):
+    conn.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS phone VARCHAR"))
+    # Trusted extension since PostgreSQL 13: the database owner may create it
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    # Same expression as search.SEARCH_DOCUMENT, spelled out so later edits
+    # there can't change what this migration builds
+    create_index_concurrently(
+        conn, "ix_contacts_search_trgm", "contacts",
+        "(lower(coalesce(name, '') || ' ' || coalesce(tag, '') || ' ' || coalesce(first_name, '') || ' ' "
+        "|| coalesce(last_name, '') || ' ' || coalesce(username, '') || ' ' || coalesce(phone, ''))) gin_trgm_ops",
+        using="gin")
+
+@migration(17, "normalized tags and segments")
+def _tags_and_segments(conn: Connection):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS tags (
+            id UUID NOT NULL PRIMARY KEY,
+            user_id UUID NOT NULL REFERENCES users(id),
+            name VARCHAR NOT NULL,
+            created_at TIMESTAMP
+        )
+    """))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ux_tags_user_name ON tags (user_id, name)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS contact_tags (
+            contact_id UUID NOT NULL REFERENCES contacts(id) ON DELETE CASCADE,
+            tag_id UUID NOT NULL REFERENCES tags(id) ON DELETE CASCADE,
+            PRIMARY KEY (contact_id, tag_id)
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_contact_tags_tag_contact ON contact_tags (tag_id, contact_id)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS segments (
+            id UUID NOT NULL PRIMARY KEY,
+            user_id UUID NOT NULL REFERENCES users(id),
+            name VARCHAR NOT NULL,
+            account_id UUID REFERENCES accounts(id) ON DELETE CASCADE,
+            tag_id UUID REFERENCES tags(id) ON DELETE CASCADE,
+            campaign_id UUID REFERENCES campaigns(id) ON DELETE CASCADE,
+            step INTEGER,
+            replied BOOLEAN,
+            created_at TIMESTAMP
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_segments_user_id ON segments (user_id)"))
+    # Backfill from the free-text Contact.tag, read as a comma-separated list
+    conn.execute(text("""
+        INSERT INTO tags (id, user_id, name, created_at)
+        SELECT gen_random_uuid(), user_id, name, now() AT TIME ZONE 'utc'
+        FROM (
+            SELECT DISTINCT c.user_id, btrim(t.name) AS name
+            FROM contacts c CROSS JOIN LATERAL regexp_split_to_table(c.tag, ',') AS t(name)
+            WHERE c.tag IS NOT NULL
+        ) s
+        WHERE name <> ''
+        ON CONFLICT (user_id, name) DO NOTHING
+    """))
+    conn.execute(text("""
+        INSERT INTO contact_tags (contact_id, tag_id)
+        SELECT DISTINCT c.id, tg.id
+        FROM contacts c CROSS JOIN LATERAL regexp_split_to_table(c.tag, ',') AS t(name)
+        JOIN tags tg ON tg.user_id = c.user_id AND tg.name = btrim(t.name)
+        WHERE c.tag IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """))
+
+@migration(18, "contact send retries")
+def _contact_send_retries(conn: Connection):
+    conn.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS send_failures INTEGER NOT NULL DEFAULT 0"))
+
+@migration(19, "media uploads follow their account")
+def _media_uploads_cascade(conn: Connection):
+    conn.execute(text("ALTER TABLE media_uploads DROP CONSTRAINT IF EXISTS media_uploads_account_id_fkey"))
+    conn.execute(text("""
+        ALTER TABLE media_uploads ADD CONSTRAINT media_uploads_account_id_fkey
+        FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    """))
+
+@migration(20, "finished contacts")
+def _finished_contacts(conn: Connection):
+    conn.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS finished BOOLEAN NOT NULL DEFAULT false"))
+    conn.execute(text("""
+        UPDATE contacts c
+        SET finished = true, next_due_at = NULL
+        FROM campaigns cp
+        WHERE cp.id = c.campaign_id AND c.current_step > cp.max_steps
+    """))
+
+@migration(21, "due index skips finished contacts", transactional=False)
+def _pending_index(conn: Connection):
+    create_index_concurrently(conn, "ix_contacts_campaign_pending", "contacts", "campaign_id, next_due_at",
+                              where="NOT replied AND NOT finished")
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_contacts_campaign_next_due"))
+
+@migration(22, "profile backfill marker", transactional=False)
+def _profile_backfill_marker(conn: Connection):
+    conn.execute(text("ALTER TABLE contacts ADD COLUMN IF NOT EXISTS profile_fetched_at TIMESTAMP"))
+    # Contacts with any cached field were looked up on creation; the rest
+    # (added before migration 10) are left for the worker's backfill
+    conn.execute(text("""
+        UPDATE contacts SET profile_fetched_at = now() AT TIME ZONE 'utc'
+        WHERE profile_fetched_at IS NULL
+          AND COALESCE(first_name, last_name, username, phone) IS NOT NULL
+    """))
+    create_index_concurrently(conn, "ix_contacts_profile_pending", "contacts", "id",
+                              where="profile_fetched_at IS NULL")
+
+@migration(23, "contact search by telegram user id", transactional=False)
+def _search_by_telegram_id(conn: Connection):
+    create_index_concurrently(conn, "ix_contacts_user_tg_user", "contacts", "user_id, telegram_user_id")
+
+# --- Runner ---
+
+def _ensure_version_table(conn: Connection):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+        )
+    """))
+
+def current_version(conn: Connection) -> int:
+    """Return the highest applied version (0 when nothing was ever recorded)"""
+    if conn.execute(text("SELECT to_regclass('schema_version')")).scalar() is None:
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+def latest_version() -> int:
+    return max(m.version for m in MIGRATIONS)
+
+def migrate() -> int:
+    """Apply pending migrations and return the resulting schema version"""
+    target = latest_version()
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        version = current_version(conn)
+        if version >= target:
+            print(f"✅ Schema up to date (version {version})")
+            return version
+
+        # Session-level lock: held across both transactional and concurrent steps.
+        # Polled rather than waited on, since a backend blocked in
+        # pg_advisory_lock keeps a snapshot open and CREATE INDEX CONCURRENTLY
+        # in the holder would wait for it forever.
+        while not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}).scalar():
+            time.sleep(LOCK_POLL_SECONDS)
+        try:
+            _ensure_version_table(conn)
+            # Another process may have finished while we waited for the lock
+            version = current_version(conn)
+            for m in sorted(MIGRATIONS, key=lambda m: m.version):
+                if m.version <= version:
+                    continue
+                print(f"🔄 Applying migration {m.version}: {m.name}")
+                if m.transactional:
+                    with engine.begin() as tx:
+                        m.fn(tx)
+                        tx.execute(text("INSERT INTO schema_version (version, name) VALUES (:v, :n)"),
+                                   {"v": m.version, "n": m.name})
+                else:
+                    m.fn(conn)
+                    conn.execute(text("INSERT INTO schema_version (version, name) VALUES (:v, :n)"),
+                                 {"v": m.version, "n": m.name})
+                version = m.version
+                print(f"✅ Migration {m.version} applied")
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+    return version
+
+if __name__ == "__main__":
+    try:
+        migrate()
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
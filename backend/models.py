@@ -1,15 +1,34 @@
 from __future__ import annotations
+import os, time, uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, BigInteger, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, Float, Boolean, DateTime, Date, BigInteger, ForeignKey, Text, Index, LargeBinary, text
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
-from db import Base, engine
+from db import Base
+
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUID (RFC 9562 v7): 48-bit ms timestamp + random bits.
+    New keys land at the right edge of the btree instead of random pages."""
+    ms = time.time_ns() // 1_000_000
+    value = (ms & 0xFFFF_FFFF_FFFF) << 80 | int.from_bytes(os.urandom(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)   # version
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)   # variant
+    return uuid.UUID(int=value)
+
+def new_id() -> str:
+    return str(uuid7())
+
+# Native uuid column that still reads/writes plain strings, so schemas and
+# callers keep using str ids
+UUIDStr = UUID(as_uuid=False)
 
 class User(Base):
     __tablename__ = "users"
-    id = Column(String, primary_key=True)               # uuid string
+    id = Column(UUIDStr, primary_key=True, default=new_id)
     email = Column(String, unique=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
+    daily_send_quota = Column(Integer, nullable=True)   # null = DAILY_SEND_QUOTA, 0 = unlimited
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
@@ -17,67 +36,225 @@ class User(Base):
 
 class Account(Base):
     __tablename__ = "accounts"
-    id = Column(String, primary_key=True)               # uuid string
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
     phone = Column(String, nullable=False)
     name = Column(String, nullable=True)                # user-friendly name
     tag = Column(String, nullable=True)                 # user tag/label
     status = Column(String, default="pending_code")    # pending_code|active|error
+    status_reason = Column(String, nullable=True)       # why the account went to error
     string_session = Column(Text)                       # encrypted string session
+    send_rate_per_minute = Column(Integer, nullable=True)  # null = SEND_RATE_PER_MINUTE
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="accounts")
     campaigns = relationship("Campaign", back_populates="account")
 
+    __table_args__ = (
+        Index("ix_accounts_user_id", "user_id"),
+    )
+
 class Campaign(Base):
     __tablename__ = "campaigns"
-    id = Column(String, primary_key=True)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
-    account_id = Column(String, ForeignKey("accounts.id"), nullable=False)
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
+    account_id = Column(UUIDStr, ForeignKey("accounts.id"), nullable=False)
     name = Column(String, nullable=False)
     interval_seconds = Column(Integer, default=86400)
     max_steps = Column(Integer, default=3)
     active = Column(Boolean, default=True)
+    priority = Column(Integer, default=1)               # fair-share weight within the account
+    # Sending window in the contact's (or else the campaign's) timezone.
+    # send_days is a bitmask, Monday = 1 ... Sunday = 64; no hours = send any time
+    timezone = Column(String, nullable=True)            # IANA name, e.g. "America/Sao_Paulo"
+    send_days = Column(Integer, default=127)
+    send_hour_start = Column(Integer, nullable=True)    # inclusive, 0-23
+    send_hour_end = Column(Integer, nullable=True)      # exclusive, 1-24
+    # Bumped on every campaign/step edit; the worker's config cache keys on it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     account = relationship("Account", back_populates="campaigns")
     steps = relationship("CampaignStep", back_populates="campaign", order_by="CampaignStep.step_number")
     contacts = relationship("Contact", back_populates="campaign")
 
+    __table_args__ = (
+        Index("ix_campaigns_user_id", "user_id"),
+        Index("ix_campaigns_account_active", "account_id", "active"),
+    )
+
 class CampaignStep(Base):
     __tablename__ = "campaign_steps"
-    id = Column(String, primary_key=True)
-    campaign_id = Column(String, ForeignKey("campaigns.id"), nullable=False)
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    campaign_id = Column(UUIDStr, ForeignKey("campaigns.id"), nullable=False)
     step_number = Column(Integer, nullable=False)
     message = Column(Text, nullable=False)
     # Optional per-step interval; if null, fall back to campaign.interval_seconds
     interval_seconds = Column(Integer, nullable=True)
+    # Optional attachment; the message is sent as its caption
+    media_id = Column(UUIDStr, ForeignKey("media_files.id"), nullable=True)
 
     campaign = relationship("Campaign", back_populates="steps")
 
+    __table_args__ = (
+        Index("ix_campaign_steps_campaign", "campaign_id", "step_number"),
+    )
+
 class Contact(Base):
     __tablename__ = "contacts"
-    id = Column(String, primary_key=True)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
-    account_id = Column(String, ForeignKey("accounts.id"), nullable=False)
-    campaign_id = Column(String, ForeignKey("campaigns.id"), nullable=True)  # specific campaign assignment
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
+    account_id = Column(UUIDStr, ForeignKey("accounts.id"), nullable=False)
+    campaign_id = Column(UUIDStr, ForeignKey("campaigns.id"), nullable=True)  # specific campaign assignment
     telegram_user_id = Column(BigInteger, nullable=False)
     name = Column(String, nullable=True)                # user-friendly name
     tag = Column(String, nullable=True)                 # user tag/label
+    # Telegram profile cached when the contact is created (used by templates);
+    # contacts added before the cache existed are filled in by the worker
+    first_name = Column(String, nullable=True)
+    last_name = Column(String, nullable=True)
+    username = Column(String, nullable=True)
+    phone = Column(String, nullable=True)               # digits only, when Telegram shares it
+    profile_fetched_at = Column(DateTime, nullable=True)  # null = never looked up
     replied = Column(Boolean, default=False)
     current_step = Column(Integer, default=1)
     last_message_at = Column(DateTime, nullable=True)
+    # When the next step is due (null = right away); pushed to the next
+    # window opening when it falls outside the campaign's sending window
+    next_due_at = Column(DateTime, nullable=True)
+    # Consecutive failed sends of the current step (retries back off)
+    send_failures = Column(Integer, nullable=False, default=0, server_default="0")
+    # Past the campaign's last step: nothing is due any more (next_due_at is null)
+    finished = Column(Boolean, nullable=False, default=False, server_default="false")
+    timezone = Column(String, nullable=True)            # overrides campaign.timezone
 
     campaign = relationship("Campaign", back_populates="contacts")
 
+    __table_args__ = (
+        Index("ix_contacts_campaign_due", "campaign_id", "replied", "last_message_at"),
+        Index("ix_contacts_campaign_pending", "campaign_id", "next_due_at",
+              postgresql_where=text("NOT replied AND NOT finished")),
+        Index("ix_contacts_account_tg_user", "account_id", "telegram_user_id"),
+        Index("ix_contacts_user_id", "user_id"),
+        Index("ix_contacts_user_tg_user", "user_id", "telegram_user_id"),
+        Index("ix_contacts_profile_pending", "id", postgresql_where=text("profile_fetched_at IS NULL")),
+    )
+
+class MediaFile(Base):
+    """An uploaded attachment; the bytes live in media_store under sha256"""
+    __tablename__ = "media_files"
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    filename = Column(String, nullable=False)
+    mime_type = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_media_files_user_id", "user_id"),
+    )
+
+class MediaUpload(Base):
+    """Telegram-side reference for a file already uploaded through an account,
+    stored as a serialized InputMedia so it survives gateway restarts"""
+    __tablename__ = "media_uploads"
+    account_id = Column(UUIDStr, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    sha256 = Column(String(64), primary_key=True)
+    input_media = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DailySendCounter(Base):
+    """Messages sent per user per UTC day, for quota checks without counting messages_sent"""
+    __tablename__ = "user_daily_sends"
+    user_id = Column(UUIDStr, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    sent = Column(Integer, nullable=False, default=0)
+
+class WorkerHeartbeat(Base):
+    """Written by each worker process after every tick; read by /readyz"""
+    __tablename__ = "worker_heartbeats"
+    worker_id = Column(String, primary_key=True)   # container hostname
+    started_at = Column(DateTime, nullable=False)
+    beat_at = Column(DateTime, nullable=False)
+    last_tick_seconds = Column(Float, nullable=True)
+    backlog = Column(Integer, nullable=True)          # due contacts carried over by the last tick
+
 class MessageLog(Base):
     __tablename__ = "messages_sent"
-    id = Column(String, primary_key=True)
-    user_id = Column(String, ForeignKey("users.id"), nullable=False)
-    account_id = Column(String, ForeignKey("accounts.id"), nullable=False)
-    contact_id = Column(String, ForeignKey("contacts.id"), nullable=False)
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
+    account_id = Column(UUIDStr, ForeignKey("accounts.id"), nullable=False)
+    contact_id = Column(UUIDStr, ForeignKey("contacts.id"), nullable=False)
     step_number = Column(Integer, nullable=False)
-    sent_at = Column(DateTime, default=datetime.utcnow)
+    message = Column(Text, nullable=True)               # rendered text as sent
+    # Partition key (monthly range partitions, see partitions.py), so it is
+    # part of the primary key
+    sent_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_messages_sent_contact_id", "contact_id"),
+        Index("ix_messages_sent_user_id", "user_id"),
+        Index("ix_messages_sent_sent_at", "sent_at"),
+        Index("ix_messages_sent_account_sent_at", "account_id", "sent_at"),
+        {"postgresql_partition_by": "RANGE (sent_at)"},
+    )
+
+class MessageReceived(Base):
+    """Incoming message from a tracked contact, stored by the gateway's inbox"""
+    __tablename__ = "messages_received"
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
+    account_id = Column(UUIDStr, ForeignKey("accounts.id"), nullable=False)
+    contact_id = Column(UUIDStr, ForeignKey("contacts.id"), nullable=False)
+    telegram_message_id = Column(BigInteger, nullable=False)
+    message = Column(Text, nullable=True)               # null for media-only messages
+    received_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Conversation pages, and idempotent re-delivery of the same message
+        Index("ux_messages_received_contact_message", "contact_id", "telegram_message_id", unique=True),
+        Index("ix_messages_received_contact_received_at", "contact_id", "received_at"),
+        Index("ix_messages_received_account_received_at", "account_id", "received_at"),
+    )
+
+class Tag(Base):
+    """A user's contact label; Contact.tag keeps the comma-separated names for display and templates"""
+    __tablename__ = "tags"
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
+    name = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ux_tags_user_name", "user_id", "name", unique=True),
+    )
+
+class ContactTag(Base):
+    __tablename__ = "contact_tags"
+    contact_id = Column(UUIDStr, ForeignKey("contacts.id", ondelete="CASCADE"), primary_key=True)
+    tag_id = Column(UUIDStr, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        # Contacts carrying a tag (the primary key serves tags of a contact)
+        Index("ix_contact_tags_tag_contact", "tag_id", "contact_id"),
+    )
+
+class Segment(Base):
+    """Saved contact filter; unset predicates match everything"""
+    __tablename__ = "segments"
+    id = Column(UUIDStr, primary_key=True, default=new_id)
+    user_id = Column(UUIDStr, ForeignKey("users.id"), nullable=False)
+    name = Column(String, nullable=False)
+    account_id = Column(UUIDStr, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=True)
+    tag_id = Column(UUIDStr, ForeignKey("tags.id", ondelete="CASCADE"), nullable=True)
+    campaign_id = Column(UUIDStr, ForeignKey("campaigns.id", ondelete="CASCADE"), nullable=True)
+    step = Column(Integer, nullable=True)               # contact's current_step
+    replied = Column(Boolean, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_segments_user_id", "user_id"),
+    )
 
-# create tables on first run
-Base.metadata.create_all(bind=engine)
+# Tables and indexes are created by the versioned runner in migrations.py
@@ -0,0 +1,78 @@
+"""
+Postgres LISTEN/NOTIFY wake-ups for the worker.
+
+The API calls ``notify_*`` inside the request transaction; Postgres delivers
+the event on commit (and drops it on rollback). The worker ``listen``s on a
+dedicated connection and queues a wake-up for only the affected contacts,
+instead of waiting for the next tick.
+"""
+from __future__ import annotations
+import asyncio, json
+from typing import Callable, Iterable
+import psycopg2
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+
+CHANNEL = "tg_schedule"
+# NOTIFY payloads are capped at 8000 bytes; a uuid list entry takes ~40
+MAX_IDS_PER_EVENT = 150
+RECONNECT_DELAY = 5
+
+def _notify(db: Session, payload: dict):
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": json.dumps(payload)})
+
+def notify_campaign(db: Session, account_id: str, campaign_id: str):
+    """Wake the worker for every contact of a campaign"""
+    _notify(db, {"account_id": account_id, "campaign_id": campaign_id})
+
+def notify_contacts(db: Session, account_id: str, contact_ids: Iterable[str]):
+    """Wake the worker for specific contacts of one account"""
+    ids = list(contact_ids)
+    for i in range(0, len(ids), MAX_IDS_PER_EVENT):
+        _notify(db, {"account_id": account_id, "contact_ids": ids[i:i + MAX_IDS_PER_EVENT]})
+
+def notify_profile(db: Session, target: str, runs: int):
+    """Arm the worker's sampling profiler for ``target``"""
+    _notify(db, {"profile": target, "runs": runs})
+
+async def listen(handler: Callable[[dict], None]):
+    """Deliver every event on CHANNEL to ``handler``; reconnects forever.
+    ``handler`` runs on the event loop for each event, so it must only queue
+    work, never do it"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+        except psycopg2.OperationalError as e:
+            print(f"[worker] LISTEN connect failed: {e}")
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+        conn.autocommit = True
+        conn.cursor().execute(f"LISTEN {CHANNEL}")
+        lost = asyncio.Event()
+
+        def on_readable():
+            try:
+                conn.poll()
+            except psycopg2.Error:
+                lost.set()
+                return
+            while conn.notifies:
+                event = conn.notifies.pop(0)
+                try:
+                    payload = json.loads(event.payload)
+                except ValueError:
+                    continue
+                handler(payload)
+
+        loop.add_reader(conn.fileno(), on_readable)
+        print(f"[worker] listening on {CHANNEL}")
+        try:
+            await lost.wait()
+            print("[worker] LISTEN connection lost, reconnecting")
+        finally:
+            loop.remove_reader(conn.fileno())
+            conn.close()
+        await asyncio.sleep(RECONNECT_DELAY)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Monthly range partitions for messages_sent.
+
+``maintain()`` creates partitions ahead of time and applies the retention
+policy to old ones. The worker runs it daily; it can also be run by hand:
+
+    python partitions.py            # create upcoming partitions + retention
+    python partitions.py --dry-run  # only print what retention would do
+"""
+
+from __future__ import annotations
+import gzip, os, re, sys
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from db import engine
+
+PARENT = "messages_sent"
+MONTHS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", "3"))
+# 0 keeps every partition forever
+RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", "0"))
+RETENTION_MODE = os.getenv("MESSAGES_RETENTION_MODE", "detach")  # detach|drop|archive
+ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR", "/app/archive")
+MAINTENANCE_LOCK_KEY = 7_311_027
+
+_NAME_RE = re.compile(rf"^{PARENT}_y(\d{{4}})m(\d{{2}})$")
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+def add_months(dt: datetime, months: int) -> datetime:
+    total = dt.year * 12 + dt.month - 1 + months
+    return datetime(total // 12, total % 12 + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT}_y{month.year:04d}m{month.month:02d}"
+
+def create_partition(conn: Connection, month: datetime):
+    start = month_start(month)
+    end = add_months(start, 1)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF {PARENT} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+def ensure_partitions(conn: Connection, months_ahead: int = MONTHS_AHEAD, now: datetime | None = None):
+    """Make sure the current month and the next ``months_ahead`` months exist"""
+    current = month_start(now or datetime.utcnow())
+    for i in range(months_ahead + 1):
+        create_partition(conn, add_months(current, i))
+
+def list_partitions(conn: Connection) -> list[tuple[str, datetime]]:
+    """Attached partitions of messages_sent with their month, oldest first"""
+    rows = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:parent AS regclass)
+    """), {"parent": PARENT}).scalars()
+    parts = []
+    for name in rows:
+        m = _NAME_RE.match(name)
+        if m:
+            parts.append((name, datetime(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(parts, key=lambda p: p[1])
+
+def archive_partition(conn: Connection, name: str, archive_dir: str = ARCHIVE_DIR) -> Path:
+    """Dump a partition to a gzipped CSV file"""
+    Path(archive_dir).mkdir(parents=True, exist_ok=True)
+    path = Path(archive_dir) / f"{name}.csv.gz"
+    cursor = conn.connection.cursor()
+    try:
+        with gzip.open(path, "wb") as f:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    finally:
+        cursor.close()
+    return path
+
+def apply_retention(conn: Connection, keep_months: int = RETENTION_MONTHS, mode: str = RETENTION_MODE,
+                    now: datetime | None = None, dry_run: bool = False) -> list[str]:
+    """Detach, drop or archive+drop partitions older than ``keep_months``"""
+    if keep_months <= 0:
+        return []
+    if mode not in ("detach", "drop", "archive"):
+        raise ValueError(f"Unknown retention mode: {mode}")
+    cutoff = add_months(month_start(now or datetime.utcnow()), -keep_months)
+    handled = []
+    for name, month in list_partitions(conn):
+        if month >= cutoff:
+            break
+        print(f"🗄️ Retention ({mode}): {name}")
+        if not dry_run:
+            if mode == "archive":
+                path = archive_partition(conn, name)
+                print(f"📦 Archived {name} to {path}")
+            conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+            if mode in ("drop", "archive"):
+                conn.execute(text(f"DROP TABLE {name}"))
+            else:
+                # A detached partition keeps the parent's foreign keys as its
+                # own, which would block deleting the contacts it mentions
+                fks = conn.execute(text("""
+                    SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype = 'f'
+                """), {"t": name}).scalars().all()
+                for fk in fks:
+                    conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{fk}"'))
+        handled.append(name)
+    return handled
+
+def maintain(dry_run: bool = False) -> list[str]:
+    """Create upcoming partitions and apply retention; safe to run from several workers"""
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY}).scalar():
+            return []
+        try:
+            if not dry_run:
+                ensure_partitions(conn)
+            return apply_retention(conn, dry_run=dry_run)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+
+if __name__ == "__main__":
+    maintain(dry_run="--dry-run" in sys.argv)
@@ -0,0 +1,110 @@
+"""
+Opt-in sampling profiler for worker ticks and API routes.
+
+A target ("tick", or a route such as "GET /api/dashboard") is armed for N runs
+via env (PROFILE_TICKS, PROFILE_ROUTE + PROFILE_REQUESTS) or the admin
+endpoint. While an armed run executes, a background thread samples every
+thread's stack each PROFILE_INTERVAL_MS and the result is written to
+PROFILE_DIR in folded-stack format (one ``thread;frame;frame count`` line per
+stack), which flamegraph.pl, speedscope and inferno read directly. Only the
+newest PROFILE_KEEP files are kept. Disarmed targets cost one dict lookup.
+"""
+from __future__ import annotations
+import os, sys, threading, time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/app/profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+_armed: dict[str, int] = {}
+_lock = threading.Lock()
+
+def arm(target: str, runs: int):
+    """Profile the next ``runs`` executions of ``target`` (0 disarms)"""
+    with _lock:
+        if runs > 0:
+            _armed[target] = runs
+        else:
+            _armed.pop(target, None)
+
+def armed() -> dict[str, int]:
+    return dict(_armed)
+
+def _take(target: str) -> bool:
+    with _lock:
+        left = _armed.get(target, 0)
+        if left <= 0:
+            return False
+        if left == 1:
+            del _armed[target]
+        else:
+            _armed[target] = left - 1
+        return True
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.done.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)).replace(";", "_"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+def _write(target: str, stacks: Counter[str], elapsed: float) -> Path:
+    out_dir = Path(PROFILE_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    slug = "".join(ch if ch.isalnum() else "_" for ch in target).strip("_")
+    path = out_dir / f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{slug}.folded"
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    if PROFILE_KEEP > 0:
+        for old in sorted(out_dir.glob("*.folded"), key=lambda p: p.stat().st_mtime)[:-PROFILE_KEEP]:
+            old.unlink(missing_ok=True)
+    print(f"🔥 profile of {target} ({elapsed:.2f}s, {sum(stacks.values())} samples) -> {path}")
+    return path
+
+@contextmanager
+def sample(target: str | None) -> Iterator[None]:
+    """Sample the block if ``target`` is armed, otherwise do nothing"""
+    if not target or not _take(target):
+        yield
+        return
+    sampler = _Sampler(PROFILE_INTERVAL_MS / 1000)
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.done.set()
+        sampler.join()
+        try:
+            _write(target, sampler.stacks, time.perf_counter() - start)
+        except OSError as e:
+            print(f"🔥 writing profile of {target} failed: {e}")
+
+if (_ticks := int(os.getenv("PROFILE_TICKS", "0"))) > 0:
+    arm("tick", _ticks)
+if os.getenv("PROFILE_ROUTE"):
+    arm(os.environ["PROFILE_ROUTE"], int(os.getenv("PROFILE_REQUESTS", "1")))
@@ -0,0 +1,105 @@
+"""
+Per-request / per-tick SQL profiling.
+
+Cursor-execute hooks on the engine add every statement's duration to the
+QueryStats of the current scope (an HTTP request or a worker tick, tracked in a
+ContextVar so it follows sync endpoints into the threadpool and gathered
+tasks). Statements slower than DB_SLOW_QUERY_MS are logged with the scope, and
+a statement repeated DB_N_PLUS_ONE_THRESHOLD times in one scope (typically a
+lazy relationship load inside a loop) is flagged once as a likely N+1.
+
+Loops whose every iteration is meant to run the same statements (the worker's
+sends, one per contact) wrap each iteration in an ``item_scope``: repeats are
+then only counted within the iteration, while the totals still add up in the
+enclosing scope.
+"""
+from __future__ import annotations
+import os, time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+from sqlalchemy import event
+
+from db import engine
+
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "10"))
+# Adds X-DB-Queries / Server-Timing headers to API responses (staging)
+DB_PROFILE_HEADER = os.getenv("DB_PROFILE_HEADER", "false").lower() == "true"
+
+class QueryStats:
+    __slots__ = ("scope", "parent", "count", "seconds", "statements", "flagged")
+
+    def __init__(self, scope: str, parent: QueryStats | None = None):
+        self.scope = scope
+        self.parent = parent
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter[str] = Counter()
+        self.flagged: list[str] = []
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        if self.parent is not None:
+            self.parent.add_time(seconds)
+        if DB_SLOW_QUERY_MS and seconds * 1000 >= DB_SLOW_QUERY_MS:
+            print(f"🐢 slow query ({seconds * 1000:.0f} ms) in {self.scope}: {_summary(statement)}")
+        if DB_N_PLUS_ONE_THRESHOLD:
+            self.statements[statement] += 1
+            if self.statements[statement] == DB_N_PLUS_ONE_THRESHOLD:
+                self.flagged.append(statement)
+                print(f"⚠️ possible N+1 in {self.scope}: {DB_N_PLUS_ONE_THRESHOLD}+ x {_summary(statement)}")
+
+    def add_time(self, seconds: float):
+        """Count a statement of a nested item scope in the totals only"""
+        self.count += 1
+        self.seconds += seconds
+        if self.parent is not None:
+            self.parent.add_time(seconds)
+
+    def summary(self) -> str:
+        return f"{self.count} queries, {self.seconds * 1000:.1f} ms in DB"
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+def _summary(statement: str, limit: int = 200) -> str:
+    flat = " ".join(statement.split())
+    return flat if len(flat) <= limit else flat[:limit] + "..."
+
+@contextmanager
+def profile_scope(scope: str) -> Iterator[QueryStats]:
+    """Attribute the statements run inside the block to ``scope``"""
+    stats = QueryStats(scope)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def item_scope(label: str) -> Iterator[QueryStats]:
+    """One iteration of a loop inside the current scope: its statements count
+    toward the scope's totals, but N+1 detection restarts for each item"""
+    parent = _current.get()
+    stats = QueryStats(f"{parent.scope} / {label}" if parent else label, parent)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+def current_stats() -> QueryStats | None:
+    return _current.get()
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, time.perf_counter() - started)
@@ -1,6 +1,53 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, field_validator
 from typing import Optional, List
 from datetime import datetime
+from zoneinfo import ZoneInfo
+
+def _check_timezone(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return value
+    try:
+        ZoneInfo(value)
+    except Exception:
+        raise ValueError(f"Unknown timezone: {value}")
+    return value
+
+class CampaignScheduleFields(BaseModel):
+    """Scheduling settings (sending window, priority) shared by campaign create/update payloads"""
+    timezone: Optional[str] = None
+    send_days: Optional[int] = None         # bitmask, Monday = 1 ... Sunday = 64
+    send_hour_start: Optional[int] = None   # inclusive, 0-23
+    send_hour_end: Optional[int] = None     # exclusive, 1-24
+
+    _validate_timezone = field_validator("timezone")(_check_timezone)
+
+    @field_validator("priority", check_fields=False)
+    @classmethod
+    def _check_priority(cls, v):
+        if v is not None and not 1 <= v <= 100:
+            raise ValueError("priority must be between 1 and 100")
+        return v
+
+    @field_validator("send_days")
+    @classmethod
+    def _check_days(cls, v):
+        if v is not None and not 1 <= v <= 127:
+            raise ValueError("send_days must be a weekday bitmask between 1 and 127")
+        return v
+
+    @field_validator("send_hour_start")
+    @classmethod
+    def _check_start(cls, v):
+        if v is not None and not 0 <= v <= 23:
+            raise ValueError("send_hour_start must be between 0 and 23")
+        return v
+
+    @field_validator("send_hour_end")
+    @classmethod
+    def _check_end(cls, v):
+        if v is not None and not 1 <= v <= 24:
+            raise ValueError("send_hour_end must be between 1 and 24")
+        return v
 
 # Auth schemas
 class UserCreate(BaseModel):
@@ -15,6 +62,7 @@ class UserResponse(BaseModel):
     id: str
     email: str
     is_active: bool
+    daily_send_quota: Optional[int] = None
     created_at: Optional[datetime]
     
     class Config:
@@ -36,6 +84,14 @@ class AccountCreate(BaseModel):
 class AccountUpdate(BaseModel):
     name: Optional[str] = None
     tag: Optional[str] = None
+    send_rate_per_minute: Optional[int] = None
+
+    @field_validator("send_rate_per_minute")
+    @classmethod
+    def _check_rate(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError("send_rate_per_minute must be positive")
+        return v
 
 class AccountVerify(BaseModel):
     code: str
@@ -48,37 +104,63 @@ class AccountResponse(BaseModel):
     name: Optional[str] = None
     tag: Optional[str] = None
     status: str
+    status_reason: Optional[str] = None
+    send_rate_per_minute: Optional[int] = None
     created_at: Optional[datetime]
     
     class Config:
         from_attributes = True
 
+# Send forecast schemas
+class SendForecast(BaseModel):
+    """Cumulative due sends; overdue ones count toward every horizon"""
+    account_id: str
+    overdue: int
+    next_hour: int
+    next_day: int
+    next_week: int
+
+# Media schemas
+class MediaResponse(BaseModel):
+    id: str
+    filename: str
+    mime_type: Optional[str] = None
+    size: int
+    created_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
 # Campaign schemas
 class CampaignStepCreate(BaseModel):
     step_number: int
     message: str
     interval_seconds: Optional[int] = None
+    media_id: Optional[str] = None
 
 class CampaignStepResponse(BaseModel):
     id: str
     step_number: int
     message: str
     interval_seconds: Optional[int] = None
+    media_id: Optional[str] = None
     
     class Config:
         from_attributes = True
 
-class CampaignCreate(BaseModel):
+class CampaignCreate(CampaignScheduleFields):
     account_id: str
     name: str
     interval_seconds: int = 86400
     max_steps: int = 3
+    priority: int = 1
 
-class CampaignUpdate(BaseModel):
+class CampaignUpdate(CampaignScheduleFields):
     account_id: Optional[str] = None
     name: Optional[str] = None
     interval_seconds: Optional[int] = None
     active: Optional[bool] = None
+    priority: Optional[int] = None
 
 class CampaignResponse(BaseModel):
     id: str
@@ -88,6 +170,11 @@ class CampaignResponse(BaseModel):
     interval_seconds: int
     max_steps: int
     active: bool
+    priority: Optional[int] = 1
+    timezone: Optional[str] = None
+    send_days: Optional[int] = None
+    send_hour_start: Optional[int] = None
+    send_hour_end: Optional[int] = None
     steps: List[CampaignStepResponse] = []
     
     class Config:
@@ -100,11 +187,17 @@ class ContactCreate(BaseModel):
     name: Optional[str] = None
     tag: Optional[str] = None
     campaign_id: Optional[str] = None
+    timezone: Optional[str] = None
+
+    _validate_timezone = field_validator("timezone")(_check_timezone)
 
 class ContactUpdate(BaseModel):
     name: Optional[str] = None
     tag: Optional[str] = None
     campaign_id: Optional[str] = None
+    timezone: Optional[str] = None
+
+    _validate_timezone = field_validator("timezone")(_check_timezone)
 
 class UserInfo(BaseModel):
     id: int
@@ -124,15 +217,77 @@ class ContactResponse(BaseModel):
     telegram_user_id: int
     name: Optional[str] = None
     tag: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    username: Optional[str] = None
+    phone: Optional[str] = None
     current_step: int
     replied: bool
+    finished: bool = False
     last_message_at: Optional[datetime]
+    next_due_at: Optional[datetime] = None
+    timezone: Optional[str] = None
     user_info: Optional[UserInfo] = None
     next_message_time: Optional[str] = None
     
     class Config:
         from_attributes = True
 
+class ContactSearchPage(BaseModel):
+    items: List[ContactResponse]        # best match first
+    next_offset: Optional[int] = None   # pass as ?offset= for the next page
+
+# Conversation schemas
+class ConversationMessage(BaseModel):
+    id: str
+    direction: str                      # out|in
+    at: datetime
+    step_number: Optional[int] = None   # outgoing follow-ups only
+    message: Optional[str] = None
+
+class ConversationPage(BaseModel):
+    contact_id: str
+    messages: List[ConversationMessage]  # newest first
+    # Last message's sort key: pass as ?before=&before_direction=&before_id=
+    # for older messages
+    next_before: Optional[datetime] = None
+    next_before_direction: Optional[str] = None
+    next_before_id: Optional[str] = None
+
+# Tag and segment schemas
+class TagResponse(BaseModel):
+    id: str
+    name: str
+    contacts: int = 0
+
+class SegmentCreate(BaseModel):
+    """Predicates left unset match every contact"""
+    name: str
+    account_id: Optional[str] = None
+    tag_id: Optional[str] = None
+    campaign_id: Optional[str] = None
+    step: Optional[int] = None
+    replied: Optional[bool] = None
+
+class SegmentResponse(SegmentCreate):
+    id: str
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# Admin schemas
+class ProfileRequest(BaseModel):
+    target: str     # "tick" or "<METHOD> <route>", e.g. "GET /api/dashboard"
+    runs: int = 1   # 0 disarms
+
+    @field_validator("runs")
+    @classmethod
+    def _validate_runs(cls, v):
+        if not 0 <= v <= 100:
+            raise ValueError("runs must be between 0 and 100")
+        return v
+
 # Dashboard schema
 class DashboardResponse(BaseModel):
     accounts: List[AccountResponse]
@@ -0,0 +1,76 @@
+"""
+Typo-tolerant contact search.
+
+Every searchable field (name, tag, cached Telegram first/last name, username
+and phone) is folded into one lower-cased document that migration 16 indexes
+with a pg_trgm GIN index. A contact matches when the query is a substring of
+the document or word-similar to part of it (``<%``, at least
+CONTACT_SEARCH_SIMILARITY); substring matches rank first, then by similarity.
+
+Both text predicates are answered from the GIN index, which spans every user:
+candidates come from a bitmap scan rather than a sequential one, then are
+narrowed to the user and ranked, so the cost follows the number of matching
+rows, not the size of the table. A query shorter than three characters has no
+trigram to look up and returns nothing. A numeric query also matches the
+Telegram user id exactly, through its own (user_id, telegram_user_id) index
+lookup in a separate UNION arm: ORed into the text predicates it would force a
+scan of every row of the user.
+"""
+from __future__ import annotations
+import os, re
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from models import Contact
+
+CONTACT_SEARCH_SIMILARITY = float(os.getenv("CONTACT_SEARCH_SIMILARITY", "0.4"))
+# pg_trgm indexes three-character trigrams: anything shorter can't use the index
+MIN_QUERY_LENGTH = 3
+
+# Must stay identical to the indexed expression (ix_contacts_search_trgm)
+SEARCH_DOCUMENT = ("lower(coalesce(name, '') || ' ' || coalesce(tag, '') || ' ' || coalesce(first_name, '') || ' ' "
+                   "|| coalesce(last_name, '') || ' ' || coalesce(username, '') || ' ' || coalesce(phone, ''))")
+
+_PHONE = re.compile(r"^\+?[\d\s().-]{5,}$")
+
+def normalize_query(query: str) -> str:
+    """Lower-case; phone numbers lose their punctuation and a leading @ is dropped"""
+    query = query.strip().lower()
+    if _PHONE.match(query):
+        return re.sub(r"\D", "", query)
+    return query.removeprefix("@")
+
+def _like_pattern(query: str) -> str:
+    return "%" + re.sub(r"([\\%_])", r"\\\1", query) + "%"
+
+def search_contacts(db: Session, user_id: str, query: str, limit: int = 20, offset: int = 0) -> list[Contact]:
+    """One page of the user's best-matching contacts (``limit + 1`` rows at
+    most, so the caller can tell whether another page exists)"""
+    q = normalize_query(query)
+    if len(q) < MIN_QUERY_LENGTH:
+        return []
+    # Transaction-local, so pooled connections keep the default
+    db.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+               {"t": str(CONTACT_SEARCH_SIMILARITY)})
+    params = {"user_id": user_id, "q": q, "pattern": _like_pattern(q), "limit": limit + 1, "offset": offset}
+    arms = [f"""
+        SELECT id, {SEARCH_DOCUMENT} LIKE :pattern AS exact, word_similarity(:q, {SEARCH_DOCUMENT}) AS similarity
+        FROM contacts
+        WHERE user_id = :user_id AND ({SEARCH_DOCUMENT} LIKE :pattern OR :q <% {SEARCH_DOCUMENT})
+    """]
+    if q.isdigit() and len(q) < 19:
+        params["telegram_user_id"] = int(q)
+        arms.append("""
+            SELECT id, true, 1.0 FROM contacts
+            WHERE user_id = :user_id AND telegram_user_id = :telegram_user_id
+        """)
+    stmt = text(f"""
+        SELECT contacts.* FROM (
+            SELECT id, bool_or(exact) AS exact, max(similarity) AS similarity
+            FROM ({" UNION ALL ".join(arms)}) arms
+            GROUP BY id
+        ) m JOIN contacts ON contacts.id = m.id
+        ORDER BY m.exact DESC, m.similarity DESC, contacts.id
+        LIMIT :limit OFFSET :offset
+    """)
+    return list(db.execute(select(Contact).from_statement(stmt), params).scalars())
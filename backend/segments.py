@@ -0,0 +1,81 @@
+"""
+Normalized contact tags and saved segments.
+
+Tags live in ``tags`` with a ``contact_tags`` link table, so a contact can
+carry several and "contacts with tag X" is an index lookup instead of a
+string match. ``Contact.tag`` still holds the comma-separated names for
+display and message templates; ``set_contact_tags`` keeps both in step.
+
+A segment is a saved conjunction of predicates (account, tag, campaign, step,
+replied). Counting or enrolling a segment runs one statement over every
+matching contact, never one request per contact.
+"""
+from __future__ import annotations
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from models import Contact, Tag, ContactTag, Segment, Campaign, new_id
+
+MAX_TAG_LENGTH = 64
+
+def parse_tags(raw: str | None) -> list[str]:
+    """Comma-separated names, stripped and de-duplicated in order"""
+    names = (name.strip()[:MAX_TAG_LENGTH] for name in (raw or "").split(","))
+    return list(dict.fromkeys(name for name in names if name))
+
+def ensure_tags(db: Session, user_id: str, names: list[str]) -> dict[str, str]:
+    """Tag ids by name, creating the missing ones"""
+    if not names:
+        return {}
+    db.execute(insert(Tag).on_conflict_do_nothing(index_elements=["user_id", "name"]),
+               [{"id": new_id(), "user_id": user_id, "name": name} for name in names])
+    rows = db.execute(select(Tag.name, Tag.id).where(Tag.user_id == user_id, Tag.name.in_(names))).all()
+    return {name: tag_id for name, tag_id in rows}
+
+def set_contact_tags(db: Session, contact: Contact, raw: str | None):
+    """Replace the contact's tags with the names in ``raw`` (in the caller's transaction)"""
+    # Sessions don't autoflush: a new contact must exist before its link rows
+    db.flush()
+    names = parse_tags(raw)
+    contact.tag = ", ".join(names) or None
+    ids = ensure_tags(db, contact.user_id, names)
+    db.execute(delete(ContactTag).where(ContactTag.contact_id == contact.id))
+    if ids:
+        db.execute(insert(ContactTag).on_conflict_do_nothing(),
+                   [{"contact_id": contact.id, "tag_id": tag_id} for tag_id in ids.values()])
+
+def tagged(tag_id: str):
+    """Condition: the contact carries ``tag_id``"""
+    return Contact.id.in_(select(ContactTag.contact_id).where(ContactTag.tag_id == tag_id))
+
+def segment_conditions(segment: Segment) -> list:
+    conditions = [Contact.user_id == segment.user_id]
+    if segment.account_id is not None:
+        conditions.append(Contact.account_id == segment.account_id)
+    if segment.tag_id is not None:
+        conditions.append(tagged(segment.tag_id))
+    if segment.campaign_id is not None:
+        conditions.append(Contact.campaign_id == segment.campaign_id)
+    if segment.step is not None:
+        conditions.append(Contact.current_step == segment.step)
+    if segment.replied is not None:
+        conditions.append(Contact.replied == segment.replied)
+    return conditions
+
+def count_segment(db: Session, segment: Segment) -> int:
+    return db.execute(select(func.count()).select_from(Contact).where(*segment_conditions(segment))).scalar_one()
+
+def enroll_segment(db: Session, segment: Segment, campaign: Campaign) -> int:
+    """Move every matching contact of the campaign's account into it at step 1,
+    in one UPDATE; contacts already in the campaign keep their progress.
+    Returns how many were enrolled."""
+    result = db.execute(
+        update(Contact)
+        .where(*segment_conditions(segment), Contact.account_id == campaign.account_id,
+               Contact.campaign_id.is_distinct_from(campaign.id))
+        .values(campaign_id=campaign.id, current_step=1, replied=False, finished=False, last_message_at=None,
+                    next_due_at=None, send_failures=0)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
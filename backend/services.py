@@ -1,76 +1,520 @@
 from __future__ import annotations
-from datetime import datetime, timedelta
-import uuid
-from sqlalchemy import select
+import asyncio, heapq, itertools, math, os, time
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta
+from typing import Iterator
+from sqlalchemy import select, update, or_, text, Row
 from sqlalchemy.orm import Session
 
 # Use absolute imports
 from db import SessionLocal
-from models import Account, Campaign, CampaignStep, Contact, MessageLog
-from telethon_manager import MANAGER
+from models import User, Account, Campaign, CampaignStep, Contact, MessageLog, DailySendCounter, new_id
+from gateway_client import GATEWAY, GatewayError
+from message_templates import render_for_contact
+from clock import utcnow
+from campaign_cache import CAMPAIGNS, CampaignConfig, StepConfig
+from circuit import CIRCUITS
+from metrics import DUE_CONTACTS, MESSAGES_SENT, SEND_ERRORS, SEND_LATENCY, SCHEDULING_LAG, FLOOD_WAITS, SEND_BACKLOG
+from query_stats import item_scope
 
 def uuid_str() -> str:
-    return str(uuid.uuid4())
-
-def due_contacts(db: Session, campaign: Campaign) -> list[Contact]:
-    """Get contacts that are due for next message in this specific campaign"""
-    now = datetime.utcnow()
-    q = db.execute(select(Contact).where(
-        Contact.campaign_id == campaign.id, 
-        Contact.replied == False
-    ))
-    contacts: list[Contact] = list(q.scalars())
-    # Build step lookup including per-step intervals
-    step_by_number: dict[int, CampaignStep] = {s.step_number: s for s in campaign.steps}
-    due = []
-    for c in contacts:
-        if c.current_step > campaign.max_steps:
-            continue
-        if not c.last_message_at:
-            due.append(c)
+    return new_id()
+
+# Traffic shaping defaults; Account.send_rate_per_minute overrides the rate
+SEND_RATE_PER_MINUTE = float(os.getenv("SEND_RATE_PER_MINUTE", "20"))
+# Minimum window a burst of due contacts is spread over (0 = rate only)
+SEND_RAMP_SECONDS = float(os.getenv("SEND_RAMP_SECONDS", "0"))
+SEND_JITTER_SECONDS = float(os.getenv("SEND_JITTER_SECONDS", "5"))
+WORKER_TICK = int(os.getenv("WORKER_TICK", "30"))
+# Default messages per user per UTC day; User.daily_send_quota overrides (0 = unlimited)
+DAILY_SEND_QUOTA = int(os.getenv("DAILY_SEND_QUOTA", "0"))
+# Send budgets (0 = unlimited): attempts per cycle, attempts per account per
+# cycle, and seconds after which a cycle stops starting new sends
+SEND_BUDGET_PER_TICK = int(os.getenv("SEND_BUDGET_PER_TICK", "0"))
+SEND_BUDGET_PER_ACCOUNT = int(os.getenv("SEND_BUDGET_PER_ACCOUNT", "0"))
+SEND_TICK_SECONDS = float(os.getenv("SEND_TICK_SECONDS", str(WORKER_TICK)))
+# Retry delay after a contact-level send failure, doubling per failure
+SEND_RETRY_SECONDS = float(os.getenv("SEND_RETRY_SECONDS", "300"))
+SEND_RETRY_MAX_SECONDS = float(os.getenv("SEND_RETRY_MAX_SECONDS", "86400"))
+# Due contacts fetched per round trip while streaming
+WORKER_CHUNK_SIZE = int(os.getenv("WORKER_CHUNK_SIZE", "500"))
+# Contacts whose Telegram profile was never cached, looked up per backfill run
+PROFILE_BACKFILL_BATCH = int(os.getenv("PROFILE_BACKFILL_BATCH", "50"))
+
+# Due contacts each account left unsent in its last full cycle
+BACKLOG: dict[str, int] = {}
+# Set on shutdown: cycles stop before their next send
+STOPPING = asyncio.Event()
+
+# One lock per account, held around each send: the tick and NOTIFY wake-ups
+# may stream the same contact, but whichever sends second finds it advanced
+# (still_due) and skips it
+_account_locks: dict[str, asyncio.Lock] = {}
+
+def account_lock(account_id: str) -> asyncio.Lock:
+    return _account_locks.setdefault(account_id, asyncio.Lock())
+
+def step_interval(campaign: Campaign, steps: dict[int, CampaignStep], step_number: int) -> int:
+    """Seconds to wait before sending ``step_number``: step override if positive,
+    otherwise the campaign default"""
+    step = steps.get(step_number)
+    if step and step.interval_seconds and step.interval_seconds > 0:
+        return step.interval_seconds
+    return campaign.interval_seconds
+
+# What the send path reads from a contact (incl. template variables)
+DUE_COLUMNS = (Contact.id, Contact.telegram_user_id, Contact.current_step, Contact.next_due_at,
+               Contact.last_message_at, Contact.send_failures, Contact.name, Contact.tag, Contact.first_name, Contact.last_name, Contact.username)
+
+def due_contacts(db: Session, campaign: Campaign, contact_ids: list[str] | None = None,
+                 now: datetime | None = None, chunk: int = WORKER_CHUNK_SIZE) -> Iterator[Row]:
+    """Contacts due for their next message in this campaign, oldest first.
+
+    Rows carry only DUE_COLUMNS and are streamed from a server-side cursor
+    ``chunk`` at a time, so memory stays flat however many are due. The
+    query runs when called, not on first iteration. The cursor lives in
+    ``db``'s transaction: don't commit ``db`` while iterating."""
+    now = now or utcnow()
+    conditions = [
+        Contact.campaign_id == campaign.id,
+        Contact.replied == False,
+        Contact.finished == False,
+        Contact.current_step <= campaign.max_steps,
+        or_(Contact.next_due_at.is_(None), Contact.next_due_at <= now),
+    ]
+    if contact_ids is not None:
+        conditions.append(Contact.id.in_(contact_ids))
+    return iter(db.execute(select(*DUE_COLUMNS).where(*conditions)
+                           .order_by(Contact.next_due_at.asc().nullsfirst())
+                           .execution_options(yield_per=chunk)))
+
+def still_due(db: Session, camp: CampaignConfig, c: Row) -> bool:
+    """Whether a streamed contact is still waiting for the same step (another
+    cycle may have sent it, or the contact replied, since it was read)"""
+    return db.execute(select(Contact.id).where(
+        Contact.id == c.id, Contact.campaign_id == camp.id,
+        Contact.current_step == c.current_step, Contact.replied == False,
+    )).first() is not None
+
+# Interval for each contact's current step, per step_interval()
+_STEP_INTERVAL_SQL = """
+    COALESCE(
+        (SELECT s.interval_seconds FROM campaign_steps s
+         WHERE s.campaign_id = c.campaign_id AND s.step_number = c.current_step
+           AND s.interval_seconds > 0),
+        cp.interval_seconds)
+"""
+
+# Due contacts of each campaign ``cp`` (never sent, or next_due_at passed), as
+# two range scans of ix_contacts_campaign_pending per campaign. Written as one
+# OR, Postgres reads every tenant's due contacts and joins them to the account.
+_DUE_CONTACTS_SQL = """
+    CROSS JOIN LATERAL (
+        SELECT c.id, c.next_due_at, c.timezone FROM contacts c
+        WHERE c.campaign_id = cp.id AND NOT c.replied AND NOT c.finished
+          AND c.current_step <= cp.max_steps AND c.next_due_at IS NULL
+        UNION ALL
+        SELECT c.id, c.next_due_at, c.timezone FROM contacts c
+        WHERE c.campaign_id = cp.id AND NOT c.replied AND NOT c.finished
+          AND c.current_step <= cp.max_steps AND c.next_due_at <= :now
+    ) c
+"""
+
+def reschedule_campaign(db: Session, campaign_id: str):
+    """Recompute next_due_at for a campaign's contacts after an interval change"""
+    db.execute(text(f"""
+        UPDATE contacts c
+        SET next_due_at = c.last_message_at + make_interval(secs => {_STEP_INTERVAL_SQL})
+        FROM campaigns cp
+        WHERE cp.id = c.campaign_id AND c.campaign_id = :campaign_id
+          AND c.last_message_at IS NOT NULL AND NOT c.finished
+    """), {"campaign_id": campaign_id})
+
+def defer_outside_window(db: Session, account_id: str, now: datetime | None = None) -> int:
+    """Push due contacts whose local time is outside their campaign's sending
+    window to the next window opening, in a single UPDATE. Returns rows moved."""
+    result = db.execute(text(f"""
+        WITH due AS (
+            SELECT c.id, w.tz, cp.send_days, cp.send_hour_start, cp.send_hour_end,
+                   (CAST(:now AS timestamp) AT TIME ZONE 'UTC') AT TIME ZONE w.tz AS local_now
+            FROM campaigns cp
+            {_DUE_CONTACTS_SQL}
+            CROSS JOIN LATERAL (SELECT COALESCE(c.timezone, cp.timezone, 'UTC') AS tz) w
+            WHERE cp.account_id = :account_id AND cp.active AND cp.send_hour_start IS NOT NULL
+        )
+        UPDATE contacts c
+        SET next_due_at = COALESCE((
+            SELECT (MIN(o.opening) AT TIME ZONE d.tz) AT TIME ZONE 'UTC'
+            FROM generate_series(0, 7) AS g(n)
+            CROSS JOIN LATERAL (
+                SELECT date_trunc('day', d.local_now)
+                       + make_interval(days => g.n, hours => d.send_hour_start) AS opening
+            ) o
+            WHERE o.opening > d.local_now
+              AND ((d.send_days >> (EXTRACT(ISODOW FROM o.opening)::int - 1)) & 1) = 1
+        ), c.next_due_at)
+        FROM due d
+        WHERE c.id = d.id AND NOT (
+            ((d.send_days >> (EXTRACT(ISODOW FROM d.local_now)::int - 1)) & 1) = 1
+            AND EXTRACT(HOUR FROM d.local_now) >= d.send_hour_start
+            AND EXTRACT(HOUR FROM d.local_now) < d.send_hour_end
+        )
+    """), {"account_id": account_id, "now": now or utcnow()})
+    return result.rowcount
+
+def shape_due(db: Session, account: Account, now: datetime | None = None,
+              tick_seconds: int = WORKER_TICK) -> int:
+    """Spread a burst of due contacts at the account's target rate.
+
+    The first ``rate * tick`` due contacts (oldest due first, never-sent
+    first) stay due; the rest get slots ``k * spacing`` seconds out plus random
+    jitter, in one UPDATE. Returns the number of contacts moved."""
+    rate = account.send_rate_per_minute or SEND_RATE_PER_MINUTE
+    allowance = max(1, math.ceil(rate * tick_seconds / 60))
+    result = db.execute(text(f"""
+        WITH due AS (
+            SELECT c.id,
+                   row_number() OVER (ORDER BY c.next_due_at NULLS FIRST, c.id) - 1 AS k,
+                   count(*) OVER () AS total
+            FROM campaigns cp
+            {_DUE_CONTACTS_SQL}
+            WHERE cp.account_id = :account_id AND cp.active
+        )
+        UPDATE contacts c
+        SET next_due_at = CAST(:now AS timestamp) + make_interval(secs =>
+            d.k * GREATEST(60.0 / :rate, :ramp / d.total) + random() * :jitter)
+        FROM due d
+        WHERE c.id = d.id AND d.k >= :allowance
+    """), {
+        "account_id": account.id, "now": now or utcnow(), "rate": rate,
+        "ramp": SEND_RAMP_SECONDS, "jitter": SEND_JITTER_SECONDS, "allowance": allowance,
+    })
+    return result.rowcount
+
+FORECAST_HORIZONS = {"next_hour": timedelta(hours=1), "next_day": timedelta(days=1),
+                     "next_week": timedelta(weeks=1)}
+
+def forecast_due(db: Session, account_id: str, now: datetime | None = None) -> dict[str, int]:
+    """Sends due per horizon for an account's active campaigns (cumulative,
+    including what is already overdue).
+
+    One pass over the account's pending contacts due within the week; the
+    worker, which only needs what is due now, uses count_due."""
+    now = now or utcnow()
+    row = db.execute(text("""
+        SELECT count(*) FILTER (WHERE c.next_due_at IS NULL OR c.next_due_at <= :now) AS overdue,
+               count(*) FILTER (WHERE c.next_due_at IS NULL OR c.next_due_at <= :hour) AS next_hour,
+               count(*) FILTER (WHERE c.next_due_at IS NULL OR c.next_due_at <= :day) AS next_day,
+               count(*) AS next_week
+        FROM campaigns cp
+        JOIN contacts c ON c.campaign_id = cp.id
+        WHERE cp.account_id = :account_id AND cp.active AND NOT c.replied AND NOT c.finished
+          AND c.current_step <= cp.max_steps
+          AND (c.next_due_at IS NULL OR c.next_due_at <= :week)
+    """), {
+        "account_id": account_id, "now": now,
+        **{key.removeprefix("next_"): now + span for key, span in FORECAST_HORIZONS.items()},
+    }).mappings().one()
+    return dict(row)
+
+def count_due(db: Session, account_id: str, now: datetime | None = None) -> int:
+    """Contacts of an account's active campaigns due now (forecast_due's
+    ``overdue``), from index range scans only as deep as what is due"""
+    return db.execute(text(f"""
+        SELECT count(*) FROM campaigns cp
+        {_DUE_CONTACTS_SQL}
+        WHERE cp.account_id = :account_id AND cp.active
+    """), {"account_id": account_id, "now": now or utcnow()}).scalar_one()
+
+def conversation(db: Session, contact_id: str, before: datetime | None = None, before_direction: str | None = None,
+                 before_id: str | None = None, limit: int = 50) -> list[dict]:
+    """Newest-first page of a contact's sent and received messages.
+
+    Messages are ordered by (at, direction, id), which is unique, so a page
+    starting after the previous page's last message neither skips nor repeats
+    messages sharing a timestamp. With only ``before``, the page starts at
+    messages strictly older than it.
+
+    Both sides are index lookups by contact_id (a contact has at most
+    max_steps sends; replies use their (contact_id, received_at) index),
+    each limited to ``limit`` rows before the merge."""
+    key = {"before": before or datetime.max, "before_direction": before_direction,
+           "before_id": before_id if before_direction else None}
+    return [dict(row) for row in db.execute(text("""
+        (SELECT 'out' AS direction, sent_at AS at, CAST(id AS varchar) AS id, step_number, message
+         FROM messages_sent
+         WHERE contact_id = :contact_id AND sent_at <= :before
+           AND (sent_at < :before OR ('out', id) < (CAST(:before_direction AS varchar), CAST(:before_id AS uuid)))
+         ORDER BY sent_at DESC, id DESC LIMIT :limit)
+        UNION ALL
+        (SELECT 'in', received_at, CAST(id AS varchar), NULL, message
+         FROM messages_received
+         WHERE contact_id = :contact_id AND received_at <= :before
+           AND (received_at < :before OR ('in', id) < (CAST(:before_direction AS varchar), CAST(:before_id AS uuid)))
+         ORDER BY received_at DESC, id DESC LIMIT :limit)
+        ORDER BY at DESC, direction DESC, id DESC
+        LIMIT :limit
+    """), {"contact_id": contact_id, "limit": limit, **key}).mappings()]
+
+def fair_order(queues: dict[str, Iterator], weights: dict[str, float]) -> Iterator[tuple[str, object]]:
+    """Weighted fair interleaving of several queues.
+
+    Each queue's n-th item gets virtual finish time n / weight and items are
+    yielded in finish-time order, so a queue with weight 2 gets twice the
+    turns of a weight-1 queue but no queue waits for another to drain."""
+    heap = []
+    for i, key in enumerate(queues):
+        heap.append((1 / weights.get(key, 1), i, key))
+    heapq.heapify(heap)
+    while heap:
+        finish, i, key = heapq.heappop(heap)
+        item = next(queues[key], None)
+        if item is None:
             continue
-        # Determine interval for the next message: step-specific overrides campaign default
-        current_step = c.current_step
-        step = step_by_number.get(current_step)
-        # Use step override if positive; otherwise fall back to campaign default
-        if step and step.interval_seconds and step.interval_seconds > 0:
-            interval_seconds = step.interval_seconds
-        else:
-            interval_seconds = campaign.interval_seconds
-
-        delta = now - c.last_message_at
-        if delta.total_seconds() >= interval_seconds:
-            due.append(c)
-    return due
-
-async def send_followups_for_account(account: Account):
-    client = await MANAGER.get_client(account)
-    await MANAGER.ensure_reply_handler(account)
+        yield key, item
+        heapq.heappush(heap, (finish + 1 / weights.get(key, 1), i, key))
+
+def sends_today(db: Session, user_ids: list[str], today: date | None = None) -> dict[str, int]:
+    rows = db.execute(select(DailySendCounter.user_id, DailySendCounter.sent).where(
+        DailySendCounter.user_id.in_(user_ids),
+        DailySendCounter.day == (today or utcnow().date())
+    )).all()
+    return {user_id: sent for user_id, sent in rows}
+
+def count_send(db: Session, user_id: str, today: date | None = None):
+    """Bump the user's daily counter in the caller's transaction"""
+    db.execute(text("""
+        INSERT INTO user_daily_sends (user_id, day, sent) VALUES (:user_id, :day, 1)
+        ON CONFLICT (user_id, day) DO UPDATE SET sent = user_daily_sends.sent + 1
+    """), {"user_id": user_id, "day": today or utcnow().date()})
+
+def _tagged(prefix: tuple, items) -> Iterator[tuple]:
+    for item in items:
+        yield (*prefix, *(item if isinstance(item, tuple) else (item,)))
+
+def _plan_account(db: Session, reader: Session, account: Account, campaign_id: str | None,
+                  contact_ids: list[str] | None
+                  ) -> tuple[int | None, Iterator[tuple[CampaignConfig, dict[int, StepConfig], Row]]]:
+    """Due (campaign, steps, contact) triples for one account, campaigns
+    interleaved by priority, plus how many contacts are due (full scans only).
+    Contacts stream through ``reader`` so that sends can commit on ``db``
+    without closing the cursors."""
+    defer_outside_window(db, account.id)
+    demand = None
+    if contact_ids is None and campaign_id is None:
+        # Counted before shaping spreads the burst out
+        demand = count_due(db, account.id)
+        DUE_CONTACTS.labels(account.id).set(demand)
+    shape_due(db, account)
+    db.commit()
+    camps = CAMPAIGNS.for_account(db, account.id)
+    if campaign_id is not None:
+        camps = [camp for camp in camps if camp.id == campaign_id]
+    queues = {camp.id: _tagged((camp, camp.steps), due_contacts(reader, camp, contact_ids)) for camp in camps}
+    weights = {camp.id: max(camp.priority, 1) for camp in camps}
+    return demand, (item for _, item in fair_order(queues, weights))
+
+async def _send_one(db: Session, account: Account, camp: CampaignConfig, steps: dict[int, StepConfig],
+                    c: Row) -> bool:
+    step = steps.get(c.current_step)
+    msg = step.message if step else None
+    if not msg and not (step and step.media_id):
+        # Nothing to send at this step: the sequence ends here rather than
+        # leaving the contact due forever
+        db.execute(update(Contact).where(Contact.id == c.id).values(
+            current_step=camp.max_steps + 1, finished=True, next_due_at=None))
+        db.commit()
+        return False
+    try:
+        rendered = render_for_contact(msg, c) if msg else msg
+        # Original due time: next_due_at is moved by shaping, windows and retries
+        due_at = (c.last_message_at + timedelta(seconds=step_interval(camp, steps, c.current_step))
+                  if c.last_message_at else None)
+        with SEND_LATENCY.time():
+            await GATEWAY.send_message(account.id, c.telegram_user_id, rendered, step.media_id)
+        sent_at = utcnow()
+        next_step = c.current_step + 1
+        finished = next_step > camp.max_steps
+        db.execute(update(Contact).where(Contact.id == c.id).values(
+            current_step=next_step,
+            last_message_at=sent_at,
+            next_due_at=None if finished else sent_at + timedelta(seconds=step_interval(camp, steps, next_step)),
+            finished=finished,
+            send_failures=0,
+        ))
+        db.add(MessageLog(
+            id=uuid_str(), 
+            user_id=account.user_id,
+            account_id=account.id, 
+            contact_id=c.id, 
+            step_number=c.current_step,
+            message=rendered,
+            sent_at=sent_at
+        ))
+        count_send(db, account.user_id)
+        db.commit()
+        CIRCUITS.success(account.id)
+        MESSAGES_SENT.labels(account.id).inc()
+        if due_at is not None:
+            SCHEDULING_LAG.observe(max((sent_at - due_at).total_seconds(), 0))
+        return True
+    except Exception as e:
+        # The session is shared by the whole cycle: a failed flush must not
+        # leave it unusable for the bookkeeping below and the sends after
+        db.rollback()
+        error = e.type if isinstance(e, GatewayError) else type(e).__name__
+        SEND_ERRORS.labels(account.id, error).inc()
+        if error == "FloodWaitError":
+            FLOOD_WAITS.labels(account.id).inc()
+        if CIRCUITS.record(db, account.id, error, str(e)) is None:
+            # Contact-level failure (blocked, privacy, bad template...): back
+            # off instead of staying first in the queue
+            delay = min(SEND_RETRY_SECONDS * 2 ** min(c.send_failures, 16), SEND_RETRY_MAX_SECONDS)
+            db.execute(update(Contact).where(Contact.id == c.id).values(
+                send_failures=Contact.send_failures + 1, next_due_at=utcnow() + timedelta(seconds=delay)))
+            db.commit()
+        return False
 
+async def run_send_cycle(accounts: list[Account], campaign_id: str | None = None,
+                         contact_ids: list[str] | None = None) -> int:
+    """Send due follow-ups for several accounts fairly.
+
+    Users take turns one send at a time (each user's accounts in turn), so a
+    tenant with a huge campaign can't starve the others, and a user stops once
+    their daily quota is used up. The cycle also stops at SEND_BUDGET_PER_TICK
+    attempts or after SEND_TICK_SECONDS, and each account at
+    SEND_BUDGET_PER_ACCOUNT; whatever doesn't fit stays due and goes first next
+    time (oldest due first). Once STOPPING is set no new send starts, and a
+    cancelled cycle still finishes (and records) the send in flight. Returns
+    the number of messages sent."""
+    sent = attempts = 0
+    deadline = time.monotonic() + SEND_TICK_SECONDS if SEND_TICK_SECONDS > 0 else math.inf
+    full_scan = campaign_id is None and contact_ids is None
+    demand: dict[str, int] = {}
+    sent_by_account: dict[str, int] = {}
+    with ExitStack() as stack:
+        with SessionLocal() as db:
+            users = {u.id: u for u in db.execute(select(User).where(
+                User.id.in_({a.user_id for a in accounts}))).scalars()}
+            used = sends_today(db, list(users))
+        remaining = {}
+        for user_id, user in users.items():
+            quota = user.daily_send_quota if user.daily_send_quota is not None else DAILY_SEND_QUOTA
+            remaining[user_id] = quota - used.get(user_id, 0) if quota > 0 else math.inf
+
+        # Per-account plans. Every account shares one write session and one
+        # streaming session (its cursors coexist in the reader's transaction),
+        # so a cycle holds two pooled connections however many accounts it serves.
+        # Accounts loaded for the plans aren't expired by each send's commit,
+        # which would reload every one of them once per send
+        db = stack.enter_context(SessionLocal(expire_on_commit=False))
+        reader = stack.enter_context(SessionLocal())
+        per_user: dict[str, list[Iterator]] = {}
+        for account in accounts:
+            # Same statements for every account
+            with item_scope(f"plan {account.id}"):
+                db_acc = db.get(Account, account.id)
+                if (not db_acc or db_acc.status != "active" or remaining.get(db_acc.user_id, 0) <= 0
+                        or not CIRCUITS.allows(db_acc.id)):
+                    continue
+                demand[db_acc.id], plan = _plan_account(db, reader, db_acc, campaign_id, contact_ids)
+            if SEND_BUDGET_PER_ACCOUNT > 0:
+                plan = itertools.islice(plan, SEND_BUDGET_PER_ACCOUNT)
+            # Stop streaming this account's contacts as soon as its circuit opens
+            plan = itertools.takewhile(lambda _, account_id=db_acc.id: CIRCUITS.allows(account_id), plan)
+            sent_by_account[db_acc.id] = 0
+            per_user.setdefault(db_acc.user_id, []).append(_tagged((db, db_acc), plan))
+
+        def round_robin(user_id: str, plans: list[Iterator]) -> Iterator:
+            # Ends once the user's quota is used up, which drops them from
+            # fair_order without streaming the rest of their contacts
+            while plans:
+                for plan in list(plans):
+                    if remaining[user_id] <= 0:
+                        return
+                    item = next(plan, None)
+                    if item is None:
+                        plans.remove(plan)
+                    else:
+                        yield item
+
+        queues = {user_id: round_robin(user_id, plans) for user_id, plans in per_user.items()}
+        for user_id, (db, account, camp, steps, contact) in fair_order(queues, {}):
+            if (STOPPING.is_set() or (SEND_BUDGET_PER_TICK > 0 and attempts >= SEND_BUDGET_PER_TICK)
+                    or time.monotonic() >= deadline):
+                break
+            # Every send runs the same handful of statements: checked for N+1
+            # per send, not across the cycle
+            async with account_lock(account.id):
+                with item_scope(f"send {contact.id}"):
+                    if not still_due(db, camp, contact):
+                        continue
+                    attempts += 1
+                    # The task copies the context, item scope included
+                    send = asyncio.ensure_future(_send_one(db, account, camp, steps, contact))
+                    try:
+                        ok = await asyncio.shield(send)
+                    except asyncio.CancelledError:
+                        # Never abandon a send between the gateway call and its commit:
+                        # that would repeat the step after a restart
+                        await asyncio.wait({send})
+                        raise
+            if ok:
+                remaining[user_id] -= 1
+                sent_by_account[account.id] += 1
+                sent += 1
+    if full_scan:
+        for account_id, count in sent_by_account.items():
+            BACKLOG[account_id] = max(demand[account_id] - count, 0)
+            SEND_BACKLOG.labels(account_id).set(BACKLOG[account_id])
+    return sent
+
+async def send_followups_for_account(account: Account, campaign_id: str | None = None,
+                                     contact_ids: list[str] | None = None):
+    """Send due follow-ups for an account; ``campaign_id``/``contact_ids`` narrow
+    the scan to what a NOTIFY wake-up reported"""
+    if not CIRCUITS.allows(account.id):
+        return
+    await GATEWAY.ensure_reply_handler(account.id)
+    await run_send_cycle([account], campaign_id, contact_ids)
+
+async def backfill_profiles(batch: int = PROFILE_BACKFILL_BATCH) -> int:
+    """Cache the Telegram profile of up to ``batch`` contacts that never had
+    one looked up (added before the profile columns existed), so templates
+    and the dashboard see their names. Returns how many were filled in."""
     with SessionLocal() as db:
-        db_acc = db.get(Account, account.id)
-        if not db_acc or db_acc.status != "active":
-            return
-        camps = db.execute(select(Campaign).where(Campaign.account_id==account.id, Campaign.active==True)).scalars()
-        for camp in camps:
-            steps = {s.step_number: s for s in camp.steps}
-            for c in due_contacts(db, camp):  # Now using campaign-specific contacts
-                step = steps.get(c.current_step)
-                msg = step.message if step else None
-                if not msg:
+        rows = db.execute(
+            select(Contact.id, Contact.account_id, Contact.telegram_user_id)
+            .join(Account, Account.id == Contact.account_id)
+            .where(Contact.profile_fetched_at.is_(None), Account.status == "active")
+            .order_by(Contact.id).limit(batch)
+        ).all()
+    rows = [r for r in rows if CIRCUITS.allows(r.account_id)]
+    if not rows:
+        return 0
+    # Gathered so the gateway client sends them as one batch
+    profiles = await asyncio.gather(*(GATEWAY.get_user_info(r.account_id, r.telegram_user_id) for r in rows),
+                                    return_exceptions=True)
+    filled = 0
+    failed: set[str] = set()
+    with SessionLocal() as db:
+        for r, profile in zip(rows, profiles):
+            if isinstance(profile, Exception):
+                error = profile.type if isinstance(profile, GatewayError) else type(profile).__name__
+                # Account-level errors go through the circuit breaker (once per
+                # account) and are retried; anything else ends the lookup
+                if r.account_id in failed:
+                    continue
+                if CIRCUITS.record(db, r.account_id, error, str(profile)) is not None:
+                    failed.add(r.account_id)
                     continue
-                try:
-                    await client.send_message(c.telegram_user_id, msg)
-                    c.current_step += 1
-                    c.last_message_at = datetime.utcnow()
-                    db.add(MessageLog(
-                        id=uuid_str(), 
-                        user_id=account.user_id,
-                        account_id=account.id, 
-                        contact_id=c.id, 
-                        step_number=c.current_step-1
-                    ))
-                    db.commit()
-                except Exception as e:
-                    # log or mark error; keep going
-                    db.commit()
+                profile = {"error": str(profile)}
+            # A profile Telegram won't resolve comes back with an "error" key
+            # and empty fields: recorded as looked up all the same
+            db.execute(update(Contact).where(Contact.id == r.id).values(
+                first_name=profile.get("first_name"), last_name=profile.get("last_name"),
+                username=profile.get("username"), phone=profile.get("phone"),
+                profile_fetched_at=utcnow()))
+            filled += "error" not in profile
+        db.commit()
+    return filled
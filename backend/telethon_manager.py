@@ -3,13 +3,21 @@ import os, asyncio, uuid
 from typing import Dict
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
-from telethon.errors import SessionPasswordNeededError
+from telethon.errors import SessionPasswordNeededError, FileReferenceExpiredError, FilePartMissingError, MediaEmptyError
+from telethon.extensions import BinaryReader
+from telethon import utils
 from sqlalchemy import select
 from sqlalchemy.orm import Session
+from datetime import datetime, timezone
 
 # Use absolute imports
 from db import SessionLocal
-from models import Account, Contact
+from models import Account, Contact, MediaFile, MediaUpload
+import media_store
+from inbox import INBOX, Incoming
+
+# Telegram captions are capped; longer step messages go out as a separate text
+CAPTION_LIMIT = 1024
 
 API_ID = int(os.getenv("TG_API_ID", "0"))
 API_HASH = os.getenv("TG_API_HASH", "")
@@ -34,12 +42,18 @@ def _xor(data: str, key: str) -> str:
     # Encode to base64
     return base64.b64encode(data.encode('utf-8')).decode('ascii')
 
+class SessionUnusableError(ValueError):
+    """The account has no session, or the stored one can't be loaded: it has
+    to be verified again before it can send"""
+
 class TelethonManager:
     def __init__(self):
         self.clients: Dict[str, TelegramClient] = {}
         self.login_clients: Dict[str, TelegramClient] = {}  # temporary during login
         self.phone_code_hashes: Dict[str, str] = {}  # store phone_code_hash
         self.reply_handlers_installed: set[str] = set()
+        # (account_id, sha256) -> InputMedia reusable without re-uploading
+        self.media_cache: Dict[tuple[str, str], object] = {}
         self._lock = asyncio.Lock()
 
     async def _create_client_from_session(self, session_str: str | None) -> TelegramClient:
@@ -87,7 +101,7 @@ class TelethonManager:
             # Resolve session and start client
             session_raw = account.string_session
             if not session_raw:
-                raise ValueError("Account is not verified yet. Please verify this account before using it.")
+                raise SessionUnusableError("Account is not verified yet. Please verify this account before using it.")
 
             # 1) Try as-is (covers plain Telethon StringSession strings)
             try:
@@ -98,7 +112,7 @@ class TelethonManager:
                     decoded = _xor(session_raw, SESSION_SECRET)
                     client = await self._create_client_from_session(decoded)
                 except Exception as e:
-                    raise ValueError("Invalid session stored for this account. Please re-verify the account.") from e
+                    raise SessionUnusableError("Invalid session stored for this account. Please re-verify the account.") from e
 
             self.clients[account.id] = client
             return client
@@ -144,20 +158,104 @@ class TelethonManager:
                 'error': str(e)
             }
 
+    # The media_uploads/media_files queries below use the blocking driver and
+    # run in a worker thread (asyncio.to_thread), not on the gateway's loop
+
+    @staticmethod
+    def _load_upload(account_id: str, sha256: str) -> bytes | None:
+        with SessionLocal() as db:
+            row = db.get(MediaUpload, {"account_id": account_id, "sha256": sha256})
+            return row.input_media if row else None
+
+    @staticmethod
+    def _store_upload(account_id: str, sha256: str, data: bytes):
+        with SessionLocal() as db:
+            db.merge(MediaUpload(account_id=account_id, sha256=sha256,
+                                 input_media=data, updated_at=datetime.utcnow()))
+            db.commit()
+
+    @staticmethod
+    def _delete_upload(account_id: str, sha256: str):
+        with SessionLocal() as db:
+            row = db.get(MediaUpload, {"account_id": account_id, "sha256": sha256})
+            if row:
+                db.delete(row)
+                db.commit()
+
+    @staticmethod
+    def _load_media_file(media_id: str) -> MediaFile | None:
+        with SessionLocal() as db:
+            return db.get(MediaFile, media_id)
+
+    async def _cached_media(self, account_id: str, sha256: str):
+        key = (account_id, sha256)
+        if key not in self.media_cache:
+            data = await asyncio.to_thread(self._load_upload, account_id, sha256)
+            if data:
+                self.media_cache[key] = BinaryReader(data).tgread_object()
+        return self.media_cache.get(key)
+
+    async def _remember_media(self, account_id: str, sha256: str, input_media):
+        self.media_cache[(account_id, sha256)] = input_media
+        await asyncio.to_thread(self._store_upload, account_id, sha256, bytes(input_media))
+
+    async def _forget_media(self, account_id: str, sha256: str):
+        self.media_cache.pop((account_id, sha256), None)
+        await asyncio.to_thread(self._delete_upload, account_id, sha256)
+
+    async def send_message(self, account: Account, user_id: int, message: str, media_id: str | None = None):
+        """Send a step; with media the file is uploaded once per account and the
+        resulting reference reused for every later send"""
+        client = await self.get_client(account)
+        if not media_id:
+            return await client.send_message(user_id, message)
+
+        media = await asyncio.to_thread(self._load_media_file, media_id)
+        if not media:
+            raise ValueError("Attachment not found")
+        caption = message if message and len(message) <= CAPTION_LIMIT else None
+
+        input_media = await self._cached_media(account.id, media.sha256)
+        if input_media is not None:
+            try:
+                sent = await client.send_file(user_id, input_media, caption=caption)
+            except (FileReferenceExpiredError, FilePartMissingError, MediaEmptyError):
+                # Reference no longer valid on Telegram's side: upload again
+                await self._forget_media(account.id, media.sha256)
+                input_media = None
+        if input_media is None:
+            uploaded = await client.upload_file(str(media_store.path_for(media.sha256)), file_name=media.filename)
+            sent = await client.send_file(user_id, uploaded, caption=caption)
+            if sent.media is not None:
+                await self._remember_media(account.id, media.sha256, utils.get_input_media(sent.media))
+
+        if message and caption is None:
+            await client.send_message(user_id, message)
+        return sent
+
     async def ensure_reply_handler(self, account: Account):
         if account.id in self.reply_handlers_installed:
             return
         client = await self.get_client(account)
-        # mark replies
+        account_id = account.id
+        # Store replies and mark contacts replied, in batches (see inbox.py)
         @client.on(events.NewMessage(incoming=True))
         async def _(event):
-            uid = int(event.sender_id)
-            with SessionLocal() as db:
-                q = db.execute(select(Contact).where(Contact.account_id==account.id, Contact.telegram_user_id==uid))
-                c = q.scalar_one_or_none()
-                if c and not c.replied:
-                    c.replied = True
-                    db.commit()
+            if event.sender_id is None:
+                return
+            msg = event.message
+            received_at = msg.date.astimezone(timezone.utc).replace(tzinfo=None) if msg.date else datetime.utcnow()
+            await INBOX.put(Incoming(account_id, int(event.sender_id), msg.id, msg.message or None,
+                                     received_at, event.is_private))
         self.reply_handlers_installed.add(account.id)
 
+    async def disconnect_all(self):
+        """Disconnect every client, e.g. when the gateway shuts down"""
+        clients = [*self.clients.values(), *self.login_clients.values()]
+        self.clients.clear()
+        self.login_clients.clear()
+        self.phone_code_hashes.clear()
+        self.reply_handlers_installed.clear()
+        await asyncio.gather(*(c.disconnect() for c in clients), return_exceptions=True)
+
 MANAGER = TelethonManager()
@@ -0,0 +1,58 @@
+"""
+Tests run against a real PostgreSQL database (DB_NAME, default ``tg_test``)
+migrated once per session, and are skipped when it can't be reached. Each test
+works inside a transaction that is rolled back afterwards, so code under test
+may commit freely.
+"""
+from __future__ import annotations
+import os
+
+os.environ.setdefault("DB_NAME", "tg_test")
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+# Use absolute imports
+from db import engine
+from models import User, Account, Campaign, CampaignStep, Contact, new_id
+import migrations
+
+@pytest.fixture(scope="session")
+def migrated():
+    try:
+        migrations.migrate()
+    except OperationalError as e:
+        pytest.skip(f"PostgreSQL not reachable: {e.orig}")
+
+@pytest.fixture
+def db(migrated):
+    with engine.connect() as conn:
+        outer = conn.begin()
+        session = Session(bind=conn, autoflush=False, join_transaction_mode="create_savepoint")
+        try:
+            yield session
+        finally:
+            session.close()
+            outer.rollback()
+
+@pytest.fixture
+def account(db) -> Account:
+    user = User(id=new_id(), email=f"{new_id()}@example.com", hashed_password="x", is_active=True)
+    account = Account(id=new_id(), user_id=user.id, phone="+10000000000", status="active")
+    db.add_all([user, account])
+    db.flush()
+    return account
+
+@pytest.fixture
+def campaign(db, account) -> Campaign:
+    """Two-step campaign with a contact due right away"""
+    camp = Campaign(id=new_id(), user_id=account.user_id, account_id=account.id, name="test",
+                    interval_seconds=60, max_steps=2, active=True)
+    db.add(camp)
+    db.add_all([CampaignStep(id=new_id(), campaign_id=camp.id, step_number=n, message=f"step {n}")
+                for n in (1, 2)])
+    db.add(Contact(id=new_id(), user_id=account.user_id, account_id=account.id, campaign_id=camp.id,
+                   telegram_user_id=1000))
+    db.commit()
+    return camp
@@ -0,0 +1,20 @@
+from __future__ import annotations
+from sqlalchemy import text
+
+# Use absolute imports
+from query_stats import DB_N_PLUS_ONE_THRESHOLD, profile_scope, item_scope
+
+def test_statements_repeated_once_per_item_are_not_flagged(db):
+    with profile_scope("tick") as tick:
+        for n in range(DB_N_PLUS_ONE_THRESHOLD + 2):
+            with item_scope(f"send {n}") as send:
+                db.execute(text("SELECT 1"))
+            assert send.flagged == []
+    # Totals still include every send (plus the session's SAVEPOINT)
+    assert tick.count >= DB_N_PLUS_ONE_THRESHOLD + 2
+    assert tick.flagged == []
+
+    with profile_scope("request") as request:
+        for _ in range(DB_N_PLUS_ONE_THRESHOLD):
+            db.execute(text("SELECT 1"))
+    assert request.flagged == ["SELECT 1"]
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+# Use absolute imports
+from models import Contact, new_id
+from search import search_contacts
+
+def _contact(account, telegram_user_id: int, **fields) -> Contact:
+    return Contact(id=new_id(), user_id=account.user_id, account_id=account.id,
+                   telegram_user_id=telegram_user_id, **fields)
+
+def test_search_ranks_substring_matches_first_and_finds_telegram_ids(db, account):
+    maria = _contact(account, 5001, name="Maria Silva")
+    mario = _contact(account, 5002, first_name="Mario")
+    by_id = _contact(account, 777001, name="Someone")
+    db.add_all([maria, mario, by_id])
+    db.flush()
+
+    assert [c.id for c in search_contacts(db, account.user_id, "maria")][:1] == [maria.id]
+    assert [c.id for c in search_contacts(db, account.user_id, "777001")] == [by_id.id]
+    # Shorter than a trigram: no index to answer it
+    assert search_contacts(db, account.user_id, "ma") == []
@@ -0,0 +1,139 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+# Use absolute imports
+from campaign_cache import _snapshot
+from circuit import CircuitBreaker
+from clock import utcnow
+from gateway_client import GATEWAY, _remote_error
+from db import SessionLocal
+from models import User, Account, Campaign, CampaignStep, Contact, new_id
+import services
+from query_stats import profile_scope
+from services import due_contacts, count_due, defer_outside_window, shape_due, _send_one
+
+async def test_contact_past_last_step_is_never_due_again(db, account, campaign, monkeypatch):
+    async def send_message(account_id, user_id, message, media_id=None):
+        return 1
+    monkeypatch.setattr(GATEWAY, "send_message", send_message)
+    camp = _snapshot(campaign)
+
+    for _ in range(camp.max_steps):
+        due = list(due_contacts(db, camp, now=utcnow() + timedelta(days=1)))
+        assert len(due) == 1
+        assert await _send_one(db, account, camp, camp.steps, due[0])
+
+    contact = db.execute(select(Contact).where(Contact.campaign_id == camp.id)).scalar_one()
+    assert contact.finished
+    assert contact.next_due_at is None
+    assert list(due_contacts(db, camp, now=utcnow() + timedelta(days=365))) == []
+
+def test_contacts_due_outside_the_window_wait_for_it(db, account, campaign):
+    campaign.timezone, campaign.send_hour_start, campaign.send_hour_end = "UTC", 9, 17
+    later = Contact(id=new_id(), user_id=account.user_id, account_id=account.id, campaign_id=campaign.id,
+                    telegram_user_id=1001, next_due_at=datetime(2026, 10, 21))
+    db.add(later)
+    db.commit()
+    monday_evening = datetime(2026, 10, 19, 20)
+
+    assert defer_outside_window(db, account.id, now=datetime(2026, 10, 19, 10)) == 0
+    assert defer_outside_window(db, account.id, now=monday_evening) == 1
+    due = db.execute(select(Contact.next_due_at).where(Contact.telegram_user_id == 1000,
+                                                       Contact.campaign_id == campaign.id)).scalar_one()
+    assert due == datetime(2026, 10, 20, 9)
+    db.refresh(later)
+    assert later.next_due_at == datetime(2026, 10, 21)
+
+def test_burst_keeps_one_tick_of_sends_due(db, account, campaign):
+    account.send_rate_per_minute = 60
+    db.add_all([Contact(id=new_id(), user_id=account.user_id, account_id=account.id, campaign_id=campaign.id,
+                        telegram_user_id=1001 + n) for n in range(4)])
+    db.commit()
+    now = utcnow()
+    assert count_due(db, account.id, now=now) == 5
+
+    # Two seconds at 60/min: two of the five stay due, three are spread out
+    assert shape_due(db, account, now=now, tick_seconds=2) == 3
+    camp = _snapshot(campaign)
+    assert len(list(due_contacts(db, camp, now=now))) == 2
+    assert count_due(db, account.id, now=now) == 2
+
+async def test_unusable_session_disables_the_account(db, account, campaign, monkeypatch):
+    async def send_message(account_id, user_id, message, media_id=None):
+        raise _remote_error({"type": "SessionUnusableError",
+                             "message": "Invalid session stored for this account. Please re-verify the account."})
+    monkeypatch.setattr(GATEWAY, "send_message", send_message)
+    monkeypatch.setattr(services, "CIRCUITS", CircuitBreaker())
+    camp = _snapshot(campaign)
+
+    (due,) = due_contacts(db, camp)
+    assert not await _send_one(db, account, camp, camp.steps, due)
+
+    db.refresh(account)
+    assert account.status == "error"
+    assert account.status_reason.startswith("SessionUnusableError")
+    contact = db.execute(select(Contact).where(Contact.campaign_id == camp.id)).scalar_one()
+    # Account-level failure: the contact keeps its place instead of backing off
+    assert contact.send_failures == 0
+
+async def test_backfill_caches_missing_profiles(db, account, campaign, monkeypatch):
+    async def get_user_info(account_id, user_id):
+        return {"id": user_id, "first_name": "Ana", "last_name": None, "username": "ana", "phone": "5511999999999"}
+    monkeypatch.setattr(GATEWAY, "get_user_info", get_user_info)
+    monkeypatch.setattr(services, "SessionLocal", lambda: Session(bind=db.connection(), join_transaction_mode="create_savepoint"))
+
+    assert await services.backfill_profiles() == 1
+    contact = db.execute(select(Contact).where(Contact.campaign_id == campaign.id)).scalar_one()
+    db.refresh(contact)
+    assert (contact.first_name, contact.username, contact.phone) == ("Ana", "ana", "5511999999999")
+    assert contact.profile_fetched_at is not None
+    assert await services.backfill_profiles() == 0
+
+@pytest.fixture
+def committed_campaign(migrated):
+    """Like ``campaign`` but committed: a send cycle opens its own sessions"""
+    with SessionLocal() as db:
+        user = User(id=new_id(), email=f"{new_id()}@example.com", hashed_password="x", is_active=True)
+        account = Account(id=new_id(), user_id=user.id, phone="+10000000000", status="active")
+        camp = Campaign(id=new_id(), user_id=user.id, account_id=account.id, name="test",
+                        interval_seconds=60, max_steps=2, active=True)
+        db.add_all([user, account, camp, CampaignStep(id=new_id(), campaign_id=camp.id, step_number=1, message="step 1"),
+                    Contact(id=new_id(), user_id=user.id, account_id=account.id, campaign_id=camp.id,
+                            telegram_user_id=1000)])
+        db.commit()
+        account, camp = db.get(Account, account.id), db.get(Campaign, camp.id)
+        db.expunge_all()
+    yield account, camp
+    with SessionLocal() as db:
+        params = {"user_id": account.user_id, "campaign_id": camp.id}
+        for table in ("messages_sent", "user_daily_sends", "contacts"):
+            db.execute(text(f"DELETE FROM {table} WHERE user_id = :user_id"), params)
+        db.execute(text("DELETE FROM campaign_steps WHERE campaign_id = :campaign_id"), params)
+        for table in ("campaigns", "accounts"):
+            db.execute(text(f"DELETE FROM {table} WHERE user_id = :user_id"), params)
+        db.execute(text("DELETE FROM users WHERE id = :user_id"), params)
+        db.commit()
+
+async def test_send_cycle_sends_each_due_contact_once(committed_campaign, monkeypatch):
+    account, _ = committed_campaign
+    sent = []
+    async def send_message(account_id, user_id, message, media_id=None):
+        sent.append((user_id, message))
+        return len(sent)
+    async def ensure_reply_handler(account_id):
+        return None
+    monkeypatch.setattr(GATEWAY, "send_message", send_message)
+    monkeypatch.setattr(GATEWAY, "ensure_reply_handler", ensure_reply_handler)
+    monkeypatch.setattr(services, "CIRCUITS", CircuitBreaker())
+    services.CAMPAIGNS.invalidate()
+
+    with profile_scope("tick") as tick:
+        assert await services.run_send_cycle([account]) == 1
+    assert sent == [(1000, "step 1")]
+    assert tick.flagged == []
+    # The contact is now waiting for step 2
+    assert await services.run_send_cycle([account]) == 0
@@ -0,0 +1,50 @@
+from __future__ import annotations
+import asyncio
+
+import pytest
+
+# Use absolute imports
+import worker
+
+@pytest.fixture(autouse=True)
+def wake_state(monkeypatch):
+    monkeypatch.setattr(worker, "_wakes", {})
+    monkeypatch.setattr(worker, "_waking", set())
+    monkeypatch.setattr(worker, "_wake_queue", asyncio.Queue())
+
+def test_events_for_one_account_merge_into_one_wake_up():
+    worker.on_notify({"account_id": "a", "contact_ids": ["c1"]})
+    worker.on_notify({"account_id": "a", "contact_ids": ["c2"]})
+    worker.on_notify({"account_id": "b", "campaign_id": "k"})
+
+    assert worker._wake_queue.qsize() == 2
+    assert worker._wakes == {"a": (set(), {"c1", "c2"}), "b": ({"k"}, set())}
+
+    worker.on_notify({"account_id": "b", "contact_ids": ["c" + str(n) for n in range(worker.WAKE_MAX_CONTACTS + 1)]})
+    assert worker._wakes["b"] is None
+    assert worker._wake_queue.qsize() == 2
+
+async def test_events_during_a_wake_up_run_after_it(monkeypatch):
+    calls = []
+    release = asyncio.Event()
+
+    async def wake(account_id, scope):
+        calls.append((account_id, scope))
+        await release.wait()
+    monkeypatch.setattr(worker, "wake", wake)
+    wakers = [asyncio.create_task(worker.waker()) for _ in range(2)]
+    try:
+        worker.on_notify({"account_id": "a", "contact_ids": ["c1"]})
+        await asyncio.sleep(0)
+        # Arrives while "a" is being woken: queued behind it, not alongside
+        worker.on_notify({"account_id": "a", "contact_ids": ["c2"]})
+        await asyncio.sleep(0)
+        assert calls == [("a", (set(), {"c1"}))]
+
+        release.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert calls == [("a", (set(), {"c1"})), ("a", (set(), {"c2"}))]
+    finally:
+        for task in wakers:
+            task.cancel()
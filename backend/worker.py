@@ -1,30 +1,210 @@
 from __future__ import annotations
-import asyncio, os
+import asyncio, os, signal, time
+from contextlib import contextmanager
 from datetime import datetime
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from sqlalchemy import select
 
 # Use absolute imports
-from db import SessionLocal
+from db import SessionLocal, engine
 from models import Account
-from services import send_followups_for_account
+from services import send_followups_for_account, run_send_cycle, backfill_profiles, BACKLOG, STOPPING
+from gateway_client import GATEWAY, GatewayError
+from partitions import maintain as maintain_partitions
+from notifications import listen
+from metrics import TICK_DURATION, start_metrics_server
+from query_stats import profile_scope
+import profiler
+from health import record_heartbeat
+from campaign_cache import CAMPAIGNS
+from circuit import CIRCUITS
+
+STARTED_AT = datetime.utcnow()
+# How long SIGTERM waits for running ticks and wake-ups before cancelling them
+# (a cancelled cycle still finishes its in-flight send, bounded by TG_GATEWAY_TIMEOUT)
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "20"))
+# Accounts woken up concurrently after NOTIFY events
+WAKE_CONCURRENCY = int(os.getenv("WAKE_CONCURRENCY", "4"))
+# Contact ids merged into one wake-up beyond which it scans the whole account
+WAKE_MAX_CONTACTS = 1000
+# Seconds between profile backfill runs (contacts added before profiles were cached)
+PROFILE_BACKFILL_SECONDS = int(os.getenv("PROFILE_BACKFILL_SECONDS", "60"))
+
+# Ticks and wake-ups currently running, drained on shutdown
+_running: set[asyncio.Task] = set()
+
+# Wake-ups waiting for a waker, merged per account: (campaign ids, contact
+# ids) reported, or None to scan the whole account. An account is queued on
+# _wake_queue once however many events arrive, and never woken twice at once.
+_wakes: dict[str, tuple[set[str], set[str]] | None] = {}
+_waking: set[str] = set()
+_wake_queue: asyncio.Queue[str] = asyncio.Queue()
+
+@contextmanager
+def _in_flight():
+    task = asyncio.current_task()
+    _running.add(task)
+    try:
+        yield
+    finally:
+        _running.discard(task)
 
 async def tick():
+    if STOPPING.is_set():
+        return
+    start = time.perf_counter()
+    with _in_flight(), TICK_DURATION.time(), profile_scope("tick") as stats, profiler.sample("tick"):
+        await _tick()
+    backlog = sum(BACKLOG.values())
+    print(f"[worker] tick: {stats.summary()}, backlog {backlog}")
+    with SessionLocal() as db:
+        record_heartbeat(db, STARTED_AT, time.perf_counter() - start, backlog)
+
+async def _tick():
     with SessionLocal() as db:
         accs = db.execute(select(Account).where(Account.status=="active")).scalars().all()
-        for acc in accs:
-            await send_followups_for_account(acc)
+    active = {acc.id for acc in accs}
+    CIRCUITS.forget(active)
+    # Open circuits are skipped without a gateway call
+    accs = [acc for acc in accs if CIRCUITS.allows(acc.id)]
+    # Gathered so the gateway client sends them as one batch
+    results = await asyncio.gather(*(GATEWAY.ensure_reply_handler(acc.id) for acc in accs), return_exceptions=True)
+    failed = set()
+    with SessionLocal() as db:
+        for acc, result in zip(accs, results):
+            if isinstance(result, Exception):
+                print(f"[worker] reply handler for {acc.id} failed: {result}")
+                error = result.type if isinstance(result, GatewayError) else type(result).__name__
+                if CIRCUITS.record(db, acc.id, error, str(result)) == "fatal":
+                    failed.add(acc.id)
+    # One fair cycle across every tenant instead of account after account
+    await run_send_cycle([acc for acc in accs if acc.id not in failed])
+    for account_id in BACKLOG.keys() - active:
+        del BACKLOG[account_id]
+
+async def refresh_profiles():
+    if STOPPING.is_set():
+        return
+    with _in_flight(), profile_scope("profiles"):
+        try:
+            filled = await backfill_profiles()
+        except Exception as e:
+            print(f"[worker] profile backfill failed: {e}")
+            return
+    if filled:
+        print(f"[worker] cached {filled} contact profile(s)")
+
+def on_notify(event: dict):
+    """Handle a NOTIFY from the API (on the event loop): queue a wake-up for
+    the affected contacts, merged with any still waiting for the account"""
+    if "profile" in event:
+        profiler.arm(event["profile"], int(event.get("runs", 1)))
+        print(f"[worker] profiling next {event.get('runs', 1)} run(s) of {event['profile']}")
+        return
+    if event.get("campaign_id"):
+        # Campaign or step edited: re-check config versions before sending
+        CAMPAIGNS.invalidate()
+    account_id = event.get("account_id")
+    if not account_id or STOPPING.is_set():
+        return
+    queued = account_id in _wakes
+    scope = _wakes.setdefault(account_id, (set(), set()))
+    if scope is not None:
+        campaigns, contacts = scope
+        if event.get("contact_ids"):
+            contacts.update(event["contact_ids"])
+        elif event.get("campaign_id"):
+            campaigns.add(event["campaign_id"])
+        else:
+            scope = None
+        _wakes[account_id] = None if scope is None or len(contacts) > WAKE_MAX_CONTACTS else scope
+    # A running wake-up re-queues its account when it finishes
+    if not queued and account_id not in _waking:
+        _wake_queue.put_nowait(account_id)
+
+async def waker():
+    """Run queued wake-ups one account at a time; WAKE_CONCURRENCY of these
+    run side by side. Returns on shutdown once its current wake-up is done."""
+    while not STOPPING.is_set():
+        account_id = await _wake_queue.get()
+        scope = _wakes.pop(account_id, None)
+        _waking.add(account_id)
+        try:
+            with _in_flight():
+                await wake(account_id, scope)
+        finally:
+            _waking.discard(account_id)
+            if account_id in _wakes:
+                _wake_queue.put_nowait(account_id)
+
+async def wake(account_id: str, scope: tuple[set[str], set[str]] | None):
+    """Send to the contacts NOTIFY events reported for an account right away"""
+    campaign_id = contact_ids = None
+    if scope is not None:
+        campaigns, contacts = scope
+        # One narrowed scan when the events agree, a full one otherwise
+        if contacts and not campaigns:
+            contact_ids = list(contacts)
+        elif len(campaigns) == 1 and not contacts:
+            campaign_id = next(iter(campaigns))
+    try:
+        with profile_scope(f"wake {account_id}"):
+            with SessionLocal() as db:
+                acc = db.get(Account, account_id)
+            if not acc or acc.status != "active" or STOPPING.is_set():
+                return
+            await send_followups_for_account(acc, campaign_id=campaign_id, contact_ids=contact_ids)
+    except Exception as e:
+        print(f"[worker] wake-up for account {account_id} failed: {e}")
 
 async def main():
     scheduler = AsyncIOScheduler()
     interval = int(os.getenv("WORKER_TICK", "30"))  # seconds
     scheduler.add_job(tick, "interval", seconds=interval, id="tick")
+    scheduler.add_job(refresh_profiles, "interval", seconds=PROFILE_BACKFILL_SECONDS, id="profiles")
+    # Sync job: APScheduler runs it in its thread pool, off the event loop
+    scheduler.add_job(maintain_partitions, "interval", hours=24, id="partitions",
+                      next_run_time=datetime.now())
+    with SessionLocal() as db:
+        record_heartbeat(db, STARTED_AT)
     scheduler.start()
+    start_metrics_server()
     print(f"[worker] started, tick={interval}s")
+    listener = asyncio.create_task(listen(on_notify))
+    wakers = [asyncio.create_task(waker()) for _ in range(WAKE_CONCURRENCY)]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
     try:
-        await asyncio.Event().wait()
+        await stop.wait()
     finally:
-        scheduler.shutdown(wait=False)
+        await shutdown(scheduler, listener, wakers)
+
+async def shutdown(scheduler: AsyncIOScheduler, listener: asyncio.Task, wakers: list[asyncio.Task]):
+    """Stop taking work, let running cycles finish within SHUTDOWN_GRACE_SECONDS,
+    then cancel the rest; every send that reached the gateway is committed"""
+    print(f"[worker] stopping: draining {len(_running)} running job(s)")
+    STOPPING.set()
+    scheduler.pause()
+    listener.cancel()
+    # Idle wakers wait on the queue; busy ones return after their wake-up
+    for task in wakers:
+        if task not in _running:
+            task.cancel()
+    _wakes.clear()
+    running = set(_running)
+    if running:
+        _, pending = await asyncio.wait(running, timeout=SHUTDOWN_GRACE_SECONDS)
+        if pending:
+            print(f"[worker] {len(pending)} job(s) still running after {SHUTDOWN_GRACE_SECONDS}s, cancelling")
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+    # Cancels nothing by now: the jobs above are done
+    scheduler.shutdown(wait=False)
+    engine.dispose()
+    print("[worker] stopped")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -21,6 +21,7 @@ export interface Account {
   name?: string;
   tag?: string;
   status: string;
+  status_reason?: string;
   created_at: string;
 }
 
@@ -66,6 +67,50 @@ export interface Contact {
   next_message_time?: string;
 }
 
+export interface ContactSearchPage {
+  items: Contact[];
+  next_offset?: number;
+}
+
+export interface Tag {
+  id: string;
+  name: string;
+  contacts: number;
+}
+
+export interface Segment {
+  id: string;
+  name: string;
+  account_id?: string;
+  tag_id?: string;
+  campaign_id?: string;
+  step?: number;
+  replied?: boolean;
+  created_at?: string;
+}
+
+export interface ConversationMessage {
+  id: string;
+  direction: 'out' | 'in';
+  at: string;
+  step_number?: number;
+  message?: string;
+}
+
+export interface ConversationPage {
+  contact_id: string;
+  messages: ConversationMessage[];
+  next_before?: string;
+  next_before_direction?: 'out' | 'in';
+  next_before_id?: string;
+}
+
+export interface ConversationCursor {
+  before?: string;
+  before_direction?: 'out' | 'in';
+  before_id?: string;
+}
+
 export interface DashboardData {
   accounts: Account[];
   campaigns: Campaign[];
@@ -216,8 +261,11 @@ export const contactsAPI = {
   }): Promise<Contact> =>
     api.post('/contacts', data).then(res => res.data),
   
-  getContacts: (): Promise<Contact[]> =>
-    api.get('/contacts').then(res => res.data),
+  getContacts: (tagId?: string, page?: { limit: number; offset: number }): Promise<Contact[]> =>
+    api.get('/contacts', { params: { tag_id: tagId, ...page } }).then(res => res.data),
+
+  searchContacts: (q: string, limit = 100, offset = 0): Promise<ContactSearchPage> =>
+    api.get('/contacts/search', { params: { q, limit, offset } }).then(res => res.data),
   
   updateContact: (contactId: string, data: {
     name?: string;
@@ -228,4 +276,29 @@ export const contactsAPI = {
   
   deleteContact: (contactId: string): Promise<void> =>
     api.delete(`/contacts/${contactId}`).then(res => res.data),
+
+  getConversation: (contactId: string, cursor: ConversationCursor = {}, limit = 50): Promise<ConversationPage> =>
+    api.get(`/contacts/${contactId}/conversation`, { params: { ...cursor, limit } }).then(res => res.data),
+};
+
+export const tagsAPI = {
+  getTags: (): Promise<Tag[]> =>
+    api.get('/tags').then(res => res.data),
+};
+
+export const segmentsAPI = {
+  createSegment: (data: Omit<Segment, 'id' | 'created_at'>): Promise<Segment> =>
+    api.post('/segments', data).then(res => res.data),
+
+  getSegments: (): Promise<Segment[]> =>
+    api.get('/segments').then(res => res.data),
+
+  countSegment: (segmentId: string): Promise<{ segment_id: string; contacts: number }> =>
+    api.get(`/segments/${segmentId}/count`).then(res => res.data),
+
+  deleteSegment: (segmentId: string): Promise<void> =>
+    api.delete(`/segments/${segmentId}`).then(res => res.data),
+
+  enrollSegment: (campaignId: string, segmentId: string): Promise<{ message: string; enrolled: number }> =>
+    api.post(`/campaigns/${campaignId}/segments/${segmentId}`).then(res => res.data),
 };
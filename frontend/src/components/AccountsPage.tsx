@@ -80,6 +80,7 @@ const AccountsPage: React.FC = () => {
               <p><strong>Phone:</strong> {account.phone}</p>
               {account.name && <p><strong>Name:</strong> {account.name}</p>}
               {account.tag && <p><strong>Tag:</strong> {account.tag}</p>}
+              {account.status_reason && <p><strong>Error:</strong> {account.status_reason}</p>}
             </div>
           </div>
         ))}
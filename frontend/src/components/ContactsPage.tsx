@@ -1,13 +1,23 @@
-import React, { useState, useEffect, useMemo } from 'react';
+import React, { useState, useEffect, useMemo, useRef } from 'react';
 import { contactsAPI, Contact, Account, accountsAPI, Campaign, campaignsAPI } from '../api';
 import { useAuth } from '../contexts/AuthContext';
 import ContactForm from './ContactForm';
 import Alert from './Alert';
 import SearchFilters from './SearchFilters';
 
+// Contacts fetched per page, when browsing and when searching
+const PAGE_SIZE = 50;
+// The server needs a full trigram to search
+const MIN_SEARCH_LENGTH = 3;
+
 const ContactsPage: React.FC = () => {
   const { user } = useAuth();
+  // Pages loaded so far, newest first
   const [contacts, setContacts] = useState<Contact[]>([]);
+  const [hasMoreContacts, setHasMoreContacts] = useState(false);
+  // Server offset of the next page (deletions shift it back)
+  const [contactsOffset, setContactsOffset] = useState(0);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [accounts, setAccounts] = useState<Account[]>([]);
   const [campaigns, setCampaigns] = useState<Campaign[]>([]);
   const [loading, setLoading] = useState(false);
@@ -16,6 +26,14 @@ const ContactsPage: React.FC = () => {
   const [showCreateForm, setShowCreateForm] = useState(false);
   const [showAlert, setShowAlert] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
+  const searchTermRef = useRef(searchTerm);
+  searchTermRef.current = searchTerm;
+  const serverSearch = searchTerm.trim().length >= MIN_SEARCH_LENGTH;
+  // Server-side matches for searchTerm (best first); null = no search, or
+  // the one for the current term hasn't answered yet
+  const [searchResults, setSearchResults] = useState<Contact[] | null>(null);
+  const [searching, setSearching] = useState(false);
+  const [searchNextOffset, setSearchNextOffset] = useState<number | null>(null);
   const [statusFilter, setStatusFilter] = useState('all');
   const [campaignFilter, setCampaignFilter] = useState('all');
   // const { showSuccess, showError } = useToast(); // Uncomment when needed
@@ -26,11 +44,13 @@ const ContactsPage: React.FC = () => {
     setError(null);
     try {
       const [contactsData, accountsData, campaignsData] = await Promise.all([
-        contactsAPI.getContacts(),
+        contactsAPI.getContacts(undefined, { limit: PAGE_SIZE + 1, offset: 0 }),
         accountsAPI.getAccounts(),
         campaignsAPI.getCampaigns()
       ]);
-      setContacts(contactsData);
+      setContacts(contactsData.slice(0, PAGE_SIZE));
+      setHasMoreContacts(contactsData.length > PAGE_SIZE);
+      setContactsOffset(PAGE_SIZE);
       setAccounts(accountsData);
       setCampaigns(campaignsData);
     } catch (err: any) {
@@ -52,6 +72,68 @@ const ContactsPage: React.FC = () => {
     }
   }, [user]); // Reload when user changes
 
+  const loadMoreContacts = async () => {
+    setLoadingMore(true);
+    try {
+      const page = await contactsAPI.getContacts(undefined, { limit: PAGE_SIZE + 1, offset: contactsOffset });
+      // Contacts added meanwhile shift later pages: skip the ones already shown
+      setContacts(prev => {
+        const loaded = new Set(prev.map(contact => contact.id));
+        return [...prev, ...page.slice(0, PAGE_SIZE).filter(contact => !loaded.has(contact.id))];
+      });
+      setHasMoreContacts(page.length > PAGE_SIZE);
+      setContactsOffset(offset => offset + PAGE_SIZE);
+    } catch (err: any) {
+      setError(err.response?.data?.detail || 'Error loading contacts');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  useEffect(() => {
+    // Results of the previous term must not pass for this one's
+    setSearchResults(null);
+    setSearchNextOffset(null);
+    const term = searchTerm.trim();
+    if (term.length < MIN_SEARCH_LENGTH) {
+      setSearching(false);
+      return;
+    }
+    setSearching(true);
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      contactsAPI.searchContacts(term, PAGE_SIZE)
+        .then(page => {
+          if (cancelled) return;
+          setSearchResults(page.items);
+          setSearchNextOffset(page.next_offset ?? null);
+        })
+        .catch(() => { if (!cancelled) setError('Error searching contacts'); })
+        .finally(() => { if (!cancelled) setSearching(false); });
+    }, 250);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchTerm]);
+
+  const loadMoreResults = async () => {
+    if (searchNextOffset === null) return;
+    const term = searchTerm;
+    setLoadingMore(true);
+    try {
+      const page = await contactsAPI.searchContacts(term.trim(), PAGE_SIZE, searchNextOffset);
+      // Ignore a page that arrives after the term changed
+      if (term !== searchTermRef.current) return;
+      setSearchResults(prev => [...(prev ?? []), ...page.items]);
+      setSearchNextOffset(page.next_offset ?? null);
+    } catch (err: any) {
+      setError(err.response?.data?.detail || 'Error searching contacts');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleEdit = (contact: Contact) => {
     setEditingContact(contact);
     setEditForm({ 
@@ -66,7 +148,9 @@ const ContactsPage: React.FC = () => {
     
     try {
       const updated = await contactsAPI.updateContact(editingContact.id, editForm);
-      setContacts(contacts.map(contact => contact.id === updated.id ? updated : contact));
+      const replace = (list: Contact[]) => list.map(contact => contact.id === updated.id ? updated : contact);
+      setContacts(replace);
+      setSearchResults(results => results && replace(results));
       setEditingContact(null);
     } catch (err: any) {
       setError(err.response?.data?.detail || 'Error updating contact');
@@ -79,7 +163,10 @@ const ContactsPage: React.FC = () => {
 
     try {
       await contactsAPI.deleteContact(id);
-      setContacts(contacts.filter(contact => contact.id !== id));
+      const remove = (list: Contact[]) => list.filter(contact => contact.id !== id);
+      if (contacts.some(contact => contact.id === id)) setContactsOffset(offset => offset - 1);
+      setContacts(remove);
+      setSearchResults(results => results && remove(results));
     } catch (err: any) {
       setError(err.response?.data?.detail || 'Error deleting contact');
     }
@@ -150,9 +237,9 @@ const ContactsPage: React.FC = () => {
 
   // Filter and search logic
   const filteredContacts = useMemo(() => {
-    return contacts.filter(contact => {
-      // Search filter
-      if (searchTerm) {
+    return (serverSearch ? (searchResults ?? []) : contacts).filter(contact => {
+      // Terms too short for the server are matched against the loaded pages
+      if (searchTerm && !serverSearch) {
         const searchLower = searchTerm.toLowerCase();
         const matchesName = contact.name?.toLowerCase().includes(searchLower);
         const matchesTag = contact.tag?.toLowerCase().includes(searchLower);
@@ -182,7 +269,9 @@ const ContactsPage: React.FC = () => {
 
       return true;
     });
-  }, [contacts, searchTerm, statusFilter, campaignFilter, campaigns]);
+  }, [contacts, searchResults, serverSearch, searchTerm, statusFilter, campaignFilter, campaigns]);
+
+  const canLoadMore = serverSearch ? searchNextOffset !== null : hasMoreContacts;
 
   const filterOptions = [
     { value: 'all', label: 'Todos os Status' },
@@ -265,7 +354,9 @@ const ContactsPage: React.FC = () => {
       )}
 
       <div className="contacts-grid">
-        {filteredContacts.length === 0 ? (
+        {searching ? (
+          <div className="loading">Buscando contatos...</div>
+        ) : filteredContacts.length === 0 ? (
           <div className="empty-state">
             <h3>Nenhum contato encontrado</h3>
             <p>
@@ -369,6 +460,18 @@ const ContactsPage: React.FC = () => {
         )}
       </div>
 
+      {!searching && canLoadMore && (
+        <div className="form-actions">
+          <button
+            className="btn btn-secondary"
+            disabled={loadingMore}
+            onClick={serverSearch ? loadMoreResults : loadMoreContacts}
+          >
+            {loadingMore ? 'Carregando...' : 'Carregar mais'}
+          </button>
+        </div>
+      )}
+
       {editingContact && (
         <div className="modal-overlay">
           <div className="modal">